@@ -10,3 +10,4 @@ admin.site.register(DoctorProfiles)
 admin.site.register(DoctorAvailability)
 admin.site.register(FavoriteDoctors)
 admin.site.register(Notifications)
+admin.site.register(Task)
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class AppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app'
+
+    def ready(self):
+        # Connect the cache invalidation handlers
+        from . import signals  # noqa: F401
+        # Register the background tasks, workers don't load the views
+        from . import notifications, prescription_pdf, qr  # noqa: F401
+        # Register the SQLite JSON functions before the first connection
+        from . import prescription_filters  # noqa: F401
@@ -0,0 +1,156 @@
+"""
+DRF authentication backed by Supabase access tokens
+
+SupabaseAuthentication verifies the bearer token (see app.utils.verify_token)
+and sets request.user to a Principal. The Principal loads the caller's
+Profiles row and DoctorProfiles row (if any) with a single joined query the
+first time either is needed, and keeps them for the rest of the request.
+"""
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+
+from .models import Profiles, DoctorProfiles
+from .utils import AuthServiceUnavailable, verify_token
+
+PROFILE_FIELDS = [field.attname for field in Profiles._meta.concrete_fields]
+# user_id is the profile id, no need to select it twice
+DOCTOR_FIELDS = [field.attname for field in DoctorProfiles._meta.concrete_fields if field.attname != 'user_id']
+
+
+def load_profiles(user_id):
+    """
+    Load a user's profile and doctor profile with one LEFT JOIN query
+
+    Args:
+        user_id (str): Supabase user id (= Profiles.id)
+
+    Returns:
+        tuple: (Profiles or None, DoctorProfiles or None)
+    """
+    queryset = Profiles.objects.filter(id=user_id)
+    row = queryset.values(
+        *PROFILE_FIELDS,
+        *(f'doctor_profiles__{name}' for name in DOCTOR_FIELDS)
+    ).first()
+    if row is None:
+        return None, None
+
+    profile = Profiles.from_db(queryset.db, PROFILE_FIELDS, [row[name] for name in PROFILE_FIELDS])
+
+    doctor_profile = None
+    if row['doctor_profiles__id'] is not None:
+        doctor_profile = DoctorProfiles.from_db(
+            queryset.db,
+            DOCTOR_FIELDS + ['user_id'],
+            [row[f'doctor_profiles__{name}'] for name in DOCTOR_FIELDS] + [profile.id]
+        )
+        doctor_profile.user = profile
+
+    return profile, doctor_profile
+
+
+class Principal:
+    """The authenticated caller of a request"""
+
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, user_data):
+        self.user_data = user_data
+        self.user_id = user_data['id']
+        self._loaded = False
+        self._profile = None
+        self._doctor_profile = None
+
+    def _load(self):
+        if not self._loaded:
+            self._profile, self._doctor_profile = load_profiles(self.user_id)
+            self._loaded = True
+
+    @property
+    def id(self):
+        return self.user_id
+
+    @property
+    def profile(self):
+        """Profiles row of the caller, None if it doesn't exist"""
+        self._load()
+        return self._profile
+
+    @property
+    def doctor_profile(self):
+        """DoctorProfiles row of the caller, None if they have none"""
+        self._load()
+        return self._doctor_profile
+
+    @property
+    def user_type(self):
+        return self.profile.user_type if self.profile else None
+
+    @property
+    def is_doctor(self):
+        return self.user_type == Profiles.UserType.DOCTOR
+
+    @property
+    def is_patient(self):
+        return self.user_type == Profiles.UserType.PATIENT
+
+    def __str__(self):
+        return str(self.user_id)
+
+
+class SupabaseAuthentication(BaseAuthentication):
+    """
+    Authenticate requests carrying a Supabase access token
+
+    Invalid or missing tokens leave the request anonymous instead of failing
+    it, so each view keeps deciding whether it needs a caller. When the token
+    can't be checked because Supabase is down, the error is kept on the
+    request and raised by get_principal, so only views needing a caller fail.
+    """
+
+    def authenticate(self, request):
+        auth_header = get_authorization_header(request).decode('latin-1')
+        if not auth_header:
+            return None
+
+        # Extract token from auth header
+        if ' ' in auth_header:
+            _, token = auth_header.split(' ', 1)
+        else:
+            token = auth_header
+
+        try:
+            user_data = verify_token(token)
+        except AuthServiceUnavailable as e:
+            request._auth_error = e
+            return None
+
+        if not user_data or 'id' not in user_data:
+            return None
+        return Principal(user_data), token
+
+    def authenticate_header(self, request):
+        return 'Bearer'
+
+
+def get_principal(request):
+    """
+    Get the authenticated caller of a DRF request
+
+    Args:
+        request: DRF request object
+
+    Returns:
+        Principal or None: None if the request has no valid token
+
+    Raises:
+        AuthServiceUnavailable: The token couldn't be checked
+    """
+    user = getattr(request, 'user', None)
+    if isinstance(user, Principal):
+        return user
+
+    error = getattr(request, '_auth_error', None)
+    if error is not None:
+        raise error
+    return None
@@ -0,0 +1,479 @@
+"""
+Benchmarks, not part of the regular suite
+
+    python manage.py test app.benchmarks
+
+Each prints its numbers. Those touching Postgres features (GIN, SKIP LOCKED)
+skip themselves on SQLite; run them with TEST_POSTGRES_HOST set.
+"""
+import base64
+import random
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Appointments, DoctorAvailability, DoctorProfiles, Prescriptions, Profiles, Task
+from .prescription_filters import filter_details
+from .prescription_pdf import load_document, pdf_renderer, render_pdf
+from .qr import LEGACY_PREFIX, _render, build_qr_payload
+from .response_cache import doctor_cache
+from .scheduling import (
+    ACTIVE_STATUSES, WEEKDAYS, booked_intervals, booked_intervals_by_weekday, from_seconds, merge_intervals,
+    to_seconds, window_slots,
+)
+from .search import get_index, search_doctors
+from .tasks import Worker, enqueue, task
+from .testing import AuthTestMixin, StubSupabase, auth, make_availability, make_doctor, make_profile, make_token
+from .utils import verify_token
+
+
+def percentiles(samples):
+    """p50 and p99 of durations in seconds, as milliseconds"""
+    samples = sorted(samples)
+    return (
+        round(samples[int(0.50 * (len(samples) - 1))] * 1000, 3),
+        round(samples[int(0.99 * (len(samples) - 1))] * 1000, 3),
+    )
+
+
+SPECIALTIES = ['Cardiology', 'Dermatology', 'Neurology', 'Pediatrics', 'Orthopedics', 'Psychiatry', 'Oncology']
+FIRST_NAMES = ['Amina', 'Karim', 'Lina', 'Yacine', 'Sara', 'Mehdi', 'Nour', 'Walid', 'Ines', 'Omar']
+LAST_NAMES = ['Benali', 'Haddad', 'Mansouri', 'Cherif', 'Saidi', 'Bouzid', 'Khelifi', 'Zerrouki', 'Amrani']
+
+
+def populate_doctors(count, seed=0, batch_size=5000):
+    """
+    Bulk insert `count` doctors with profiles, locations around Algiers and
+    two availability windows each
+
+    Returns:
+        list: Their DoctorProfiles ids
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    ids = []
+    for offset in range(0, count, batch_size):
+        size = min(batch_size, count - offset)
+        users = [
+            Profiles(
+                id=uuid.uuid4(), user_type=Profiles.UserType.DOCTOR, created_at=now, updated_at=now,
+                full_name=f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {offset + n}',
+                email=f'doctor{offset + n}@example.com',
+            )
+            for n in range(size)
+        ]
+        Profiles.objects.bulk_create(users)
+        doctors = [
+            DoctorProfiles(
+                id=uuid.uuid4(), user=user, specialty=rng.choice(SPECIALTIES),
+                hospital_name=f'{rng.choice(LAST_NAMES)} Hospital',
+                location_lat=Decimal(f'{36.75 + rng.uniform(-1, 1):.6f}'),
+                location_lng=Decimal(f'{3.06 + rng.uniform(-1, 1):.6f}'),
+                bio=f'{rng.choice(SPECIALTIES)} specialist, {rng.randint(1, 30)} years of practice',
+                average_rating=Decimal(f'{rng.uniform(1, 5):.2f}'),
+            )
+            for user in users
+        ]
+        DoctorProfiles.objects.bulk_create(doctors)
+        DoctorAvailability.objects.bulk_create([
+            DoctorAvailability(
+                id=uuid.uuid4(), doctor=doctor, day_of_week=day, start_time='09:00', end_time='17:00',
+                slot_duration=30, is_available=True, created_at=now, updated_at=now,
+            )
+            for doctor in doctors for day in ('monday', 'wednesday')
+        ])
+        ids.extend(doctor.id for doctor in doctors)
+    return ids
+
+
+def timed(func, runs):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+class AuthLatencyBenchmark(AuthTestMixin, SimpleTestCase):
+    """Verification latency of a token seen for the first time (no cache hit)"""
+
+    RUNS = 2000
+
+    def _run(self, stub, mode, runs):
+        with override_settings(SUPABASE_URL=stub.url, SUPABASE_AUTH_MODE=mode):
+            samples = timed(lambda: self.assertIsNotNone(verify_token(make_token(uuid.uuid4()))), runs)
+        return percentiles(samples)
+
+    def test_local_vs_remote(self):
+        with StubSupabase() as stub:
+            local = self._run(stub, 'local', self.RUNS)
+            self.assertEqual(stub.requests, 0)
+            loopback = self._run(stub, 'remote', self.RUNS)
+            # Closer to a real Supabase round trip from the same region
+            stub.delay = 0.02
+            remote = self._run(stub, 'remote', 200)
+            self.assertEqual(stub.requests, self.RUNS + 200)
+        print(f'\nauth p50/p99 ms: local {local}, remote over loopback {loopback}, remote with 20 ms upstream {remote}')
+
+
+class AppointmentListSizeBenchmark(AuthTestMixin, TestCase):
+    """Appointment list pages with and without ?include=qr_code"""
+
+    ROWS = 200
+    RUNS = 20
+
+    @classmethod
+    def setUpTestData(cls):
+        patient = make_profile(email='patient@example.com')
+        doctor = make_doctor()
+        start = date(2026, 1, 1)
+        appointments = []
+        for number in range(cls.ROWS):
+            day = start + timedelta(days=number)
+            payload = build_qr_payload(uuid.uuid4(), patient, doctor, day, '09:00:00', '09:30:00', 'scheduled')
+            # Half the rows predate stored payloads and still hold the PNG
+            if number % 2:
+                payload = LEGACY_PREFIX + base64.b64encode(_render(payload)).decode()
+            appointments.append(Appointments(
+                id=uuid.uuid4(), patient=patient, doctor=doctor, appointment_date=day,
+                start_time='09:00', end_time='09:30', qr_code=payload,
+            ))
+        Appointments.objects.bulk_create(appointments)
+
+    def _measure(self, url):
+        samples, size = [], None
+        for _ in range(self.RUNS):
+            started = time.perf_counter()
+            response = self.client.get(url)
+            samples.append(time.perf_counter() - started)
+            self.assertEqual(response.status_code, 200)
+            size = len(response.content)
+        return size, percentiles(samples)[0]
+
+    def test_qr_code_left_out(self):
+        for name in ('appointments-list', 'appointments-all-appointments'):
+            url = f'{reverse(name)}?page_size={self.ROWS}'
+            without = self._measure(url)
+            with_qr = self._measure(f'{url}&include=qr_code')
+            print(f'\n{name}, {self.ROWS} rows: {without[0]} bytes in {without[1]} ms (p50), '
+                  f'{with_qr[0]} bytes in {with_qr[1]} ms with include=qr_code')
+
+
+def nested_loop_slots(windows, appointments):
+    """Free slots the way DoctorAvailabilityView used to find them: every slot against every booking"""
+    slots = []
+    for window in windows:
+        current = datetime.combine(datetime.min, window.start_time)
+        window_end = datetime.combine(datetime.min, window.end_time)
+        while current < window_end:
+            slot_end = current + timedelta(minutes=window.slot_duration)
+            is_available = True
+            for appointment in appointments:
+                if (current < datetime.combine(datetime.min, appointment.end_time)
+                        and slot_end > datetime.combine(datetime.min, appointment.start_time)
+                        and window.day_of_week == appointment.appointment_date.strftime('%A').lower()):
+                    is_available = False
+                    break
+            # The old loop also offered a last slot running past the window
+            if is_available and slot_end <= window_end:
+                slots.append({
+                    'day_of_week': window.day_of_week,
+                    'start_time': current.time().strftime('%H:%M'),
+                    'end_time': slot_end.time().strftime('%H:%M'),
+                    'duration': window.slot_duration,
+                })
+            current = slot_end
+    return slots
+
+
+class SlotComputationBenchmark(TestCase):
+    """
+    Free slots of a doctor with hundreds of bookings, the old nested loop
+    against merge and sweep (app.scheduling): one fully booked day, and the
+    undated view matching bookings by weekday across 20 weeks
+    """
+
+    DAY_BOOKINGS = 300
+    WEEKS = 20
+    RUNS = 50
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(0)
+        cls.doctor, patient = make_doctor(), make_profile()
+        cls.day = date(2026, 3, 2)
+        make_availability(cls.doctor, WEEKDAYS[cls.day.weekday()], '00:00', '23:59', slot_duration=5)
+        make_availability(cls.doctor, WEEKDAYS[cls.day.weekday() + 1], '08:00', '18:00', slot_duration=15)
+        bookings = []
+        for _ in range(cls.DAY_BOOKINGS):
+            start = rng.randrange(0, 24 * 3600 - 900, 60)
+            bookings.append((cls.day, start, start + rng.choice([120, 300, 900])))
+        # 20 bookings of half an hour on each of 20 Tuesdays, evenings stay free
+        for week in range(cls.WEEKS):
+            for start in rng.sample(range(8 * 3600, 16 * 3600, 1800), 10):
+                bookings.append((cls.day + timedelta(days=7 * week + 1), start, start + 1800))
+                bookings.append((cls.day + timedelta(days=7 * week + 1), start + 900, start + 2700))
+        Appointments.objects.bulk_create([
+            Appointments(
+                id=uuid.uuid4(), patient=patient, doctor=cls.doctor, appointment_date=day,
+                start_time=from_seconds(start), end_time=from_seconds(end),
+            )
+            for day, start, end in bookings
+        ])
+
+    def _compare(self, label, windows, load, merged):
+        """Checks both give the same slots, prints compute time and time with the query"""
+        appointments = load()
+        self.assertEqual(window_slots(windows, merged()), nested_loop_slots(windows, appointments))
+        free = len(window_slots(windows, merged()))
+        old = percentiles(timed(lambda: nested_loop_slots(windows, appointments), self.RUNS))
+        new = percentiles(timed(lambda: window_slots(windows, merge_intervals(
+            (to_seconds(a.start_time), to_seconds(a.end_time)) for a in appointments
+        )), self.RUNS))
+        print(f'\nslots, {label}, {len(appointments)} bookings, {free} slots free: '
+              f'compute p50/p99 nested loop {old} ms, merge and sweep {new} ms')
+        old = percentiles(timed(lambda: nested_loop_slots(windows, load()), self.RUNS))
+        new = percentiles(timed(lambda: window_slots(windows, merged()), self.RUNS))
+        print(f'slots, {label}, with the query: p50/p99 nested loop {old} ms, merge and sweep {new} ms')
+
+    def test_old_vs_new(self):
+        active = Appointments.objects.filter(doctor=self.doctor, status__in=ACTIVE_STATUSES)
+        day = WEEKDAYS[self.day.weekday()]
+        self._compare(
+            'one day', list(DoctorAvailability.objects.filter(doctor=self.doctor, day_of_week=day)),
+            lambda: list(active.filter(appointment_date=self.day)),
+            lambda: booked_intervals(self.doctor.id, self.day),
+        )
+        weekday = WEEKDAYS[self.day.weekday() + 1]
+        self._compare(
+            f'undated {weekday}', list(DoctorAvailability.objects.filter(doctor=self.doctor, day_of_week=weekday)),
+            # The old view loaded every booking of the doctor, whatever the day
+            lambda: list(active.all()),
+            lambda: booked_intervals_by_weekday(self.doctor.id).get(weekday, []),
+        )
+
+
+@override_settings(PAGINATION_MAX_PAGE_SIZE=1000)
+class DoctorDirectoryBenchmark(AuthTestMixin, TestCase):
+    """Queries and time of a full directory page, response cache cleared"""
+
+    RUNS = 10
+
+    def test_directory(self):
+        user = make_profile()
+        populated = 0
+        for size in (10, 100, 1000):
+            populate_doctors(size - populated, seed=size)
+            populated = size
+            samples, queries = [], None
+            for _ in range(self.RUNS):
+                caches['default'].clear()
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    response = self.client.get(reverse('doctor-profiles'), {'page_size': size}, **auth(user))
+                    samples.append(time.perf_counter() - started)
+                self.assertEqual(len(response.json()['results']), size)
+                queries = len(captured)
+            print(f'\ndirectory, {size} doctors: {queries} queries, p50 {percentiles(samples)[0]} ms')
+
+
+class NearbyDoctorsBenchmark(AuthTestMixin, TestCase):
+    """?near= searches at 10k and 100k doctors, response cache cleared"""
+
+    RUNS = 50
+
+    def test_near(self):
+        user = make_profile()
+        rng = random.Random(1)
+        populated = 0
+        for size in (10_000, 100_000):
+            populate_doctors(size - populated, seed=size)
+            populated = size
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('ANALYZE doctor_profiles')
+            for radius_km in (5, 25):
+                samples = []
+                for _ in range(self.RUNS):
+                    caches['default'].clear()
+                    near = f'{36.75 + rng.uniform(-0.5, 0.5):.5f},{3.06 + rng.uniform(-0.5, 0.5):.5f}'
+                    started = time.perf_counter()
+                    response = self.client.get(
+                        reverse('doctor-profiles'), {'near': near, 'radius_km': radius_km, 'limit': 20}, **auth(user)
+                    )
+                    samples.append(time.perf_counter() - started)
+                    self.assertEqual(response.status_code, 200)
+                print(f'\nnear, {size} doctors, {radius_km} km: p50/p99 {percentiles(samples)} ms')
+
+
+class DoctorSearchBenchmark(TestCase):
+    """search_doctors() at 10k and 100k doctors, first page of 20"""
+
+    RUNS = 50
+    QUERIES = ['benali', 'cardiology', 'amina benali', 'cardio haddad', 'cardiolgy', 'karim bouzid 1234']
+
+    def test_search(self):
+        populated = 0
+        for size in (10_000, 100_000):
+            populate_doctors(size - populated, seed=size)
+            populated = size
+            # bulk_create sends no signals
+            doctor_cache.bump('directory')
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('ANALYZE doctor_profiles; ANALYZE profiles')
+            else:
+                started = time.perf_counter()
+                get_index()
+                print(f'\nin-process index of {size} doctors built in {round((time.perf_counter() - started) * 1000)} ms')
+            for text in self.QUERIES:
+                found = len(search_doctors(text, 20))
+                p50, p99 = percentiles(timed(lambda: search_doctors(text, 20), self.RUNS))
+                print(f'search {connection.vendor}, {size} doctors, {text!r}: {found} results, p50/p99 {p50}/{p99} ms')
+
+
+class PrescriptionDetailsBenchmark(TestCase):
+    """
+    Details containment over 1M prescriptions: GIN jsonb_path_ops index
+    against a sequential scan on Postgres. SQLite, whose json_contains()
+    always scans, only gets 100k, as a check of the fallback
+    """
+
+    ROWS = 1_000_000
+    SQLITE_ROWS = 100_000
+    RUNS = 20
+    MEDICATIONS = [f'Medication {n}' for n in range(50)]
+    # In one prescription out of a thousand
+    RARE = 'Colchicine'
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(0)
+        doctor, patient = make_doctor(), make_profile()
+        today = timezone.now().date()
+        cls.rows = cls.ROWS if connection.vendor == 'postgresql' else cls.SQLITE_ROWS
+        for offset in range(0, cls.rows, 5000):
+            Prescriptions.objects.bulk_create([
+                Prescriptions(
+                    id=uuid.uuid4(), doctor=doctor, patient=patient, prescription_date=today, is_synced=True,
+                    details={'medications': [
+                        {'name': name, 'dosage': f'{rng.choice([100, 200, 500])}mg'}
+                        for name in rng.sample(cls.MEDICATIONS, rng.randint(1, 3)) + ([cls.RARE] if n % 1000 == 0 else [])
+                    ]},
+                )
+                for n in range(offset, offset + 5000)
+            ])
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE prescriptions')
+
+    def _measure(self, label):
+        for name in (self.RARE, self.MEDICATIONS[0]):
+            def filtered():
+                return filter_details(Prescriptions.objects.all(), [{'medications': [{'name': name}]}])
+
+            count = filtered().count()
+            page_times = percentiles(timed(lambda: list(filtered().order_by('-created_at', '-id')[:20]), self.RUNS))
+            count_times = percentiles(timed(lambda: filtered().count(), self.RUNS))
+            print(f'\ndetails {label}, {name!r} in {count} of {self.rows}: '
+                  f'page of 20 p50/p99 {page_times} ms, count p50/p99 {count_times} ms')
+
+    def test_containment(self):
+        if connection.vendor != 'postgresql':
+            return self._measure('sqlite json_contains()')
+        self._measure('postgres GIN jsonb_path_ops')
+        with connection.cursor() as cursor:
+            # Rolled back with the test
+            cursor.execute('DROP INDEX prescriptions_details_path_idx')
+        self._measure('postgres without index')
+
+
+class PrescriptionPdfBenchmark(TestCase):
+    """PDFs rendered per second of CPU time, i.e. per core, short and long prescriptions"""
+
+    RUNS = 50
+
+    @classmethod
+    def setUpTestData(cls):
+        doctor = make_doctor(full_name='Amina Benali', hospital_name='Mustapha Hospital', hospital_address='Place du 1er Mai, Algiers')
+        patient = make_profile(full_name='Karim Haddad')
+        cls.documents = {
+            'short, 2 medications': Prescriptions.objects.create(
+                id=uuid.uuid4(), doctor=doctor, patient=patient, prescription_date=date(2026, 1, 1), is_synced=True,
+                details={'medications': [
+                    {'name': 'Amoxicillin', 'dosage': '500mg', 'frequency': 'Three times a day'},
+                    {'name': 'Ibuprofen', 'dosage': '200mg', 'frequency': 'As needed'},
+                ]},
+            ),
+            # About the most one page holds
+            'full page, 6 medications and notes': Prescriptions.objects.create(
+                id=uuid.uuid4(), doctor=doctor, patient=patient, prescription_date=date(2026, 1, 1), is_synced=True,
+                details={'medications': [
+                    {'name': f'Medication {n}', 'dosage': f'{n * 50}mg', 'frequency': 'Twice a day',
+                     'duration': f'{n} days', 'instructions': 'Take with food, do not combine with alcohol'}
+                    for n in range(1, 7)
+                ]},
+                additional_notes='Follow up in two weeks. ' * 6,
+            ),
+        }
+
+    def _rate(self, func):
+        """Calls per CPU second and wall p50/p99 of func"""
+        cpu = time.thread_time()
+        samples = timed(func, self.RUNS)
+        return round(self.RUNS / (time.thread_time() - cpu), 1), percentiles(samples)
+
+    @override_settings(STORAGES={**settings.STORAGES, 'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'}})
+    def test_render_rate(self):
+        for label, prescription in self.documents.items():
+            document = load_document(prescription.id)
+            size = len(render_pdf(document))
+            rate, wall = self._rate(lambda: render_pdf(document))
+            print(f'\npdf {label}: {size / 1024:.1f} KB, render only {rate} PDFs/s per core, p50/p99 {wall} ms')
+            # Load, render, store (deduplicated after the first) and link
+            rate, wall = self._rate(lambda: pdf_renderer.render(prescription.id))
+            print(f'pdf {label}: render task {rate} PDFs/s per core, p50/p99 {wall} ms')
+        print(f"renderer metric: {pdf_renderer.stats()['pdfs_per_second_per_core']} PDFs/s per core")
+
+
+# Numbers of the benchmark tasks run, by any worker thread
+ran = []
+
+
+@task('benchmarks.noop')
+def noop_task(number):
+    ran.append(number)
+
+
+class ClaimThroughputBenchmark(TransactionTestCase):
+    """Tasks claimed and run per second by competing worker threads (SKIP LOCKED)"""
+
+    TASKS = 2000
+
+    @override_settings(TASKS_SYNC=False)
+    def test_throughput(self):
+        if connection.vendor != 'postgresql':
+            self.skipTest('SKIP LOCKED needs Postgres')
+        for concurrency in (1, 4, 8):
+            ran.clear()
+            for offset in range(0, self.TASKS, 500):
+                with transaction.atomic():
+                    for number in range(offset, offset + 500):
+                        enqueue('benchmarks.noop', number=number)
+            started = time.perf_counter()
+            Worker(concurrency=concurrency, burst=True).run()
+            elapsed = time.perf_counter() - started
+            # Every task ran exactly once, none left behind
+            self.assertEqual(sorted(ran), list(range(self.TASKS)))
+            self.assertFalse(Task.objects.exists())
+            print(f'\nclaims, {concurrency} workers: {self.TASKS} tasks in {elapsed:.2f} s, {self.TASKS / elapsed:.0f} tasks/s')
@@ -0,0 +1,31 @@
+"""
+Double-booking protection for appointments
+
+Bookings for the same doctor and day are serialized with a transaction-level
+Postgres advisory lock, and the overlap check (app.scheduling) runs while it
+is held. Locks are per doctor and day, so unrelated bookings never wait on
+each other.
+"""
+from django.db import connection
+
+
+def lock_doctor_day(doctor_id, appointment_date):
+    """
+    Serialize bookings of one doctor's day until the current transaction ends
+
+    Must be called inside transaction.atomic(). On databases without
+    advisory locks (SQLite in tests) this is a no-op; SQLite already
+    serializes writers.
+
+    Args:
+        doctor_id: DoctorProfiles id
+        appointment_date: Date being booked
+    """
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT pg_advisory_xact_lock(hashtext(%s))",
+            [f'appointments:{doctor_id}:{appointment_date}']
+        )
+
@@ -0,0 +1,141 @@
+"""
+Circuit breaker for calls to upstream services
+
+closed: calls go through, consecutive failures are counted.
+open: calls fail fast with CircuitOpenError until recovery_timeout passes.
+half-open: a few probe calls are let through; a success closes the circuit,
+a failure opens it again.
+
+State transitions are counted and exposed through MetricsView.
+"""
+import logging
+import threading
+import time
+
+from . import metrics
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+logger = logging.getLogger(__name__)
+
+_breakers = {}
+
+
+class CircuitOpenError(Exception):
+    """The circuit is open, the upstream call was not attempted"""
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold, recovery_timeout, half_open_max_calls=1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+        self._transitions = {}
+        self._rejected = 0
+        _breakers[name] = self
+
+    def _transition(self, state):
+        """Move to a new state (caller holds the lock)"""
+        key = f'{self._state}->{state}'
+        self._transitions[key] = self._transitions.get(key, 0) + 1
+        logger.warning("Circuit breaker '%s': %s", self.name, key)
+        self._state = state
+        self._failures = 0
+        self._probes = 0
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def before_call(self):
+        """
+        Ask permission to call the upstream
+
+        Raises:
+            CircuitOpenError: The circuit is open, or half-open with all
+                probe slots taken
+        """
+        with self._lock:
+            if self._state == OPEN:
+                if time.monotonic() - self._opened_at < self.recovery_timeout:
+                    self._rejected += 1
+                    raise CircuitOpenError(f"Circuit '{self.name}' is open")
+                self._transition(HALF_OPEN)
+
+            if self._state == HALF_OPEN:
+                if self._probes >= self.half_open_max_calls:
+                    self._rejected += 1
+                    raise CircuitOpenError(f"Circuit '{self.name}' is half-open")
+                self._probes += 1
+
+    def record_success(self):
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._transition(CLOSED)
+            else:
+                self._failures = 0
+
+    def release(self):
+        """
+        Give back the probe slot of a call that ended without an outcome
+
+        For calls interrupted by something saying nothing about the
+        upstream (a bug, a bad argument), so the half-open circuit doesn't
+        stay short of probes until the next transition.
+        """
+        with self._lock:
+            if self._state == HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def record_failure(self):
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._transition(OPEN)
+                return
+            self._failures += 1
+            if self._state == CLOSED and self._failures >= self.failure_threshold:
+                self._transition(OPEN)
+
+    def reset(self):
+        """Close the circuit and forget failures and counters"""
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._probes = 0
+            self._transitions = {}
+            self._rejected = 0
+
+    def stats(self):
+        """
+        Returns:
+            dict: Current state, consecutive failures, rejected calls and
+            transition counts
+        """
+        state = self.state
+        with self._lock:
+            return {
+                'state': state,
+                'consecutive_failures': self._failures,
+                'rejected': self._rejected,
+                'transitions': dict(self._transitions),
+            }
+
+
+def _stats():
+    return {name: breaker.stats() for name, breaker in _breakers.items()}
+
+
+metrics.register('circuit_breakers', _stats)
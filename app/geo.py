@@ -0,0 +1,75 @@
+"""
+Distance helpers for doctor locations
+
+Locations are plain latitude/longitude columns on DoctorProfiles. Radius
+searches first narrow the candidates with a bounding box the database can
+filter on, then compute the exact great-circle distance in Python.
+"""
+import math
+
+from django.db.models import Q
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance between two points, in kilometers"""
+    lat1, lng1, lat2, lng2 = (math.radians(float(value)) for value in (lat1, lng1, lat2, lng2))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(lat, lng, radius_km):
+    """
+    Latitude/longitude box containing every point within radius_km
+
+    Args:
+        lat, lng (float): Center of the search
+        radius_km (float): Search radius
+
+    Returns:
+        tuple: (min_lat, max_lat, min_lng, max_lng), the longitude range
+            is the whole globe near the poles and across the antimeridian
+    """
+    lat = float(lat)
+    lng = float(lng)
+    lat_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat = max(-90.0, lat - lat_delta)
+    max_lat = min(90.0, lat + lat_delta)
+
+    # Longitude degrees shrink with the cosine of the latitude
+    cos_lat = math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+    if cos_lat <= 1e-9 or max_lat >= 90.0 or min_lat <= -90.0:
+        return min_lat, max_lat, -180.0, 180.0
+    lng_delta = lat_delta / cos_lat
+    if lng - lng_delta < -180.0 or lng + lng_delta > 180.0:
+        return min_lat, max_lat, -180.0, 180.0
+    return min_lat, max_lat, lng - lng_delta, lng + lng_delta
+
+
+def bounding_box_filter(lat, lng, radius_km):
+    """Q narrowing DoctorProfiles to the bounding box of a radius search"""
+    min_lat, max_lat, min_lng, max_lng = bounding_box(lat, lng, radius_km)
+    return Q(
+        location_lat__range=(min_lat, max_lat),
+        location_lng__range=(min_lng, max_lng)
+    )
+
+
+def parse_point(value):
+    """
+    Parse a "lat,lng" query parameter
+
+    Raises:
+        ValueError: The value is not two numbers in range
+    """
+    parts = value.split(',')
+    if len(parts) != 2:
+        raise ValueError('Expected "lat,lng"')
+    lat, lng = float(parts[0]), float(parts[1])
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError('Coordinates out of range')
+    return lat, lng
@@ -0,0 +1,38 @@
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ...tasks import Worker
+
+
+class Command(BaseCommand):
+    help = 'Run queued background tasks (app.tasks) until stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, default=settings.TASKS_WORKER_CONCURRENCY,
+            help='Tasks run at the same time (threads)'
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=settings.TASKS_POLL_INTERVAL,
+            help='Seconds to wait before polling again when no task is due'
+        )
+        parser.add_argument(
+            '--burst', action='store_true',
+            help='Exit once no task is due instead of polling'
+        )
+
+    def handle(self, *args, **options):
+        worker = Worker(
+            concurrency=max(1, options['concurrency']),
+            poll_interval=options['poll_interval'],
+            burst=options['burst'],
+        )
+        # Finish the running tasks on SIGTERM/Ctrl-C instead of abandoning them
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: worker.stop())
+
+        self.stdout.write(f"Running tasks with {worker.concurrency} threads")
+        worker.run()
+        self.stdout.write("Task worker stopped")
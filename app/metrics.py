@@ -0,0 +1,34 @@
+"""
+Process-local metrics registry
+
+Modules register a callable that returns a dict of their counters, and
+MetricsView serves a snapshot of all of them. Numbers are per worker process.
+"""
+import threading
+
+_providers = {}
+_lock = threading.Lock()
+
+
+def register(name, provider):
+    """
+    Register a metrics provider
+
+    Args:
+        name (str): Section name in the metrics snapshot
+        provider (callable): Returns a JSON-serializable dict
+    """
+    with _lock:
+        _providers[name] = provider
+
+
+def snapshot():
+    """
+    Collect the current value of every registered provider
+
+    Returns:
+        dict: Section name -> provider output
+    """
+    with _lock:
+        providers = dict(_providers)
+    return {name: provider() for name, provider in providers.items()}
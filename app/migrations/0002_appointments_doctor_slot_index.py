@@ -0,0 +1,32 @@
+# Generated by Django 5.2 on 2026-10-18
+
+from django.db import migrations
+
+
+# The tables are managed by Supabase, so indexes are added with raw SQL and
+# only on Postgres
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS appointments_doctor_slot_idx "
+        "ON appointments (doctor_id, appointment_date, start_time, end_time) "
+        "WHERE status <> 'cancelled'"
+    )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS appointments_doctor_slot_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
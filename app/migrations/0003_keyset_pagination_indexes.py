@@ -0,0 +1,41 @@
+# Generated by Django 5.2 on 2026-10-18
+
+from django.db import migrations
+
+
+# Indexes matching the keyset pagination orderings, so every page is an
+# index range scan. Raw SQL on Postgres only, the tables are not managed
+INDEXES = [
+    ('appointments_date_start_id_idx', 'appointments', 'appointment_date, start_time, id'),
+    ('appointments_patient_date_idx', 'appointments', 'patient_id, appointment_date, start_time, id'),
+    ('appointments_doctor_date_idx', 'appointments', 'doctor_id, appointment_date, start_time, id'),
+    ('notifications_user_created_idx', 'notifications', 'user_id, created_at, id'),
+    ('prescriptions_created_id_idx', 'prescriptions', 'created_at, id'),
+    ('prescriptions_patient_created_idx', 'prescriptions', 'patient_id, created_at, id'),
+    ('prescriptions_doctor_created_idx', 'prescriptions', 'doctor_id, created_at, id'),
+]
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, columns in INDEXES:
+        schema_editor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _, _ in INDEXES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0002_appointments_doctor_slot_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2 on 2026-10-18
+
+from django.db import migrations
+
+
+# The doctor directory is ordered by COALESCE(average_rating, 0) DESC, id and
+# can be filtered with specialty__iexact (UPPER(specialty) = UPPER(...)).
+# Raw SQL on Postgres only, the tables are not managed
+INDEXES = [
+    ('doctor_profiles_rating_idx', 'doctor_profiles', '(COALESCE(average_rating, 0)) DESC, id'),
+    ('doctor_profiles_specialty_rating_idx', 'doctor_profiles', 'UPPER(specialty), (COALESCE(average_rating, 0)) DESC, id'),
+]
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, columns in INDEXES:
+        schema_editor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _, _ in INDEXES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
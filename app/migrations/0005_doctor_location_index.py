@@ -0,0 +1,33 @@
+# Generated by Django 5.2 on 2026-10-18
+
+from django.db import migrations
+
+
+# Serves the bounding box prefilter of ?near= doctor searches
+# (location_lat BETWEEN ... AND location_lng BETWEEN ...). Raw SQL on
+# Postgres only, the tables are not managed
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS doctor_profiles_location_idx "
+        "ON doctor_profiles (location_lat, location_lng) "
+        "WHERE location_lat IS NOT NULL AND location_lng IS NOT NULL"
+    )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS doctor_profiles_location_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_doctor_directory_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
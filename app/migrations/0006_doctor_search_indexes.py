@@ -0,0 +1,47 @@
+# Generated by Django 5.2 on 2026-10-18
+
+from django.db import migrations
+
+
+# GIN indexes serving each matching branch of app.search, one full-text
+# index per field since a match is weighed by the field it is in. The
+# expressions must stay identical to the ones in its SQL for the planner to
+# use them. Raw SQL on Postgres only, the tables are not managed
+INDEXES = [
+    ('doctor_profiles_specialty_search_idx', "doctor_profiles USING GIN (to_tsvector('simple', coalesce(specialty, '')))"),
+    ('doctor_profiles_hospital_search_idx', "doctor_profiles USING GIN (to_tsvector('simple', coalesce(hospital_name, '')))"),
+    ('doctor_profiles_bio_search_idx', "doctor_profiles USING GIN (to_tsvector('simple', coalesce(bio, '')))"),
+    (
+        'profiles_full_name_search_idx',
+        "profiles USING GIN (to_tsvector('simple', coalesce(full_name, '')))",
+    ),
+    ('profiles_full_name_trgm_idx', 'profiles USING GIN (full_name gin_trgm_ops)'),
+    ('doctor_profiles_specialty_trgm_idx', 'doctor_profiles USING GIN (specialty gin_trgm_ops)'),
+    ('doctor_profiles_hospital_trgm_idx', 'doctor_profiles USING GIN (hospital_name gin_trgm_ops)'),
+]
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for name, definition in INDEXES:
+        schema_editor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}")
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _ in INDEXES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_doctor_location_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
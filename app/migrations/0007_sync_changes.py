@@ -0,0 +1,53 @@
+# Generated by Django 5.2 on 2026-10-18
+
+from django.db import migrations, models
+
+
+# Indexes serving the (updated_at, id) scans of the sync changes feed for
+# each owner column. Raw SQL on Postgres only, the tables are not managed
+INDEXES = [
+    ('appointments_patient_updated_idx', 'appointments', 'patient_id, updated_at, id'),
+    ('appointments_doctor_updated_idx', 'appointments', 'doctor_id, updated_at, id'),
+    ('prescriptions_patient_updated_idx', 'prescriptions', 'patient_id, updated_at, id'),
+    ('prescriptions_doctor_updated_idx', 'prescriptions', 'doctor_id, updated_at, id'),
+    ('doctor_availability_doctor_updated_idx', 'doctor_availability', 'doctor_id, updated_at, id'),
+]
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, columns in INDEXES:
+        schema_editor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _, _ in INDEXES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_doctor_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncTombstone',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('owner_id', models.UUIDField()),
+                ('entity', models.CharField(choices=[('appointment', 'Appointment'), ('prescription', 'Prescription'), ('notification', 'Notification'), ('availability', 'Availability')], max_length=20)),
+                ('object_id', models.UUIDField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'sync_tombstones',
+                'indexes': [models.Index(fields=['owner_id', 'deleted_at', 'id'], name='sync_tombstones_owner_idx')],
+            },
+        ),
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
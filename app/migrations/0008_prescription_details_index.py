@@ -0,0 +1,33 @@
+# Generated by Django 5.2 on 2026-10-18
+
+from django.db import migrations
+
+
+# Serves containment queries on prescription details (details @> '{...}',
+# e.g. ?medication=). jsonb_path_ops only supports @>, and is smaller and
+# faster for it than the default operator class. Raw SQL on Postgres only,
+# the tables are not managed
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS prescriptions_details_path_idx "
+        "ON prescriptions USING GIN (details jsonb_path_ops)"
+    )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS prescriptions_details_path_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_sync_changes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
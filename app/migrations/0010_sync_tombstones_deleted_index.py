@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_tasks'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='synctombstone',
+            index=models.Index(fields=['deleted_at'], name='sync_tombstones_deleted_idx'),
+        ),
+    ]
@@ -5,6 +5,7 @@
 #   * Make sure each ForeignKey and OneToOneField has `on_delete` set to the desired behavior
 #   * Remove `managed = False` lines if you wish to allow Django to create, modify, and delete the table
 # Feel free to rename the models, but don't rename db_table values or field names.
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 
 
@@ -222,4 +223,65 @@ class Prescriptions(models.Model):
 
     class Meta:
         managed = False
-        db_table = 'prescriptions'
\ No newline at end of file
+        db_table = 'prescriptions'
+
+class SyncTombstone(models.Model):
+    """
+    Record of a deleted row, so offline clients can drop their copy
+
+    Written by app.signals when a synced row is deleted, one per user who can
+    see the row, and served by the sync changes feed. Unlike the tables
+    above, this one is managed by Django.
+    """
+    class Entity(models.TextChoices):
+        APPOINTMENT = 'appointment', 'Appointment'
+        PRESCRIPTION = 'prescription', 'Prescription'
+        NOTIFICATION = 'notification', 'Notification'
+        AVAILABILITY = 'availability', 'Availability'
+
+    id = models.BigAutoField(primary_key=True)
+    owner_id = models.UUIDField()
+    entity = models.CharField(max_length=20, choices=Entity.choices)
+    object_id = models.UUIDField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'sync_tombstones'
+        indexes = [
+            models.Index(fields=['owner_id', 'deleted_at', 'id'], name='sync_tombstones_owner_idx'),
+            # Pruning, see app.sync.prune_tombstones
+            models.Index(fields=['deleted_at'], name='sync_tombstones_deleted_idx'),
+        ]
+
+
+class Task(models.Model):
+    """
+    Background task waiting for, or being run by, a worker (see app.tasks)
+
+    Finished tasks are deleted. Tasks that failed max_attempts times stay as
+    dead letters for inspection. Managed by Django, like SyncTombstone.
+    """
+    class Status(models.TextChoices):
+        QUEUED = 'queued', 'Queued'
+        RUNNING = 'running', 'Running'
+        DEAD = 'dead', 'Dead'
+
+    id = models.BigAutoField(primary_key=True)
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.QUEUED)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField()
+    run_at = models.DateTimeField()
+    # Lease of the worker running the task, it is run again once expired
+    locked_until = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'tasks'
+        indexes = [
+            models.Index(fields=['run_at', 'id'], name='tasks_queued_idx', condition=models.Q(status='queued')),
+            models.Index(fields=['locked_until'], name='tasks_running_idx', condition=models.Q(status='running')),
+        ]
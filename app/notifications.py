@@ -0,0 +1,71 @@
+"""
+Notifications created by the backend
+
+Created by background tasks (app.tasks), so the request changing an
+appointment doesn't wait for them. The notification id is chosen when the
+task is queued, which makes a retried task create it only once.
+"""
+import uuid
+
+from django.utils import timezone
+
+from .models import Appointments, Notifications
+from .tasks import enqueue, task
+
+# Appointment status -> (notification type, title, content template)
+STATUS_NOTIFICATIONS = {
+    Appointments.Status.CONFIRMED: (
+        Notifications.Types.APPOINTMENT_CONFIRMATION,
+        'Appointment confirmed',
+        'Your appointment with Dr. {doctor} on {date} at {time} is confirmed.',
+    ),
+    Appointments.Status.CANCELLED: (
+        Notifications.Types.APPOINTMENT_CANCELLED,
+        'Appointment cancelled',
+        'Your appointment with Dr. {doctor} on {date} at {time} was cancelled.',
+    ),
+}
+
+
+@task('notifications.create')
+def create_notification(notification_id, user_id, type, title, content, related_id=None):
+    Notifications.objects.get_or_create(id=notification_id, defaults={
+        'user_id': user_id,
+        'type': type,
+        'title': title,
+        'content': content,
+        'is_read': False,
+        'related_id': related_id,
+        'created_at': timezone.now(),
+    })
+
+
+def notify(user_id, type, title, content, related_id=None):
+    """Queue a notification for a user"""
+    enqueue(
+        'notifications.create',
+        notification_id=uuid.uuid4(),
+        user_id=user_id,
+        type=type,
+        title=title,
+        content=content,
+        related_id=related_id,
+    )
+
+
+def notify_status_change(appointment):
+    """
+    Tell the patient their appointment was confirmed or cancelled
+
+    Args:
+        appointment (Appointments): With its doctor and doctor's user loaded
+    """
+    if appointment.status not in STATUS_NOTIFICATIONS:
+        return
+    notification_type, title, template = STATUS_NOTIFICATIONS[appointment.status]
+    content = template.format(
+        doctor=appointment.doctor.user.full_name or '',
+        date=appointment.appointment_date,
+        time=str(appointment.start_time)[:5],
+    )
+    notify(appointment.patient_id, notification_type, title, content, related_id=appointment.id)
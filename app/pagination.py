@@ -0,0 +1,165 @@
+"""
+Keyset (cursor) pagination
+
+Pages are fetched with a WHERE on the ordering columns of the last row seen,
+e.g. (appointment_date, start_time, id) > (d, t, i), instead of an OFFSET, so
+every page costs the same no matter how deep the client is. The cursor is
+an opaque base64 token holding those values. The ordering must end with a
+unique column (id) and its columns must not be NULL.
+"""
+import base64
+import datetime
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class _CursorEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder without the millisecond rounding, cursors must be exact"""
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values):
+    """Encode ordering values as an opaque cursor string"""
+    data = json.dumps(values, cls=_CursorEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor produced by encode_cursor
+
+    Raises:
+        ValueError: The cursor is malformed
+    """
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError('Invalid cursor') from e
+    if not isinstance(values, list):
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def keyset_filter(ordering, values):
+    """
+    Build the filter selecting rows strictly after `values` in `ordering`
+
+    Args:
+        ordering (list): Field names, '-' prefix for descending
+        values (list): Values of those fields on the last row seen
+
+    Returns:
+        Q: (a > x) OR (a = x AND b > y) OR (a = x AND b = y AND c > z) ...
+    """
+    condition = Q()
+    equal = Q()
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= equal & Q(**{f'{name}__{lookup}': value})
+        equal &= Q(**{name: value})
+    return condition
+
+
+def row_values(row, ordering):
+    """Values of the ordering fields on a model instance or .values() dict"""
+    names = [field.lstrip('-') for field in ordering]
+    if isinstance(row, dict):
+        return [row[name] for name in names]
+    return [getattr(row, name) for name in names]
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset pagination for querysets
+
+    The ordering comes from the constructor, else from the view's `ordering`
+    attribute, else defaults to (created_at, id).
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    ordering = ('created_at', 'id')
+
+    def __init__(self, ordering=None):
+        if ordering is not None:
+            self.ordering = ordering
+
+    def get_ordering(self, view):
+        return getattr(view, 'ordering', None) or self.ordering
+
+    def get_page_size(self, request):
+        page_size = settings.PAGINATION_PAGE_SIZE
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, page_size))
+        except (TypeError, ValueError):
+            pass
+        return max(1, min(page_size, settings.PAGINATION_MAX_PAGE_SIZE))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        Get one page of the queryset
+
+        Returns:
+            list: Rows of the page (instances or dicts, like the queryset)
+        """
+        self.request = request
+        self.ordering = self.get_ordering(view)
+        self.page_size = self.get_page_size(request)
+
+        # One extra row tells whether there is a next page
+        queryset = queryset.order_by(*self.ordering)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            try:
+                values = decode_cursor(cursor)
+                if len(values) != len(self.ordering):
+                    raise ValueError('Invalid cursor')
+                queryset = queryset.filter(keyset_filter(self.ordering, values))
+                # Values that don't fit their column fail when the query is
+                # built or compiled, i.e. here or on evaluation
+                rows = list(queryset[:self.page_size + 1])
+            except (ValidationError, ValueError, TypeError):
+                raise NotFound('Invalid cursor')
+        else:
+            rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        self.next_cursor = encode_cursor(row_values(rows[-1], self.ordering)) if self.has_next else None
+        return rows
+
+    def get_next_link(self):
+        if not self.next_cursor:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'next_cursor': self.next_cursor,
+            'results': data
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'next_cursor': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
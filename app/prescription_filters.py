@@ -0,0 +1,124 @@
+"""
+Queries over the JSON details of prescriptions
+
+details holds the medications of a prescription, e.g.
+{"medications": [{"name": "Amoxicillin", "dosage": "500mg"}, ...]}. These
+filters are answered by the database: on Postgres, containment (@>) is
+served by the GIN jsonb_path_ops index of migration 0008. SQLite has no
+JSON containment, so json_contains() below is registered as an SQL function
+of every SQLite connection and called from the WHERE clause. The queryset
+stays lazy, pagination still reads one page.
+"""
+import json
+
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.db.models import BooleanField, F, Func, Value
+from django.dispatch import receiver
+from django.utils.dateparse import parse_date
+from rest_framework.exceptions import ValidationError
+
+# Name of json_contains() in SQLite
+SQLITE_JSON_CONTAINS = 'app_json_contains'
+
+
+def json_contains(document, pattern):
+    """
+    Whether a JSON document contains a pattern, like Postgres jsonb @>
+
+    Objects contain the pattern's keys with contained values, arrays contain
+    every element of the pattern's array in any order, scalars are equal.
+    """
+    if isinstance(pattern, dict):
+        return isinstance(document, dict) and all(
+            key in document and json_contains(document[key], value)
+            for key, value in pattern.items()
+        )
+    if isinstance(pattern, list):
+        return isinstance(document, list) and all(
+            any(json_contains(item, value) for item in document)
+            for value in pattern
+        )
+    # True == 1 in Python, not in JSON
+    if isinstance(pattern, bool) or isinstance(document, bool):
+        return isinstance(pattern, bool) and isinstance(document, bool) and pattern == document
+    if isinstance(pattern, (int, float)):
+        return isinstance(document, (int, float)) and pattern == document
+    return pattern == document
+
+
+def _sqlite_json_contains(document, pattern):
+    return document is not None and json_contains(json.loads(document), json.loads(pattern))
+
+
+@receiver(connection_created)
+def register_sqlite_functions(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        connection.connection.create_function(SQLITE_JSON_CONTAINS, 2, _sqlite_json_contains, deterministic=True)
+
+
+class SQLiteJSONContains(Func):
+    """document @> pattern on SQLite, pattern being JSON text"""
+    function = SQLITE_JSON_CONTAINS
+    arity = 2
+    output_field = BooleanField()
+
+
+def filter_details(queryset, patterns=(), has_key=None):
+    """
+    Narrow a prescriptions queryset on its details
+
+    Args:
+        queryset (QuerySet): Prescriptions, already filtered by owner
+        patterns (list): JSON values the details must all contain
+        has_key (str): Top-level key the details must have
+
+    Returns:
+        QuerySet: Filtered prescriptions
+    """
+    if has_key:
+        queryset = queryset.filter(details__has_key=has_key)
+    if not patterns:
+        return queryset
+    for pattern in patterns:
+        if connection.vendor == 'postgresql':
+            queryset = queryset.filter(details__contains=pattern)
+        else:
+            queryset = queryset.filter(SQLiteJSONContains(F('details'), Value(json.dumps(pattern))))
+    return queryset
+
+
+def filter_prescriptions(queryset, params):
+    """
+    Apply the details and date query params of the prescription lists
+
+    Query params: medication (exact medication name), details_contains
+    (JSON the details must contain), details_has_key (top-level key),
+    date_from and date_to (prescription date, YYYY-MM-DD)
+
+    Raises:
+        ValidationError: A param is malformed
+    """
+    patterns = []
+    raw_contains = params.get('details_contains')
+    if raw_contains:
+        try:
+            patterns.append(json.loads(raw_contains))
+        except ValueError:
+            raise ValidationError({'details_contains': 'Must be valid JSON'})
+
+    medication = params.get('medication')
+    if medication:
+        patterns.append({'medications': [{'name': medication}]})
+
+    for name, lookup in (('date_from', 'gte'), ('date_to', 'lte')):
+        if params.get(name):
+            try:
+                value = parse_date(params[name])
+            except ValueError:
+                value = None
+            if value is None:
+                raise ValidationError({name: 'Must use YYYY-MM-DD'})
+            queryset = queryset.filter(**{f'prescription_date__{lookup}': value})
+
+    return filter_details(queryset, patterns=patterns, has_key=params.get('details_has_key'))
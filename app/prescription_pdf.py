@@ -0,0 +1,210 @@
+"""
+Server-side prescription PDFs
+
+Prescriptions are rendered to a one page PDF from their details and the
+doctor's and patient's profiles, by a background task (app.tasks) so the
+request that saved the prescription doesn't wait for it. Rendering is
+deterministic (the PDF dates are pinned to the prescription date), and
+files are stored under the sha256 of their content on the storage named by
+PRESCRIPTION_PDF_STORAGE, so rendering an unchanged prescription again
+stores nothing new. pdf_url is filled in once the file is stored.
+"""
+import hashlib
+import textwrap
+import threading
+import time
+from datetime import datetime, time as dt_time
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+from django.utils import timezone
+from PIL import Image, ImageDraw, ImageFont
+
+from . import metrics
+from .models import Prescriptions
+from .tasks import enqueue, task
+
+# A4 at 150 dpi
+PAGE_SIZE = (1240, 1754)
+RESOLUTION = 150.0
+MARGIN = 100
+WRAP_WIDTH = 80
+
+
+def load_document(prescription_id):
+    """
+    Load what goes on the PDF of a prescription, with one query
+
+    Returns:
+        dict: Prescription row with doctor and patient fields, None if the
+            prescription doesn't exist
+    """
+    return Prescriptions.objects.filter(id=prescription_id).values(
+        'id', 'prescription_date', 'details', 'additional_notes', 'updated_at',
+        'doctor__user__full_name', 'doctor__specialty', 'doctor__hospital_name', 'doctor__hospital_address',
+        'patient__full_name',
+    ).first()
+
+
+def _medication_lines(details):
+    """Text lines of the medications in details, one block per medication"""
+    medications = details.get('medications') if isinstance(details, dict) else details
+    if not isinstance(medications, list):
+        return [str(details)] if details else []
+
+    lines = []
+    for number, medication in enumerate(medications, 1):
+        if not isinstance(medication, dict):
+            lines.append(f'{number}. {medication}')
+            continue
+        lines.append(f"{number}. {medication.get('name', '')}")
+        for key, value in medication.items():
+            if key != 'name' and value not in (None, ''):
+                lines.append(f"    {key.replace('_', ' ').capitalize()}: {value}")
+    return lines
+
+
+def _font(size):
+    if settings.PRESCRIPTION_PDF_FONT:
+        return ImageFont.truetype(settings.PRESCRIPTION_PDF_FONT, size)
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 only has the fixed size bitmap font
+        return ImageFont.load_default()
+
+
+def render_pdf(document):
+    """
+    Render a prescription document to PDF
+
+    Args:
+        document (dict): As returned by load_document
+
+    Returns:
+        bytes: The PDF, the same bytes for the same document
+    """
+    title_font, text_font = _font(40), _font(26)
+    page = Image.new('L', PAGE_SIZE, 255)
+    draw = ImageDraw.Draw(page)
+    y = MARGIN
+
+    def write(text, font, gap=12):
+        nonlocal y
+        for line in textwrap.wrap(text, WRAP_WIDTH, subsequent_indent='    ') or ['']:
+            draw.text((MARGIN, y), line, fill=0, font=font)
+            y += font.getbbox('Ag')[3] + gap
+
+    write(f"Dr. {document['doctor__user__full_name'] or ''}", title_font)
+    for field in ('doctor__specialty', 'doctor__hospital_name', 'doctor__hospital_address'):
+        if document[field]:
+            write(document[field], text_font)
+    y += 30
+    draw.line((MARGIN, y, PAGE_SIZE[0] - MARGIN, y), fill=0, width=2)
+    y += 30
+
+    write(f"Patient: {document['patient__full_name'] or ''}", text_font)
+    write(f"Date: {document['prescription_date']}", text_font)
+    y += 30
+    for line in _medication_lines(document['details']):
+        write(line, text_font)
+    if document['additional_notes']:
+        y += 30
+        write('Notes:', text_font)
+        write(document['additional_notes'], text_font)
+
+    # Pillow stamps the current time otherwise, which would defeat dedup
+    pinned = datetime.combine(document['prescription_date'], dt_time()).timetuple()
+    buffer = BytesIO()
+    page.save(
+        buffer, format='PDF', resolution=RESOLUTION, quality=90,
+        title=f"Prescription {document['id']}", creationDate=pinned, modDate=pinned
+    )
+    return buffer.getvalue()
+
+
+def store_pdf(pdf):
+    """
+    Store a PDF under its content hash
+
+    Returns:
+        tuple: (URL of the file, whether it was already stored)
+    """
+    storage = storages[settings.PRESCRIPTION_PDF_STORAGE]
+    digest = hashlib.sha256(pdf).hexdigest()
+    name = f'prescriptions/{digest[:2]}/{digest}.pdf'
+    if storage.exists(name):
+        return storage.url(name), True
+    # Two workers may race to store the same file, either copy will do
+    name = storage.save(name, ContentFile(pdf))
+    return storage.url(name), False
+
+
+class PdfRenderer:
+    """Renders prescription PDFs as background tasks, and counts them"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {'queued': 0, 'rendered': 0, 'deduplicated': 0, 'failed': 0, 'render_seconds': 0.0}
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def schedule(self, prescription_id):
+        """Render a prescription's PDF in the background once the transaction commits"""
+        self._count('queued')
+        enqueue('prescription_pdf.render', prescription_id=prescription_id)
+
+    def render(self, prescription_id):
+        """
+        Render, store and link the PDF of a prescription
+
+        Returns:
+            str: URL of the PDF, None if the prescription no longer exists
+        """
+        try:
+            document = load_document(prescription_id)
+            if document is None:
+                return None
+
+            # CPU time of this thread, waiting on the GIL doesn't count
+            started = time.thread_time()
+            pdf = render_pdf(document)
+            self._count('render_seconds', time.thread_time() - started)
+            self._count('rendered')
+
+            url, existed = store_pdf(pdf)
+            if existed:
+                self._count('deduplicated')
+
+            # Skipped if the prescription changed while rendering, its own
+            # render is queued. updated_at moves so the sync feed sees the URL
+            Prescriptions.objects.filter(id=prescription_id, updated_at=document['updated_at']).update(
+                pdf_url=url, updated_at=timezone.now()
+            )
+            return url
+        except Exception:
+            self._count('failed')
+            raise
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        # render_seconds is CPU time, so this is the rate of one core
+        stats['pdfs_per_second_per_core'] = (
+            round(stats['rendered'] / stats['render_seconds'], 2) if stats['render_seconds'] else None
+        )
+        stats['render_seconds'] = round(stats['render_seconds'], 3)
+        return stats
+
+
+pdf_renderer = PdfRenderer()
+metrics.register('prescription_pdf', pdf_renderer.stats)
+
+
+@task('prescription_pdf.render')
+def render_prescription_pdf(prescription_id):
+    pdf_renderer.render(prescription_id)
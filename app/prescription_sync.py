@@ -0,0 +1,232 @@
+"""
+Batch upsert of prescriptions written offline
+
+The mobile app creates prescriptions offline with a client generated
+local_id, and sends its whole queue when it reconnects. A batch is checked
+with one query per kind of referenced row (patients, appointments, existing
+prescriptions) whatever its size, then written with
+INSERT ... ON CONFLICT (local_id) DO UPDATE, so replaying a batch after a
+lost response is harmless. Their PDFs are then rendered in the background
+like those of single saves.
+
+The update only applies to rows of the same doctor, so a local_id taken by
+another doctor between the check and the write is reported, not stolen.
+"""
+import uuid
+from datetime import datetime
+
+from django.db import connection, transaction
+
+from .models import Appointments, Prescriptions, Profiles
+from .prescription_pdf import pdf_renderer
+
+# Columns a replayed item may change on an existing prescription. pdf_url
+# is only ever set by the PDF renderer
+UPDATE_FIELDS = [
+    'patient', 'appointment', 'prescription_date', 'details',
+    'additional_notes', 'is_synced', 'updated_at',
+]
+
+
+OWNED_ELSEWHERE = 'local_id belongs to another doctor'
+
+
+def _parse_uuid(value):
+    """UUID of a value, None if it isn't one"""
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        return None
+
+
+def _parse_item(item):
+    """
+    Check the shape of one item
+
+    Returns:
+        tuple: (parsed dict or None, list of error messages)
+    """
+    if not isinstance(item, dict):
+        return None, ['Each item must be an object']
+
+    errors = []
+    local_id = item.get('local_id')
+    if not isinstance(local_id, str) or not local_id:
+        errors.append('local_id is required')
+
+    patient_id = _parse_uuid(item.get('patient_id'))
+    if patient_id is None:
+        errors.append('patient_id must be a UUID')
+
+    appointment_id = None
+    if item.get('appointment_id'):
+        appointment_id = _parse_uuid(item['appointment_id'])
+        if appointment_id is None:
+            errors.append('appointment_id must be a UUID')
+
+    details = item.get('details', {})
+    if not isinstance(details, (dict, list)):
+        errors.append('details must be a JSON object')
+
+    prescription_date = datetime.now().date()
+    if item.get('prescription_date'):
+        try:
+            prescription_date = datetime.strptime(item['prescription_date'], '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            errors.append('prescription_date must use YYYY-MM-DD')
+
+    if errors:
+        return None, errors
+    return {
+        'local_id': local_id,
+        'patient_id': patient_id,
+        'appointment_id': appointment_id,
+        'prescription_date': prescription_date,
+        'details': details,
+        'additional_notes': item.get('additional_notes'),
+        'pdf_url': item.get('pdf_url'),
+    }, []
+
+
+def _upsert(prescriptions):
+    """
+    INSERT ... ON CONFLICT (local_id) DO UPDATE, updating only rows of the
+    same doctor
+
+    Returns:
+        dict: local_id -> id of the rows inserted or updated, those left
+            alone are missing
+    """
+    meta = Prescriptions._meta
+    fields = meta.concrete_fields
+    quote = connection.ops.quote_name
+    table = quote(meta.db_table)
+    update = ', '.join(
+        f'{quote(column)} = EXCLUDED.{quote(column)}'
+        for column in (meta.get_field(name).column for name in UPDATE_FIELDS)
+    )
+    row = '(' + ', '.join(['%s'] * len(fields)) + ')'
+    written = {}
+    batch_size = connection.ops.bulk_batch_size(fields, prescriptions)
+    with connection.cursor() as cursor:
+        for start in range(0, len(prescriptions), batch_size):
+            batch = prescriptions[start:start + batch_size]
+            cursor.execute(
+                f"INSERT INTO {table} ({', '.join(quote(field.column) for field in fields)}) "
+                f"VALUES {', '.join([row] * len(batch))} "
+                f"ON CONFLICT ({quote('local_id')}) DO UPDATE SET {update} "
+                f"WHERE {table}.{quote('doctor_id')} = EXCLUDED.{quote('doctor_id')} "
+                f"RETURNING {quote('id')}, {quote('local_id')}",
+                [
+                    field.get_db_prep_save(field.pre_save(prescription, True), connection)
+                    for prescription in batch for field in fields
+                ],
+            )
+            written.update((local_id, meta.pk.to_python(pk)) for pk, local_id in cursor.fetchall())
+    return written
+
+
+def sync_prescriptions(doctor, items):
+    """
+    Create or update a batch of prescriptions of a doctor, keyed by local_id
+
+    Args:
+        doctor (DoctorProfiles): Doctor writing the prescriptions
+        items (list): Prescriptions as sent by the app
+
+    Returns:
+        list: One result per item, in order, with its local_id, status
+            ('created', 'updated' or 'error'), id and errors
+    """
+    results = [None] * len(items)
+    parsed = {}
+    for index, item in enumerate(items):
+        data, errors = _parse_item(item)
+        local_id = item.get('local_id') if isinstance(item, dict) else None
+        if data is not None and data['local_id'] in parsed:
+            errors = ['local_id appears more than once in the batch']
+        if errors:
+            results[index] = {'local_id': local_id, 'status': 'error', 'id': None, 'errors': errors}
+        else:
+            parsed[data['local_id']] = (index, data)
+
+    # Everything the batch refers to, one query each
+    entries = [data for _, data in parsed.values()]
+    patient_ids = set(Profiles.objects.filter(
+        id__in={data['patient_id'] for data in entries}
+    ).values_list('id', flat=True))
+    appointments = {
+        appointment['id']: appointment
+        for appointment in Appointments.objects.filter(
+            id__in={data['appointment_id'] for data in entries if data['appointment_id']}
+        ).values('id', 'doctor_id', 'patient_id')
+    }
+    existing = {
+        prescription['local_id']: prescription
+        for prescription in Prescriptions.objects.filter(
+            local_id__in=list(parsed)
+        ).values('local_id', 'id', 'doctor_id')
+    }
+    # An appointment has at most one prescription
+    appointment_owner = dict(Prescriptions.objects.filter(
+        appointment_id__in=list(appointments)
+    ).values_list('appointment_id', 'local_id'))
+
+    to_write = []
+    claimed = {}
+    for local_id, (index, data) in parsed.items():
+        errors = []
+        current = existing.get(local_id)
+        if current is not None and current['doctor_id'] != doctor.id:
+            errors.append(OWNED_ELSEWHERE)
+        if data['patient_id'] not in patient_ids:
+            errors.append('Patient not found')
+        appointment_id = data['appointment_id']
+        if appointment_id is not None:
+            appointment = appointments.get(appointment_id)
+            if appointment is None:
+                errors.append('Appointment not found')
+            else:
+                if appointment['doctor_id'] != doctor.id:
+                    errors.append('You can only create prescriptions for your own appointments')
+                if appointment['patient_id'] != data['patient_id']:
+                    errors.append('Patient ID does not match the appointment')
+                owner = appointment_owner.get(appointment_id, claimed.get(appointment_id, local_id))
+                if owner != local_id:
+                    errors.append('This appointment already has a prescription')
+
+        if errors:
+            results[index] = {'local_id': local_id, 'status': 'error', 'id': None, 'errors': errors}
+            continue
+
+        if appointment_id is not None:
+            claimed[appointment_id] = local_id
+        to_write.append(Prescriptions(
+            id=current['id'] if current is not None else uuid.uuid4(),
+            doctor_id=doctor.id,
+            is_synced=True,
+            **data
+        ))
+
+    if to_write:
+        with transaction.atomic():
+            written = _upsert(to_write)
+            for prescription in to_write:
+                index = parsed[prescription.local_id][0]
+                prescription_id = written.get(prescription.local_id)
+                if prescription_id is None:
+                    # Taken by another doctor since it was checked
+                    results[index] = {
+                        'local_id': prescription.local_id, 'status': 'error', 'id': None, 'errors': [OWNED_ELSEWHERE],
+                    }
+                    continue
+                results[index] = {
+                    'local_id': prescription.local_id,
+                    # Another request of the same doctor may have created it since
+                    'status': 'updated' if prescription.local_id in existing or prescription_id != prescription.id else 'created',
+                    'id': prescription_id,
+                    'errors': [],
+                }
+                # No post_save on this path, queue the PDFs here
+                pdf_renderer.schedule(prescription_id)
+    return results
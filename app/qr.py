@@ -0,0 +1,134 @@
+"""
+Appointment QR codes
+
+Appointments store only the compact JSON payload of their QR code in
+Appointments.qr_code. The PNG is rendered on demand by AppointmentQRCodeView
+and cached by payload hash, in memory and optionally on disk (QR_CACHE_DIR).
+Rows written before this change still hold a base64 PNG data URI, which is
+served as is. With QR_CACHE_DIR set, new payloads are rendered to disk by a
+background task, so the first request for the image finds it ready.
+"""
+import base64
+import hashlib
+import json
+import os
+from functools import lru_cache
+from io import BytesIO
+
+import qrcode
+from django.conf import settings
+
+from .tasks import enqueue, task
+
+QR_PAYLOAD_VERSION = 1
+LEGACY_PREFIX = 'data:image/png;base64,'
+
+
+def build_qr_payload(appointment_id, patient, doctor, date, start_time, end_time, appointment_status):
+    """
+    Build the text encoded in an appointment's QR code
+
+    Args:
+        appointment_id: Appointment UUID
+        patient (Profiles): Patient profile
+        doctor (DoctorProfiles): Doctor profile, with its user loaded
+        date, start_time, end_time: Appointment slot (str or date/time)
+        appointment_status (str): Current status of the appointment
+
+    Returns:
+        str: Compact JSON payload
+    """
+    qr_data = {
+        'v': QR_PAYLOAD_VERSION,
+        'appointment_id': str(appointment_id),
+        'patient': {
+            'id': str(patient.id),
+            'name': patient.full_name,
+            'email': patient.email
+        },
+        'doctor': {
+            'id': str(doctor.id),
+            'name': doctor.user.full_name,
+            'specialty': doctor.specialty,
+            'hospital': doctor.hospital_name
+        },
+        'appointment': {
+            'date': str(date),
+            'start_time': str(start_time),
+            'end_time': str(end_time),
+            'status': appointment_status
+        }
+    }
+    return json.dumps(qr_data, separators=(',', ':'))
+
+
+def payload_digest(payload):
+    """Hash identifying a QR payload, used as cache key and ETag"""
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _render(payload):
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(payload)
+    qr.make(fit=True)
+
+    qr_image = qr.make_image(fill_color="black", back_color="white")
+    buffered = BytesIO()
+    qr_image.save(buffered, format="PNG")
+    return buffered.getvalue()
+
+
+@lru_cache(maxsize=settings.QR_CACHE_MAX_ENTRIES)
+def _get_png(digest, payload):
+    if payload.startswith(LEGACY_PREFIX):
+        return base64.b64decode(payload[len(LEGACY_PREFIX):])
+
+    cache_dir = settings.QR_CACHE_DIR
+    if not cache_dir:
+        return _render(payload)
+
+    path = os.path.join(cache_dir, f'{digest}.png')
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+
+    png = _render(payload)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write then rename so readers never see a partial file
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(png)
+    os.replace(tmp_path, path)
+    return png
+
+
+def get_qr_png(payload):
+    """
+    Get the PNG image for a stored QR payload
+
+    Args:
+        payload (str): Value of Appointments.qr_code
+
+    Returns:
+        tuple: (png bytes, payload digest)
+    """
+    digest = payload_digest(payload)
+    return _get_png(digest, payload), digest
+
+
+@task('qr.render')
+def render_qr(payload):
+    get_qr_png(payload)
+
+
+def prerender_qr(payload):
+    """Queue rendering a new payload, when rendered PNGs are kept on disk"""
+    if settings.QR_CACHE_DIR:
+        enqueue('qr.render', payload=payload)
@@ -0,0 +1,130 @@
+"""
+Versioned cache of read-mostly API responses
+
+Responses are kept in the Django cache named by RESPONSE_CACHE_ALIAS
+(locmem unless configured otherwise) together with the versions of the
+scopes they were built from, e.g. 'directory' or 'doctor:<id>'. Writes bump
+the versions of the scopes they touch (see app.signals), which makes every
+entry built before the write out of date without having to find it.
+
+Out of date and expired entries are served stale while a single request,
+the one winning a cache.add() lock, rebuilds them. Only a request finding
+no entry at all waits for the rebuild, so a popular key going cold causes
+one database query instead of one per concurrent request.
+"""
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+
+
+def _new_version():
+    return str(time.time_ns())
+
+
+class ResponseCache:
+    """Response data cache with per-scope versions and stale-while-revalidate"""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'rebuilds': 0, 'waits': 0, 'bumps': 0}
+
+    @property
+    def cache(self):
+        return caches[settings.RESPONSE_CACHE_ALIAS]
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def _versions(self, scopes):
+        """Current versions of scopes, starting the missing ones"""
+        keys = [f'{self.name}-ver:{scope}' for scope in scopes]
+        versions = self.cache.get_many(keys)
+        missing = [key for key in keys if key not in versions]
+        if missing:
+            # A lost version must never make older entries current again
+            for key in missing:
+                self.cache.add(key, _new_version(), None)
+            versions.update(self.cache.get_many(missing))
+        return tuple(versions.get(key) for key in keys)
+
+    def version(self, scope):
+        """Current version of a scope, changes on every bump"""
+        return self._versions([scope])[0]
+
+    def bump(self, *scopes):
+        """Make every entry built from these scopes out of date"""
+        self.cache.set_many({f'{self.name}-ver:{scope}': _new_version() for scope in scopes}, None)
+        self._count('bumps', len(scopes))
+
+    def get_or_build(self, key, scopes, build):
+        """
+        Get cached data, building it on a miss
+
+        Args:
+            key (str): Identifies the response, e.g. the request URL
+            scopes (list): Scopes the data is built from
+            build (callable): Returns the data, exceptions are not cached
+
+        Returns:
+            The data, possibly stale by up to one rebuild
+        """
+        entry_key = f'{self.name}:{hashlib.sha256(key.encode()).hexdigest()}'
+        versions = self._versions(scopes)
+        entry = self.cache.get(entry_key)
+
+        if entry is not None:
+            entry_versions, built_at, data = entry
+            if entry_versions == versions and time.time() - built_at < settings.RESPONSE_CACHE_FRESH_TTL:
+                self._count('hits')
+                return data
+
+        lock_key = f'{entry_key}:lock'
+        if self.cache.add(lock_key, 1, settings.RESPONSE_CACHE_LOCK_TIMEOUT):
+            self._count('misses' if entry is None else 'rebuilds')
+            try:
+                # Stored under the versions read before building, so a write
+                # landing meanwhile leaves the entry out of date
+                data = build()
+                self.cache.set(
+                    entry_key,
+                    (versions, time.time(), data),
+                    settings.RESPONSE_CACHE_FRESH_TTL + settings.RESPONSE_CACHE_STALE_TTL
+                )
+            finally:
+                self.cache.delete(lock_key)
+            return data
+
+        if entry is not None:
+            self._count('stale_hits')
+            return entry[2]
+
+        # Another request is building the first copy, wait for it
+        self._count('waits')
+        deadline = time.monotonic() + settings.RESPONSE_CACHE_LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            entry = self.cache.get(entry_key)
+            if entry is not None:
+                return entry[2]
+            if self.cache.get(lock_key) is None:
+                # The build failed, or the entry was evicted right away
+                break
+        return build()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        lookups = stats['hits'] + stats['stale_hits'] + stats['misses'] + stats['rebuilds'] + stats['waits']
+        stats['hit_rate'] = round((stats['hits'] + stats['stale_hits']) / lookups, 4) if lookups else None
+        return stats
+
+
+doctor_cache = ResponseCache('doctors')
+metrics.register('doctor_response_cache', doctor_cache.stats)
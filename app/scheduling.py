@@ -0,0 +1,266 @@
+"""
+Free-slot computation for doctor schedules
+
+Times are handled as seconds since midnight. A doctor's booked appointments
+are loaded with one query, sorted and merged into disjoint intervals once,
+and the slots of an availability window are then checked against them in a
+single sweep, so building a day's slots is O(slots + appointments) instead
+of comparing every slot with every appointment.
+"""
+from bisect import bisect_right
+from datetime import time, timedelta
+
+from .models import Appointments, DoctorAvailability
+
+# Appointments holding their slot, cancelled and past ones don't
+ACTIVE_STATUSES = (
+    Appointments.Status.SCHEDULED,
+    Appointments.Status.CONFIRMED,
+    Appointments.Status.IN_PROGRESS,
+)
+
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+
+def to_seconds(value):
+    """Seconds since midnight of a datetime.time"""
+    return value.hour * 3600 + value.minute * 60 + value.second
+
+
+def from_seconds(seconds):
+    """datetime.time for a number of seconds since midnight"""
+    return time(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def merge_intervals(intervals):
+    """
+    Sort intervals and merge the overlapping or touching ones
+
+    Args:
+        intervals (iterable): (start, end) pairs in seconds
+
+    Returns:
+        list: Disjoint (start, end) pairs in increasing order
+    """
+    merged = []
+    for start, end in sorted(intervals):
+        # An empty or inverted interval (bad row) blocks nothing
+        if start >= end:
+            continue
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+def free_slots(window_start, window_end, slot_duration, busy):
+    """
+    Slots of an availability window not overlapping any busy interval
+
+    Args:
+        window_start, window_end (int): Window bounds in seconds
+        slot_duration (int): Slot length in minutes
+        busy (list): Merged busy intervals, as returned by merge_intervals
+
+    Returns:
+        list: (start, end) pairs in seconds of the free slots
+    """
+    step = slot_duration * 60
+    if step <= 0:
+        return []
+
+    slots = []
+    i = 0
+    start = window_start
+    while start + step <= window_end:
+        end = start + step
+        # Busy intervals are sorted, those ending before this slot end
+        # before every later slot too
+        while i < len(busy) and busy[i][1] <= start:
+            i += 1
+        if i == len(busy) or busy[i][0] >= end:
+            slots.append((start, end))
+        start = end
+    return slots
+
+
+def window_slots(windows, busy):
+    """
+    Free slots of availability windows, as returned by DoctorAvailabilityView
+
+    Args:
+        windows (iterable): DoctorAvailability rows of a single day
+        busy (list): Merged busy intervals of that day
+
+    Returns:
+        list: {'day_of_week', 'start_time', 'end_time', 'duration'} dicts
+    """
+    slots = []
+    for window in windows:
+        for start, end in free_slots(
+            to_seconds(window.start_time),
+            to_seconds(window.end_time),
+            window.slot_duration,
+            busy
+        ):
+            slots.append({
+                'day_of_week': window.day_of_week,
+                'start_time': from_seconds(start).strftime('%H:%M'),
+                'end_time': from_seconds(end).strftime('%H:%M'),
+                'duration': window.slot_duration
+            })
+    return slots
+
+
+def is_free(busy, start, end):
+    """Whether [start, end) overlaps none of the merged busy intervals, False if it is empty"""
+    if start >= end:
+        return False
+    # Last busy interval starting before the end of the slot
+    i = bisect_right(busy, (end,)) - 1
+    return i < 0 or busy[i][1] <= start
+
+
+def availability_windows(doctor_id, day):
+    """
+    Availability windows of a doctor on a date
+
+    Returns:
+        list: (start, end) pairs in seconds, empty if the doctor doesn't
+            work that day
+    """
+    windows = DoctorAvailability.objects.filter(
+        doctor_id=doctor_id,
+        day_of_week=WEEKDAYS[day.weekday()],
+        is_available=True
+    ).values_list('start_time', 'end_time')
+    return [(to_seconds(start), to_seconds(end)) for start, end in windows]
+
+
+def within_windows(windows, start, end):
+    """Whether [start, end) lies inside one of the windows"""
+    return any(window_start <= start and end <= window_end for window_start, window_end in windows)
+
+
+def booked_intervals(doctor_id, appointment_date, exclude_id=None):
+    """
+    Merged busy intervals of a doctor on a date
+
+    Args:
+        doctor_id: DoctorProfiles id
+        appointment_date: Date to load
+        exclude_id: Appointment to ignore (the one being rescheduled)
+
+    Returns:
+        list: Disjoint (start, end) pairs in seconds
+    """
+    appointments = Appointments.objects.filter(
+        doctor_id=doctor_id,
+        appointment_date=appointment_date,
+        status__in=ACTIVE_STATUSES
+    )
+    if exclude_id is not None:
+        appointments = appointments.exclude(id=exclude_id)
+    return merge_intervals(
+        (to_seconds(start), to_seconds(end))
+        for start, end in appointments.values_list('start_time', 'end_time')
+    )
+
+
+def booked_intervals_by_date(doctor_id, date_from, date_to):
+    """
+    Merged busy intervals of a doctor for each date of a range
+
+    Args:
+        doctor_id: DoctorProfiles id
+        date_from, date_to (date): Range bounds, both included
+
+    Returns:
+        dict: date -> disjoint (start, end) pairs, dates without bookings
+            are left out
+    """
+    by_doctor = booked_intervals_by_doctor([doctor_id], date_from, date_to)
+    return next(iter(by_doctor.values()), {})
+
+
+def booked_intervals_by_doctor(doctor_ids, date_from, date_to):
+    """
+    Merged busy intervals of several doctors over a date range, in one query
+
+    Returns:
+        dict: doctor id -> {date -> disjoint (start, end) pairs}
+    """
+    appointments = Appointments.objects.filter(
+        doctor_id__in=doctor_ids,
+        appointment_date__range=(date_from, date_to),
+        status__in=ACTIVE_STATUSES
+    ).values_list('doctor_id', 'appointment_date', 'start_time', 'end_time')
+
+    intervals = {}
+    for doctor_id, appointment_date, start, end in appointments:
+        intervals.setdefault(doctor_id, {}).setdefault(appointment_date, []).append(
+            (to_seconds(start), to_seconds(end))
+        )
+    return {
+        doctor_id: {day: merge_intervals(day_intervals) for day, day_intervals in days.items()}
+        for doctor_id, days in intervals.items()
+    }
+
+
+def iter_free_slots(windows_by_day, busy_by_date, date_from, date_to, not_before=None):
+    """
+    Free slots of one doctor over a date range, in chronological order
+
+    Slots are computed a day at a time as the iterator is consumed, so
+    callers only interested in the first few pay for those days only.
+
+    Args:
+        windows_by_day (dict): Weekday name -> DoctorAvailability rows
+        busy_by_date (dict): date -> merged busy intervals
+        date_from, date_to (date): Range bounds, both included
+        not_before (tuple): (date, seconds), slots starting earlier are
+            skipped, e.g. the ones already past today
+
+    Yields:
+        tuple: (date, start, end, slot_duration), times in seconds
+    """
+    day = date_from
+    while day <= date_to:
+        busy = busy_by_date.get(day, [])
+        day_slots = []
+        for window in windows_by_day.get(WEEKDAYS[day.weekday()], []):
+            for start, end in free_slots(
+                to_seconds(window.start_time),
+                to_seconds(window.end_time),
+                window.slot_duration,
+                busy
+            ):
+                if not_before is None or (day, start) >= not_before:
+                    day_slots.append((start, end, window.slot_duration))
+        # Windows of a day may come in any order
+        day_slots.sort()
+        for start, end, slot_duration in day_slots:
+            yield day, start, end, slot_duration
+        day += timedelta(days=1)
+
+
+def booked_intervals_by_weekday(doctor_id):
+    """
+    Merged busy intervals of a doctor grouped by weekday, across all dates
+
+    Returns:
+        dict: Weekday name ('monday', ...) -> disjoint (start, end) pairs
+    """
+    appointments = Appointments.objects.filter(
+        doctor_id=doctor_id,
+        status__in=ACTIVE_STATUSES
+    ).values_list('appointment_date', 'start_time', 'end_time')
+
+    intervals = {}
+    for appointment_date, start, end in appointments:
+        intervals.setdefault(WEEKDAYS[appointment_date.weekday()], []).append(
+            (to_seconds(start), to_seconds(end))
+        )
+    return {day: merge_intervals(day_intervals) for day, day_intervals in intervals.items()}
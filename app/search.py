@@ -0,0 +1,256 @@
+"""
+Doctor search
+
+Every word of the query must match the doctor: as a prefix of a word of
+their name, specialty, hospital or bio, or, so that typos still find
+something, as a word close to one of their name, specialty or hospital.
+
+Typo matches are only tried for a word no indexed word starts with. A
+doctor scores, for every word, the weight of the best field it matched
+(FIELD_WEIGHTS, halved for a typo), summed over the words.
+
+On Postgres, prefixes are matched with full-text search and typos with
+pg_trgm word similarity, each branch served by a GIN index (see migration
+0006). Other databases (SQLite in tests) use an inverted index built in
+process from the doctor table, rebuilt whenever the doctor directory
+changes, with difflib standing in for pg_trgm.
+
+Results are ordered by (score desc, id) so they can be paginated with
+keyset cursors. Every matching doctor is scored before the page is cut,
+so a search costs in proportion to the doctors it matches, not to the
+page: a common surname or specialty at 100k doctors takes about 100 ms
+on Postgres (see DoctorSearchBenchmark).
+"""
+import difflib
+import heapq
+import math
+import re
+import threading
+from bisect import bisect_left, bisect_right
+
+from django.db import connection
+
+from .models import DoctorProfiles
+from .response_cache import doctor_cache
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+# Relative weight of a match in each field
+FIELD_WEIGHTS = (
+    ('user__full_name', 1.0),
+    ('specialty', 1.0),
+    ('hospital_name', 0.4),
+    ('bio', 0.1),
+)
+# Fields a word may match with a typo, like the pg_trgm indexes
+TYPO_FIELDS = ('user__full_name', 'specialty', 'hospital_name')
+# Minimum difflib ratio of a typo match
+TYPO_CUTOFF = 0.75
+# Score factor of a typo match found by similarity
+FUZZY_FACTOR = 0.5
+
+
+def tokenize(text):
+    """Lowercase words of a text"""
+    return _WORD.findall(text.lower()) if text else []
+
+
+_SEARCH_SQL = """
+WITH words AS (
+    SELECT word, position, to_tsquery('simple', word || ':*') AS tsq
+    FROM unnest(%(words)s::text[]) WITH ORDINALITY AS query(word, position)
+),
+prefix_matches AS (
+    SELECT w.position, d.id, %(full_name)s AS weight
+    FROM words w, profiles p JOIN doctor_profiles d ON d.user_id = p.id
+    WHERE to_tsvector('simple', coalesce(p.full_name, '')) @@ w.tsq
+    UNION ALL
+    SELECT w.position, d.id, %(specialty)s
+    FROM words w, doctor_profiles d
+    WHERE to_tsvector('simple', coalesce(d.specialty, '')) @@ w.tsq
+    UNION ALL
+    SELECT w.position, d.id, %(hospital_name)s
+    FROM words w, doctor_profiles d
+    WHERE to_tsvector('simple', coalesce(d.hospital_name, '')) @@ w.tsq
+    UNION ALL
+    SELECT w.position, d.id, %(bio)s
+    FROM words w, doctor_profiles d
+    WHERE to_tsvector('simple', coalesce(d.bio, '')) @@ w.tsq
+),
+typo_words AS (
+    SELECT word, position
+    FROM words
+    WHERE position NOT IN (SELECT position FROM prefix_matches)
+),
+matches AS (
+    SELECT position, id, weight
+    FROM prefix_matches
+    UNION ALL
+    SELECT w.position, d.id, %(full_name)s * %(fuzzy)s
+    FROM typo_words w, profiles p JOIN doctor_profiles d ON d.user_id = p.id
+    WHERE p.full_name %%> w.word
+    UNION ALL
+    SELECT w.position, d.id, %(specialty)s * %(fuzzy)s
+    FROM typo_words w, doctor_profiles d
+    WHERE d.specialty %%> w.word
+    UNION ALL
+    SELECT w.position, d.id, %(hospital_name)s * %(fuzzy)s
+    FROM typo_words w, doctor_profiles d
+    WHERE d.hospital_name %%> w.word
+),
+scored AS (
+    -- Best match of each word, doctors matched by every word
+    SELECT id, sum(weight)::float8 AS score
+    FROM (SELECT position, id, max(weight) AS weight FROM matches GROUP BY position, id) best
+    GROUP BY id
+    HAVING count(*) = %(word_count)s
+)
+SELECT id, score
+FROM scored
+{after}
+ORDER BY score DESC, id
+LIMIT %(limit)s
+"""
+
+
+def _search_postgres(words, limit, after):
+    params = {
+        'words': words,
+        'word_count': len(words),
+        'fuzzy': FUZZY_FACTOR,
+        'limit': limit,
+    }
+    params.update((field.rsplit('__', 1)[-1], weight) for field, weight in FIELD_WEIGHTS)
+    after_sql = ''
+    if after is not None:
+        after_sql = 'WHERE score < %(after_score)s::float8 OR (score = %(after_score)s::float8 AND id > %(after_id)s::uuid)'
+        params['after_score'], params['after_id'] = after
+
+    with connection.cursor() as cursor:
+        cursor.execute(_SEARCH_SQL.format(after=after_sql), params)
+        return [(doctor_id, score) for doctor_id, score in cursor.fetchall()]
+
+
+def _post(postings, word, number, weight):
+    doctors = postings.setdefault(word, {})
+    doctors[number] = max(doctors.get(number, 0.0), weight)
+
+
+class InvertedIndex:
+    """
+    Word -> doctors postings over the searchable doctor fields
+
+    Doctors are numbered in the order of their id as a string, the tie
+    breaker of the results, so postings and ranking work on small ints.
+    """
+
+    def __init__(self, rows):
+        rows = sorted(rows, key=lambda row: str(row['id']))
+        self.ids = [row['id'] for row in rows]
+        self.postings = {}
+        # Postings of the fields a word may match with a typo
+        self.typo_postings = {}
+        for number, row in enumerate(rows):
+            for field, weight in FIELD_WEIGHTS:
+                for word in tokenize(row[field]):
+                    _post(self.postings, word, number, weight)
+                    if field in TYPO_FIELDS:
+                        _post(self.typo_postings, word, number, weight)
+        self.vocabulary = sorted(self.postings)
+        # Typo candidates by length, words too short or too long to reach
+        # the similarity cutoff are never compared
+        self.typo_vocabulary = {}
+        for word in sorted(self.typo_postings):
+            self.typo_vocabulary.setdefault(len(word), []).append(word)
+
+    def _typo_candidates(self, word):
+        # ratio = 2 * matches / (len(a) + len(b)) <= 2 * min / (len(a) + len(b))
+        shortest = math.ceil(len(word) * TYPO_CUTOFF / (2 - TYPO_CUTOFF))
+        longest = math.floor(len(word) * (2 - TYPO_CUTOFF) / TYPO_CUTOFF)
+        return [
+            candidate for length in range(shortest, longest + 1)
+            for candidate in self.typo_vocabulary.get(length, ())
+        ]
+
+    def _matching_words(self, word):
+        """Postings of the words starting with word, else close to it, with their score factor"""
+        start = bisect_left(self.vocabulary, word)
+        end = start
+        while end < len(self.vocabulary) and self.vocabulary[end].startswith(word):
+            end += 1
+        if end > start:
+            return [(self.postings[match], 1.0) for match in self.vocabulary[start:end]]
+        return [
+            (self.typo_postings[match], FUZZY_FACTOR)
+            for match in difflib.get_close_matches(word, self._typo_candidates(word), n=3, cutoff=TYPO_CUTOFF)
+        ]
+
+    def search(self, words, limit, after=None):
+        """
+        Returns:
+            list: (doctor id, score) of the first `limit` doctors matching
+                every word after `after`, ordered by score desc, id
+        """
+        scores = None
+        for word in words:
+            # A doctor scores once per query word, with its best match
+            best = {}
+            for postings, factor in self._matching_words(word):
+                for number, weight in postings.items():
+                    best[number] = max(best.get(number, 0.0), weight * factor)
+            if scores is None:
+                scores = best
+            else:
+                scores = {number: score + best[number] for number, score in scores.items() if number in best}
+            if not scores:
+                return []
+        results = scores.items()
+        if after is not None:
+            after_score = after[0]
+            # Number the id would have, ties after it come after the cursor
+            after_number = bisect_right(self.ids, str(after[1]), key=str) - 1
+            results = [
+                (number, score) for number, score in results
+                if score < after_score or (score == after_score and number > after_number)
+            ]
+        # Only the page is sorted, not every match
+        page = heapq.nsmallest(limit, results, key=lambda item: (-item[1], item[0]))
+        return [(self.ids[number], score) for number, score in page]
+
+
+_index = None
+_index_version = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """The in-process index, rebuilt when the doctor directory changed"""
+    global _index, _index_version
+    version = doctor_cache.version('directory')
+    with _index_lock:
+        if _index is None or _index_version != version:
+            rows = DoctorProfiles.objects.values('id', *(field for field, _ in FIELD_WEIGHTS))
+            _index = InvertedIndex(rows)
+            _index_version = version
+        return _index
+
+
+def search_doctors(text, limit, after=None):
+    """
+    Search doctors by name, specialty, hospital and bio
+
+    Args:
+        text (str): Search query
+        limit (int): Maximum number of results
+        after (tuple): (score, id) of the last result of the previous page
+
+    Returns:
+        list: (doctor id, score) pairs, best first
+    """
+    # A repeated word changes nothing, and must not count twice above
+    words = list(dict.fromkeys(tokenize(text)))
+    if not words:
+        return []
+    if connection.vendor == 'postgresql':
+        return _search_postgres(words, limit, after)
+    return get_index().search(words, limit, after)
@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from django.urls import reverse
 from .models import (
     Profiles, 
     DoctorProfiles, 
@@ -58,9 +59,18 @@ class DoctorProfileSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
     
     
+def appointment_qr_url(appointment_id, request=None):
+    """URL of AppointmentQRCodeView for an appointment, absolute if a request is given"""
+    url = reverse('appointment-qr', args=[appointment_id])
+    return request.build_absolute_uri(url) if request is not None else url
+
+
 class AppointmentSerializer(serializers.ModelSerializer):
-    patient_id = serializers.UUIDField(source='patient.id',read_only=True)
-    doctor_id = serializers.UUIDField(source='doctor.id',read_only=True)
+    # Read the FK columns directly, going through the relations loads them row by row
+    patient_id = serializers.UUIDField(read_only=True)
+    doctor_id = serializers.UUIDField(read_only=True)
+    # qr_code holds the QR payload, the image itself is served from here
+    qr_code_url = serializers.SerializerMethodField()
 
     class Meta:
         model = Appointments
@@ -69,15 +79,29 @@ class AppointmentSerializer(serializers.ModelSerializer):
                  'id',
                  'patient', 'doctor', 'patient_id', 'doctor_id', 
                  'appointment_date', 'start_time', 'end_time', 'status', 
-                 'reason', 'notes', 'qr_code', 'created_at', 'updated_at']
+                 'reason', 'notes', 'qr_code', 'qr_code_url', 'created_at', 'updated_at']
         read_only_fields = ['created_at', 'updated_at']
 
+    def get_fields(self):
+        fields = super().get_fields()
+        # Lets list endpoints leave out heavy columns they deferred
+        for name in self.context.get('omit_fields', ()):
+            fields.pop(name, None)
+        return fields
+
+    def get_qr_code_url(self, obj):
+        """URL of the rendered QR code image"""
+        # Don't load a deferred qr_code just to check it is set
+        if 'qr_code' not in obj.get_deferred_fields() and not obj.qr_code:
+            return None
+        return appointment_qr_url(obj.id, self.context.get('request'))
+
 
 
 class PrescriptionSerializer(serializers.ModelSerializer):
-    patient_id = serializers.UUIDField(source='patient.id', read_only=True)
-    doctor_id = serializers.UUIDField(source='doctor.id', read_only=True)
-    appointment_id = serializers.UUIDField(source='appointment.id', read_only=True)
+    patient_id = serializers.UUIDField(read_only=True)
+    doctor_id = serializers.UUIDField(read_only=True)
+    appointment_id = serializers.UUIDField(read_only=True)
 
     class Meta:
         model = Prescriptions
@@ -0,0 +1,125 @@
+"""
+Signal handlers keeping cached data in sync with the tables
+
+Connected in AppConfig.ready(). Invalidations run once the surrounding
+transaction commits, so a concurrent request can't cache the old data again
+between the invalidation and the commit. Sync tombstones and background
+tasks are written in the current transaction instead, so they are committed
+or rolled back with it.
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+from django.utils.dateparse import parse_date
+
+from .models import (
+    Appointments,
+    DoctorAvailability,
+    DoctorProfiles,
+    Notifications,
+    Prescriptions,
+    Profiles,
+    SyncTombstone,
+)
+from .prescription_pdf import pdf_renderer
+from .response_cache import doctor_cache
+from .slot_cache import slot_cache
+from .sync import doctor_user_ids, write_tombstones
+
+
+def _slot_of(appointment):
+    # Read __dict__ so deferred fields are never loaded just for this
+    appointment_date = appointment.__dict__.get('appointment_date')
+    if isinstance(appointment_date, str):
+        # Views assign the raw request value, normalize it to match cache keys
+        appointment_date = parse_date(appointment_date)
+    return appointment.__dict__.get('doctor_id'), appointment_date
+
+
+@receiver(post_init, sender=Appointments)
+def remember_appointment_slot(sender, instance, **kwargs):
+    """Keep the loaded doctor and date, to invalidate them if they change"""
+    instance._initial_slot = _slot_of(instance)
+
+
+@receiver(post_save, sender=Appointments)
+def appointment_saved(sender, instance, **kwargs):
+    slots = {_slot_of(instance), getattr(instance, '_initial_slot', (None, None))}
+    instance._initial_slot = _slot_of(instance)
+
+    def invalidate():
+        for doctor_id, appointment_date in slots:
+            if doctor_id is not None and appointment_date is not None:
+                slot_cache.invalidate_date(doctor_id, appointment_date)
+
+    transaction.on_commit(invalidate)
+
+
+@receiver(post_delete, sender=Appointments)
+def appointment_deleted(sender, instance, **kwargs):
+    doctor_id, appointment_date = _slot_of(instance)
+    if doctor_id is not None and appointment_date is not None:
+        transaction.on_commit(lambda: slot_cache.invalidate_date(doctor_id, appointment_date))
+
+
+@receiver(post_save, sender=DoctorAvailability)
+@receiver(post_delete, sender=DoctorAvailability)
+def availability_changed(sender, instance, **kwargs):
+    doctor_id = instance.__dict__.get('doctor_id')
+    if doctor_id is not None:
+        def invalidate():
+            slot_cache.invalidate_doctor(doctor_id)
+            doctor_cache.bump('directory', f'doctor:{doctor_id}')
+
+        transaction.on_commit(invalidate)
+
+
+@receiver(post_save, sender=DoctorProfiles)
+@receiver(post_delete, sender=DoctorProfiles)
+def doctor_profile_changed(sender, instance, **kwargs):
+    doctor_id = instance.pk
+    transaction.on_commit(lambda: doctor_cache.bump('directory', f'doctor:{doctor_id}'))
+
+
+@receiver(post_save, sender=Profiles)
+@receiver(post_delete, sender=Profiles)
+def profile_changed(sender, instance, **kwargs):
+    """Doctor responses embed the doctor's name, email, phone and avatar"""
+    user_id = instance.pk
+
+    def invalidate():
+        # Looked up rather than trusting user_type, which may just have changed
+        doctor_ids = list(DoctorProfiles.objects.filter(user_id=user_id).values_list('id', flat=True))
+        if doctor_ids:
+            doctor_cache.bump('directory', *(f'doctor:{doctor_id}' for doctor_id in doctor_ids))
+
+    transaction.on_commit(invalidate)
+
+
+@receiver(post_save, sender=Prescriptions)
+def prescription_saved(sender, instance, **kwargs):
+    """Render the PDF of the saved version, queued with the save"""
+    pdf_renderer.schedule(instance.pk)
+
+
+@receiver(post_delete, sender=Appointments)
+@receiver(post_delete, sender=Prescriptions)
+def patient_record_deleted(sender, instance, **kwargs):
+    """Seen by the patient and by the doctor"""
+    entity = SyncTombstone.Entity.APPOINTMENT if sender is Appointments else SyncTombstone.Entity.PRESCRIPTION
+    owners = [instance.__dict__.get('patient_id'), *doctor_user_ids([instance.__dict__.get('doctor_id')])]
+    write_tombstones(entity, instance.pk, owners)
+
+
+@receiver(post_delete, sender=Notifications)
+def notification_deleted(sender, instance, **kwargs):
+    write_tombstones(SyncTombstone.Entity.NOTIFICATION, instance.pk, [instance.__dict__.get('user_id')])
+
+
+@receiver(post_delete, sender=DoctorAvailability)
+def availability_deleted(sender, instance, **kwargs):
+    write_tombstones(
+        SyncTombstone.Entity.AVAILABILITY,
+        instance.pk,
+        doctor_user_ids([instance.__dict__.get('doctor_id')])
+    )
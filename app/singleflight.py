@@ -0,0 +1,79 @@
+"""
+Duplicate call suppression
+
+Concurrent callers asking for the same key share one in-flight call: the
+first caller runs the function, the others wait for it and get its result
+(or its exception). Nothing is remembered once the call returns; caching is
+the caller's job. Works across threads, so it covers threaded WSGI workers
+as well as sync views run from ASGI through asgiref's thread pools.
+"""
+import threading
+
+from asgiref.sync import sync_to_async
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Group:
+    """A namespace of keys whose concurrent calls are coalesced"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._counters = {'calls': 0, 'shared': 0}
+
+    def do(self, key, fn):
+        """
+        Run fn() unless a call for the same key is already in flight
+
+        Args:
+            key: Hashable identifier of the work
+            fn (callable): Zero-argument function doing the work
+
+        Returns:
+            The result of the (possibly shared) call
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self._counters['calls'] += 1
+            else:
+                self._counters['shared'] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    async def ado(self, key, fn):
+        """Async flavour of do(), waiting in a worker thread so the event loop stays free"""
+        return await sync_to_async(self.do, thread_sensitive=False)(key, fn)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Upstream calls made, callers that piggybacked on them and
+            calls currently in flight
+        """
+        with self._lock:
+            return dict(self._counters, in_flight=len(self._calls))
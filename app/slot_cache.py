@@ -0,0 +1,138 @@
+"""
+Cache of computed free slots
+
+DoctorAvailabilityView keeps the free slots of each (doctor, date) in the
+Django cache named by SLOT_CACHE_ALIAS, so repeated calendar views cost no
+database work. Entries are invalidated when the data they come from changes
+(see app.signals):
+
+- an appointment is created, moved, has its status changed or is deleted:
+  the entries of its old and new dates go
+- an availability window changes: every entry of the doctor goes
+
+Invalidation never deletes anything, it moves the doctor or the date to a
+new version that is part of the entry keys. Readers note the versions
+before querying the database and store their result under those, so a
+result computed from data that changed meanwhile is stored under a key
+nobody reads anymore. SLOT_CACHE_TTL bounds how long an entry can live if
+an invalidation is ever missed, e.g. after a raw SQL write.
+"""
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+
+
+def _new_version():
+    return str(time.time_ns())
+
+
+class SlotCache:
+    """Free slots per (doctor, date), with hit and invalidation counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._date_invalidations = 0
+        self._doctor_invalidations = 0
+
+    @property
+    def cache(self):
+        return caches[settings.SLOT_CACHE_ALIAS]
+
+    def _doctor_key(self, doctor_id):
+        # Query params and model fields spell the same UUID differently
+        try:
+            return str(uuid.UUID(str(doctor_id)))
+        except ValueError:
+            return str(doctor_id)
+
+    def _versions(self, version_keys):
+        """Current value of version keys, starting the missing ones"""
+        versions = self.cache.get_many(version_keys)
+        missing = [key for key in version_keys if key not in versions]
+        if missing:
+            # A lost version must never fall back to older entries
+            for key in missing:
+                self.cache.add(key, _new_version(), settings.SLOT_CACHE_TTL)
+            versions.update(self.cache.get_many(missing))
+        return versions
+
+    def _entry_keys(self, doctor_id, dates):
+        """
+        Returns:
+            dict: date -> key of its entry under the current versions
+        """
+        doctor = self._doctor_key(doctor_id)
+        doctor_version_key = f'slots-ver:{doctor}'
+        date_version_keys = {date: f'slots-ver:{doctor}:{date}' for date in dates}
+        versions = self._versions([doctor_version_key, *date_version_keys.values()])
+        doctor_version = versions.get(doctor_version_key, '')
+        return {
+            date: f'slots:{doctor}:{doctor_version}:{date}:{versions.get(key, "")}'
+            for date, key in date_version_keys.items()
+        }
+
+    def get_many(self, doctor_id, dates):
+        """
+        Get the cached free slots of a doctor on several dates
+
+        Args:
+            doctor_id: DoctorProfiles id
+            dates (list): date objects or 'YYYY-MM-DD' strings
+
+        Returns:
+            tuple: (dict of date -> list of slots for the dates found, stamp
+                to pass to set_many for the others)
+        """
+        stamp = self._entry_keys(doctor_id, dates)
+        found = self.cache.get_many(list(stamp.values()))
+        with self._lock:
+            self._hits += len(found)
+            self._misses += len(stamp) - len(found)
+        return {date: found[key] for date, key in stamp.items() if key in found}, stamp
+
+    def set_many(self, slots_by_date, stamp):
+        """
+        Store free slots computed after a get_many
+
+        Args:
+            slots_by_date (dict): date -> JSON-serializable list of slots
+            stamp (dict): Returned by get_many before the data was read
+        """
+        self.cache.set_many(
+            {stamp[date]: slots for date, slots in slots_by_date.items()},
+            settings.SLOT_CACHE_TTL
+        )
+
+    def invalidate_date(self, doctor_id, date):
+        """Invalidate the entry of one doctor and date"""
+        self.cache.set(f'slots-ver:{self._doctor_key(doctor_id)}:{date}', _new_version(), settings.SLOT_CACHE_TTL)
+        with self._lock:
+            self._date_invalidations += 1
+
+    def invalidate_doctor(self, doctor_id):
+        """Invalidate every entry of a doctor"""
+        self.cache.set(f'slots-ver:{self._doctor_key(doctor_id)}', _new_version(), settings.SLOT_CACHE_TTL)
+        with self._lock:
+            self._doctor_invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 4) if lookups else None,
+                'date_invalidations': self._date_invalidations,
+                'doctor_invalidations': self._doctor_invalidations,
+            }
+
+
+slot_cache = SlotCache()
+metrics.register('slot_cache', slot_cache.stats)
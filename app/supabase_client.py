@@ -0,0 +1,219 @@
+"""
+Shared HTTP client for the Supabase auth API
+
+Every call goes through one pooled requests.Session, so TLS connections are
+kept alive between requests. Calls have connect/read timeouts, idempotent
+calls are retried a bounded number of times with jittered backoff, and the
+latency of every call is recorded for MetricsView.
+
+Each call also has a deadline budget covering all of its attempts, and runs
+behind a circuit breaker so that a slow or failing Supabase makes callers
+fail fast with SupabaseUnavailable instead of tying up every worker. Token
+checks, logins and sign-ups have a breaker each, so failing sign-ups don't
+stop tokens from being verified.
+"""
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from . import metrics
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
+
+# Retrying these is safe: the request has no side effect upstream
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS'})
+RETRY_STATUS_CODES = frozenset({502, 503, 504})
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _breaker(name):
+    return CircuitBreaker(
+        name,
+        failure_threshold=settings.SUPABASE_BREAKER_FAILURE_THRESHOLD,
+        recovery_timeout=settings.SUPABASE_BREAKER_RECOVERY_TIMEOUT,
+        half_open_max_calls=settings.SUPABASE_BREAKER_HALF_OPEN_MAX_CALLS,
+    )
+
+
+# Token checks (/auth/v1/user and the JWKS), logins and sign-ups
+verify_breaker = _breaker('supabase_verify')
+login_breaker = _breaker('supabase_login')
+signup_breaker = _breaker('supabase_signup')
+
+
+class SupabaseUnavailable(Exception):
+    """Supabase could not be reached in time, or the circuit breaker is open"""
+
+
+def get_session():
+    """Return the process-wide pooled session"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=settings.SUPABASE_HTTP_POOL_CONNECTIONS,
+                    pool_maxsize=settings.SUPABASE_HTTP_POOL_MAXSIZE,
+                    max_retries=0,
+                )
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers.update({'apikey': settings.SUPABASE_KEY})
+                _session = session
+    return _session
+
+
+class _LatencyRecorder:
+    """Per-endpoint call counts and a window of recent latencies"""
+
+    def __init__(self, window=1000):
+        self.window = window
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds, error=False, retries=0):
+        with self._lock:
+            entry = self._endpoints.get(endpoint)
+            if entry is None:
+                entry = {'calls': 0, 'errors': 0, 'retries': 0, 'latencies': deque(maxlen=self.window)}
+                self._endpoints[endpoint] = entry
+            entry['calls'] += 1
+            entry['errors'] += int(error)
+            entry['retries'] += retries
+            entry['latencies'].append(seconds)
+
+    def stats(self):
+        with self._lock:
+            snapshot = {name: dict(entry, latencies=sorted(entry['latencies'])) for name, entry in self._endpoints.items()}
+
+        result = {}
+        for name, entry in snapshot.items():
+            latencies = entry.pop('latencies')
+            if latencies:
+                entry['p50_ms'] = round(latencies[int(0.50 * (len(latencies) - 1))] * 1000, 2)
+                entry['p99_ms'] = round(latencies[int(0.99 * (len(latencies) - 1))] * 1000, 2)
+                entry['max_ms'] = round(latencies[-1] * 1000, 2)
+            result[name] = entry
+        return result
+
+
+_latency = _LatencyRecorder()
+metrics.register('supabase_http', _latency.stats)
+
+
+def _backoff(attempt):
+    """Full-jitter exponential backoff, in seconds"""
+    ceiling = min(settings.SUPABASE_HTTP_BACKOFF_MAX, settings.SUPABASE_HTTP_BACKOFF_BASE * (2 ** attempt))
+    return random.uniform(0, ceiling)
+
+
+def request(method, path, endpoint, breaker, deadline=None, **kwargs):
+    """
+    Call the Supabase API through the pooled session
+
+    Args:
+        method (str): HTTP method
+        path (str): Path below SUPABASE_URL, e.g. "/auth/v1/user", or an
+            absolute URL of the project (the apikey header is sent along)
+        endpoint (str): Name the call is recorded under in the metrics
+        breaker (CircuitBreaker): Breaker of this kind of call
+        deadline (float): time.monotonic() value by which all attempts must
+            be done, SUPABASE_HTTP_DEADLINE seconds from now by default
+        **kwargs: Passed on to requests (headers, json, params, ...)
+
+    Returns:
+        requests.Response: The last response received (5xx included)
+
+    Raises:
+        SupabaseUnavailable: The circuit is open, Supabase could not be
+            reached or the deadline ran out
+    """
+    method = method.upper()
+    retries = settings.SUPABASE_HTTP_RETRIES if method in IDEMPOTENT_METHODS else 0
+    url = path if path.startswith(('http://', 'https://')) else f"{settings.SUPABASE_URL}{path}"
+    session = get_session()
+
+    started = time.monotonic()
+    if deadline is None:
+        deadline = started + settings.SUPABASE_HTTP_DEADLINE
+
+    try:
+        breaker.before_call()
+    except CircuitOpenError as e:
+        _latency.record(endpoint, 0.0, error=True)
+        raise SupabaseUnavailable(str(e)) from e
+
+    recorded = False
+    try:
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            timeout = (
+                min(settings.SUPABASE_HTTP_CONNECT_TIMEOUT, remaining),
+                min(settings.SUPABASE_HTTP_READ_TIMEOUT, remaining),
+            )
+            try:
+                if remaining <= 0:
+                    raise requests.Timeout(f"Deadline exceeded calling {endpoint}")
+                response = session.request(method, url, timeout=timeout, **kwargs)
+            except requests.RequestException as e:
+                error = e
+                response = None
+            else:
+                error = None
+
+            pause = _backoff(attempt)
+            give_up = attempt >= retries or time.monotonic() + pause >= deadline
+
+            if error is not None and give_up:
+                breaker.record_failure()
+                recorded = True
+                _latency.record(endpoint, time.monotonic() - started, error=True, retries=attempt)
+                raise SupabaseUnavailable(str(error)) from error
+
+            if response is not None and (response.status_code not in RETRY_STATUS_CODES or give_up):
+                if response.status_code >= 500:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                recorded = True
+                _latency.record(endpoint, time.monotonic() - started, error=response.status_code >= 500, retries=attempt)
+                return response
+
+            time.sleep(pause)
+            attempt += 1
+    finally:
+        # Interrupted by something other than the upstream, free the probe
+        if not recorded:
+            breaker.release()
+
+
+def get_user(token):
+    """GET /auth/v1/user for the given access token"""
+    return request('GET', '/auth/v1/user', 'auth.user', verify_breaker, headers={'Authorization': f'Bearer {token}'})
+
+
+def get_jwks():
+    """GET SUPABASE_JWKS_URL, the project's public signing keys"""
+    return request('GET', settings.SUPABASE_JWKS_URL, 'auth.jwks', verify_breaker)
+
+
+def sign_in_with_password(email, password):
+    """POST /auth/v1/token?grant_type=password"""
+    return request(
+        'POST', '/auth/v1/token', 'auth.token', login_breaker,
+        params={'grant_type': 'password'},
+        json={'email': email, 'password': password},
+    )
+
+
+def sign_up(payload):
+    """POST /auth/v1/signup"""
+    return request('POST', '/auth/v1/signup', 'auth.signup', signup_breaker, json=payload)
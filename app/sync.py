@@ -0,0 +1,217 @@
+"""
+Delta sync feed for the mobile app
+
+Instead of downloading every appointment, prescription and notification
+again, clients send back the cursor of their last sync and get the rows
+created or updated since, plus tombstones of the rows deleted since (see
+SyncTombstone). Each entity is read in (updated_at, id) order from an index
+on (owner, updated_at, id), so a sync costs as much as what changed.
+
+The cursor holds the position reached in every entity, so entities can be
+paged independently until the client has caught up, and the time the client
+was last fully caught up. Tombstones are kept SYNC_TOMBSTONE_RETENTION_DAYS
+(manage.py prune_sync_tombstones deletes older ones); a cursor last caught
+up before that may have missed deletions and gets 410, the client then
+syncs again from scratch.
+
+Notifications are served once, when created: the table has no updated_at,
+so is_read changes are not in the feed. Clients keep their own read state.
+"""
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import (
+    Appointments,
+    DoctorAvailability,
+    DoctorProfiles,
+    Notifications,
+    Prescriptions,
+    SyncTombstone,
+)
+from .pagination import decode_cursor, encode_cursor, keyset_filter, row_values
+
+# Cursor entry holding the time the client was last caught up
+SYNCED_AT = 'synced_at'
+
+# Type of the row ids of each entity of owner_filters()
+ID_TYPES = {
+    'appointments': uuid.UUID,
+    'prescriptions': uuid.UUID,
+    'notifications': uuid.UUID,
+    'availability': uuid.UUID,
+    'deleted': int,
+}
+
+
+def doctor_user_ids(doctor_ids):
+    """Profile ids of the users of these doctor profiles"""
+    return list(DoctorProfiles.objects.filter(id__in=doctor_ids).values_list('user_id', flat=True))
+
+
+def write_tombstones(entity, object_id, owner_ids):
+    """Record the deletion of a row for every user who could see it"""
+    SyncTombstone.objects.bulk_create([
+        SyncTombstone(entity=entity, object_id=object_id, owner_id=owner_id)
+        for owner_id in set(owner_ids) if owner_id is not None
+    ])
+
+
+def owner_filters(principal):
+    """
+    Rows of each entity visible to the caller
+
+    Returns:
+        dict: Entity name -> (queryset, timestamp field)
+    """
+    user_id = principal.user_id
+    doctor = principal.doctor_profile
+
+    own = Q(patient_id=user_id)
+    if doctor is not None:
+        own |= Q(doctor_id=doctor.id)
+
+    entities = {
+        'appointments': (Appointments.objects.filter(own).defer('qr_code'), 'updated_at'),
+        'prescriptions': (Prescriptions.objects.filter(own), 'updated_at'),
+        # Notifications are never edited apart from is_read, which clients set
+        'notifications': (Notifications.objects.filter(user_id=user_id).select_related('user'), 'created_at'),
+        'deleted': (SyncTombstone.objects.filter(owner_id=user_id), 'deleted_at'),
+    }
+    if doctor is not None:
+        entities['availability'] = (DoctorAvailability.objects.filter(doctor_id=doctor.id), 'updated_at')
+    return entities
+
+
+def _parse_timestamp(timestamp):
+    if not isinstance(timestamp, str):
+        raise ValueError('Invalid cursor')
+    # Raises ValueError itself for well formed but impossible dates
+    timestamp = parse_datetime(timestamp)
+    if timestamp is None or timezone.is_naive(timestamp):
+        raise ValueError('Invalid cursor')
+    return timestamp
+
+
+def _parse_position(entity, timestamp, row_id):
+    """[timestamp, id] of a cursor entry, as the datetime and id type they compare with"""
+    timestamp = _parse_timestamp(timestamp)
+    if ID_TYPES[entity] is int:
+        if not isinstance(row_id, int) or isinstance(row_id, bool):
+            raise ValueError('Invalid cursor')
+    else:
+        if not isinstance(row_id, str):
+            raise ValueError('Invalid cursor')
+        row_id = uuid.UUID(row_id)
+    return [timestamp, row_id]
+
+
+def parse_sync_cursor(cursor):
+    """
+    Decode a sync cursor
+
+    Returns:
+        tuple: ({entity: [timestamp, id]}, time the client was last caught
+            up or None)
+
+    Raises:
+        ValueError: The cursor is malformed
+    """
+    if not cursor:
+        return {}, None
+    positions = {}
+    synced_at = None
+    for entry in decode_cursor(cursor):
+        if isinstance(entry, list) and len(entry) == 2 and entry[0] == SYNCED_AT:
+            synced_at = _parse_timestamp(entry[1])
+            continue
+        if not isinstance(entry, list) or len(entry) != 3 or entry[0] not in ID_TYPES:
+            raise ValueError('Invalid cursor')
+        positions[entry[0]] = _parse_position(*entry)
+    return positions, synced_at
+
+
+def tombstone_cutoff():
+    """Tombstones older than this are pruned, and cursors last caught up before it expired"""
+    return timezone.now() - timedelta(days=settings.SYNC_TOMBSTONE_RETENTION_DAYS)
+
+
+def cursor_expired(synced_at):
+    """
+    Whether a cursor may have missed pruned tombstones
+
+    Args:
+        synced_at (datetime): From parse_sync_cursor, None for cursors
+            without it
+    """
+    return synced_at is None or synced_at < tombstone_cutoff()
+
+
+def prune_tombstones():
+    """
+    Delete the tombstones older than the retention
+
+    Returns:
+        int: Number deleted
+    """
+    # Tombstones committed late can be older than the position of the
+    # sync that missed them, by up to SYNC_SETTLE_SECONDS
+    cutoff = tombstone_cutoff() - timedelta(seconds=settings.SYNC_SETTLE_SECONDS)
+    deleted, _ = SyncTombstone.objects.filter(deleted_at__lt=cutoff).delete()
+    return deleted
+
+
+def changes_since(principal, positions, limit, synced_at=None):
+    """
+    Rows of every entity changed after the given positions
+
+    Rows changed in the last SYNC_SETTLE_SECONDS are left for the next sync:
+    a transaction committing late can write an updated_at older than rows
+    already served, and the cursor would skip past it.
+
+    Args:
+        principal (Principal): Caller
+        positions (dict): Entity name -> [timestamp, id] of the last row seen
+        limit (int): Most rows per entity
+        synced_at (datetime): Time the client was last caught up, None on
+            a first sync
+
+    Returns:
+        tuple: ({entity: rows}, new positions, whether any entity has more,
+            time the client is caught up to)
+    """
+    settled = timezone.now() - timedelta(seconds=settings.SYNC_SETTLE_SECONDS)
+    changes = {}
+    new_positions = dict(positions)
+    has_more = False
+
+    for entity, (queryset, timestamp) in owner_filters(principal).items():
+        ordering = (timestamp, 'id')
+        queryset = queryset.filter(**{f'{timestamp}__lte': settled}).order_by(*ordering)
+        if entity in positions:
+            queryset = queryset.filter(keyset_filter(ordering, positions[entity]))
+
+        # One extra row tells whether there is more to fetch
+        rows = list(queryset[:limit + 1])
+        if len(rows) > limit:
+            has_more = True
+            rows = rows[:limit]
+        if rows:
+            new_positions[entity] = row_values(rows[-1], ordering)
+        changes[entity] = rows
+
+    # Only a complete sync moves it, a client paging through what changed
+    # still misses the rest
+    if not has_more or synced_at is None:
+        synced_at = settled
+    return changes, new_positions, has_more, synced_at
+
+
+def encode_sync_cursor(positions, synced_at):
+    """Encode {entity: [timestamp, id]} and the time the client is caught up to as an opaque cursor"""
+    entries = [[entity, *position] for entity, position in sorted(positions.items())]
+    return encode_cursor([*entries, [SYNCED_AT, synced_at]])
@@ -0,0 +1,255 @@
+"""
+Background tasks queued in the database
+
+Work that doesn't need to happen inline is queued with enqueue() as a row
+of the tasks table, in the caller's transaction, so a task exists exactly
+when the change that asked for it was committed. Workers (manage.py
+run_tasks) claim due tasks with SELECT ... FOR UPDATE SKIP LOCKED, so any
+number of them can poll the table without handing out a task twice or
+waiting on each other's locks.
+
+A claimed task holds a lease (TASKS_LEASE_SECONDS); a worker dying mid-task
+lets it be claimed again once the lease expires, unless that run was its
+last attempt. Failed tasks are retried with exponential backoff and jitter,
+and after max_attempts failures are kept as dead letters (status 'dead')
+with their last error.
+
+Without Postgres (SQLite tests), or with TASKS_SYNC set, tasks run in
+process right after the transaction commits. The request has already
+succeeded by then, so a failing task is logged and counted as dead, not
+raised.
+"""
+import logging
+import random
+import threading
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import metrics
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+_lock = threading.Lock()
+_counters = {'enqueued': 0, 'claimed': 0, 'succeeded': 0, 'retried': 0, 'dead': 0}
+
+
+def _count(name, value=1):
+    with _lock:
+        _counters[name] += value
+
+
+def task(name, max_attempts=None):
+    """
+    Register a function as a task
+
+    Args:
+        name (str): Name tasks are queued under, must not change while
+            tasks with it are queued
+        max_attempts (int): Runs before the task is dead, defaults to
+            TASKS_MAX_ATTEMPTS
+
+    The function is called with the keyword arguments given to enqueue().
+    """
+    def decorator(func):
+        _registry[name] = (func, max_attempts)
+        return func
+    return decorator
+
+
+def is_sync():
+    """Whether tasks run in process instead of being queued"""
+    if settings.TASKS_SYNC is not None:
+        return settings.TASKS_SYNC
+    return connection.vendor != 'postgresql'
+
+
+def enqueue(name, delay=0, **kwargs):
+    """
+    Queue a task
+
+    Args:
+        name (str): Registered task name
+        delay (float): Seconds to wait before running it
+        **kwargs: Arguments of the task, JSON serializable (UUIDs and dates
+            arrive as strings)
+    """
+    if name not in _registry:
+        raise LookupError(f'Unknown task {name}')
+    func, max_attempts = _registry[name]
+    _count('enqueued')
+
+    if is_sync():
+        transaction.on_commit(lambda: _run_now(name, func, kwargs))
+        return
+
+    Task.objects.create(
+        name=name,
+        payload=kwargs,
+        max_attempts=max_attempts or settings.TASKS_MAX_ATTEMPTS,
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )
+
+
+def _run_now(name, func, kwargs):
+    """Run a task in process, once, there is no row to retry it from"""
+    try:
+        func(**kwargs)
+    except Exception:
+        _count('dead')
+        logger.exception('Task %s failed', name)
+    else:
+        _count('succeeded')
+
+
+def retry_delay(attempts):
+    """Seconds before the next run of a task that failed `attempts` times"""
+    delay = min(settings.TASKS_RETRY_BASE_SECONDS * 2 ** (attempts - 1), settings.TASKS_RETRY_MAX_SECONDS)
+    # Spread out retries of tasks that failed together
+    return delay * random.uniform(0.5, 1.0)
+
+
+def claim(limit=1):
+    """
+    Claim due tasks for this worker
+
+    Tasks whose lease expired on their last attempt are dead letters
+    instead, the worker running their last attempt died.
+
+    Returns:
+        list: Tasks now running under a lease, attempts counting this run
+    """
+    while True:
+        now = timezone.now()
+        with transaction.atomic():
+            tasks = list(
+                Task.objects.select_for_update(skip_locked=True)
+                .filter(Q(status=Task.Status.QUEUED, run_at__lte=now) | Q(status=Task.Status.RUNNING, locked_until__lt=now))
+                .order_by('run_at', 'id')[:limit]
+            )
+            exhausted = [t for t in tasks if t.status == Task.Status.RUNNING and t.attempts >= t.max_attempts]
+            tasks = [t for t in tasks if t not in exhausted]
+            if exhausted:
+                Task.objects.filter(id__in=[t.id for t in exhausted]).update(
+                    status=Task.Status.DEAD,
+                    locked_until=None,
+                    last_error='Lease expired during the last attempt',
+                    updated_at=now,
+                )
+            if tasks:
+                Task.objects.filter(id__in=[t.id for t in tasks]).update(
+                    status=Task.Status.RUNNING,
+                    attempts=F('attempts') + 1,
+                    locked_until=now + timedelta(seconds=settings.TASKS_LEASE_SECONDS),
+                    updated_at=now,
+                )
+        for expired in exhausted:
+            _count('dead')
+            logger.error('Task %s (%s) is dead, its lease expired after %s attempts', expired.id, expired.name, expired.attempts)
+        # Only dead letters found, what comes after them may be due
+        if tasks or not exhausted:
+            break
+    for claimed in tasks:
+        claimed.attempts += 1
+    _count('claimed', len(tasks))
+    return tasks
+
+
+def execute(claimed):
+    """Run a claimed task, then delete it, retry it or mark it dead"""
+    # Only touch the row if it is still this run's, the lease may have
+    # expired and another worker taken it
+    current = Task.objects.filter(id=claimed.id, status=Task.Status.RUNNING, attempts=claimed.attempts)
+    try:
+        if claimed.name not in _registry:
+            raise LookupError(f'Unknown task {claimed.name}')
+        func, _ = _registry[claimed.name]
+        func(**claimed.payload)
+    except Exception:
+        error = traceback.format_exc()
+        now = timezone.now()
+        if claimed.attempts >= claimed.max_attempts:
+            current.update(status=Task.Status.DEAD, locked_until=None, last_error=error, updated_at=now)
+            _count('dead')
+            logger.error('Task %s (%s) is dead after %s attempts', claimed.id, claimed.name, claimed.attempts)
+        else:
+            current.update(
+                status=Task.Status.QUEUED,
+                locked_until=None,
+                last_error=error,
+                run_at=now + timedelta(seconds=retry_delay(claimed.attempts)),
+                updated_at=now,
+            )
+            _count('retried')
+            logger.warning('Task %s (%s) failed, will retry', claimed.id, claimed.name)
+    else:
+        current.delete()
+        _count('succeeded')
+
+
+class Worker:
+    """Threads claiming and running tasks until stopped"""
+
+    def __init__(self, concurrency=1, poll_interval=1.0, burst=False):
+        """
+        Args:
+            concurrency (int): Tasks run at the same time
+            poll_interval (float): Seconds a thread sleeps when nothing is due
+            burst (bool): Stop once nothing is due instead of polling
+        """
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.burst = burst
+        self.stopping = threading.Event()
+
+    def stop(self):
+        """Stop after the running tasks finish"""
+        self.stopping.set()
+
+    def _loop(self):
+        try:
+            while not self.stopping.is_set():
+                try:
+                    tasks = claim()
+                    if tasks:
+                        execute(tasks[0])
+                except Exception:
+                    # Database trouble, the lease brings back a task left running
+                    logger.exception('Task worker error')
+                    tasks = []
+                    # Start over on a new connection. The thread otherwise
+                    # keeps its own, reconnecting for every task halves
+                    # the throughput (see ClaimThroughputBenchmark)
+                    connection.close()
+                if not tasks:
+                    if self.burst:
+                        return
+                    self.stopping.wait(self.poll_interval)
+        finally:
+            connection.close()
+
+    def run(self):
+        threads = [
+            threading.Thread(target=self._loop, name=f'task-worker-{number}', daemon=True)
+            for number in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            # Joined with a timeout so signals still reach the main thread
+            while thread.is_alive():
+                thread.join(0.5)
+
+
+def stats():
+    with _lock:
+        return dict(_counters)
+
+
+metrics.register('tasks', stats)
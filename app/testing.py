@@ -0,0 +1,208 @@
+"""
+Test support: test runner, row factories, tokens and a stub Supabase
+
+The app's models map tables owned by Supabase (managed = False), which
+migrations never create. TestRunner creates them in the test database just
+before migrations run, so the index migrations find them too.
+
+Requests are authenticated with HS256 tokens signed with TEST_JWT_SECRET
+and verified locally, see AuthTestMixin.
+"""
+import json
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import jwt
+from django.apps import apps
+from django.core.cache import caches
+from django.db import connections
+from django.db.models.signals import pre_migrate
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from .circuit_breaker import _breakers
+from .models import Appointments, DoctorAvailability, DoctorProfiles, Prescriptions, Profiles
+from .token_cache import token_cache
+from .utils import jwks_cache
+
+TEST_JWT_SECRET = 'test-jwt-secret-of-at-least-32-bytes!'
+
+# Mirrors of Django's own tables, created by their apps
+DJANGO_TABLE_PREFIXES = ('auth_', 'django_')
+
+
+def create_unmanaged_tables(sender, using, **kwargs):
+    connection = connections[using]
+    existing = set(connection.introspection.table_names())
+    with connection.schema_editor() as editor:
+        for model in sender.get_models():
+            table = model._meta.db_table
+            if model._meta.managed or table.startswith(DJANGO_TABLE_PREFIXES) or table in existing:
+                continue
+            editor.create_model(model)
+
+
+class TestRunner(DiscoverRunner):
+    def setup_databases(self, **kwargs):
+        app_config = apps.get_app_config('app')
+        pre_migrate.connect(create_unmanaged_tables, sender=app_config)
+        try:
+            return super().setup_databases(**kwargs)
+        finally:
+            pre_migrate.disconnect(create_unmanaged_tables, sender=app_config)
+
+
+def make_profile(user_type=Profiles.UserType.PATIENT, **fields):
+    now = timezone.now()
+    fields.setdefault('full_name', f'{user_type.title()} {uuid.uuid4().hex[:6]}')
+    return Profiles.objects.create(
+        id=fields.pop('id', uuid.uuid4()), user_type=user_type, created_at=now, updated_at=now, **fields
+    )
+
+
+def make_doctor(specialty='Cardiology', full_name=None, **fields):
+    user = make_profile(Profiles.UserType.DOCTOR, **({'full_name': full_name} if full_name else {}))
+    return DoctorProfiles.objects.create(id=uuid.uuid4(), user=user, specialty=specialty, **fields)
+
+
+def make_availability(doctor, day_of_week, start_time='09:00', end_time='17:00', slot_duration=30):
+    now = timezone.now()
+    return DoctorAvailability.objects.create(
+        id=uuid.uuid4(), doctor=doctor, day_of_week=day_of_week, start_time=start_time, end_time=end_time,
+        slot_duration=slot_duration, is_available=True, created_at=now, updated_at=now,
+    )
+
+
+def make_appointment(patient, doctor, appointment_date, start_time='09:00', end_time='09:30', **fields):
+    fields.setdefault('status', Appointments.Status.SCHEDULED)
+    return Appointments.objects.create(
+        id=uuid.uuid4(), patient=patient, doctor=doctor, appointment_date=appointment_date,
+        start_time=start_time, end_time=end_time, **fields
+    )
+
+
+def make_prescription(patient, doctor, **fields):
+    fields.setdefault('prescription_date', timezone.now().date())
+    fields.setdefault('details', {'medications': [{'name': 'Amoxicillin', 'dosage': '500mg'}]})
+    fields.setdefault('is_synced', True)
+    return Prescriptions.objects.create(id=uuid.uuid4(), patient=patient, doctor=doctor, **fields)
+
+
+def make_token(user_id, lifetime=3600, secret=TEST_JWT_SECRET):
+    """HS256 access token shaped like Supabase's"""
+    now = datetime.now(dt_timezone.utc)
+    return jwt.encode({
+        'sub': str(user_id),
+        'aud': 'authenticated',
+        'role': 'authenticated',
+        'iat': now,
+        'exp': now + timedelta(seconds=lifetime),
+        # Every token differs, even when made in the same second
+        'jti': uuid.uuid4().hex,
+    }, secret, algorithm='HS256')
+
+
+def auth(profile):
+    """Client kwargs authenticating as a profile"""
+    return {'HTTP_AUTHORIZATION': f'Bearer {make_token(profile.id)}'}
+
+
+class AuthTestMixin:
+    """Verifies test tokens locally, starts every test with empty caches and closed circuits"""
+
+    def setUp(self):
+        super().setUp()
+        local_auth = override_settings(SUPABASE_AUTH_MODE='local', SUPABASE_JWT_SECRET=TEST_JWT_SECRET)
+        local_auth.enable()
+        self.addCleanup(local_auth.disable)
+        caches['default'].clear()
+        token_cache.clear()
+        jwks_cache.clear()
+        for breaker in _breakers.values():
+            breaker.reset()
+
+
+class StubSupabase:
+    """
+    Local HTTP server standing in for the Supabase auth API
+
+    Answers GET /auth/v1/user with the user of the bearer token, the JWKS
+    path with `jwks` and any POST with an empty object. `delay` slows every answer down, `status` (when
+    set) replaces it with an empty error response. Counts requests and the
+    TCP connections they came over.
+    """
+
+    def __init__(self, delay=0.0, status=None, jwks=None):
+        self.delay = delay
+        self.status = status
+        self.jwks = jwks or {'keys': []}
+        self.requests = 0
+        self.connections = set()
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are written separately, Nagle would hold the body
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _answered(self):
+                """Count the request, wait and send the forced error, if any"""
+                with stub._lock:
+                    stub.requests += 1
+                    stub.connections.add(self.client_address)
+                time.sleep(stub.delay)
+                if stub.status is not None:
+                    self._send(stub.status, {})
+                    return True
+                return False
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if not self._answered():
+                    self._send(200, {})
+
+            def do_GET(self):
+                if self._answered():
+                    return
+                if self.path.startswith('/auth/v1/.well-known/jwks.json'):
+                    return self._send(200, stub.jwks)
+                token = self.headers.get('Authorization', '').removeprefix('Bearer ')
+                try:
+                    claims = jwt.decode(token, options={'verify_signature': False})
+                except jwt.InvalidTokenError:
+                    return self._send(401, {'msg': 'invalid token'})
+                return self._send(200, {'id': claims['sub'], 'aud': claims.get('aud'), 'role': claims.get('role')})
+
+            def _send(self, code, body):
+                data = json.dumps(body).encode()
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+
+            def handle_error(self, request, client_address):
+                # Clients giving up on a slow answer close the socket under it
+                pass
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
@@ -1,3 +1,1212 @@
-from django.test import TestCase
+import base64
+import io
+import json
+import threading
+import time
+import uuid
+from datetime import date, timedelta
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
 
-# Create your tests here.
+from unittest import mock, skipUnless
+
+import jwt
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import supabase_client
+from .circuit_breaker import CircuitBreaker
+from .singleflight import Group
+from .supabase_client import SupabaseUnavailable
+from .models import Appointments, DoctorProfiles, Notifications, Prescriptions, Profiles, SyncTombstone, Task
+from .pagination import encode_cursor
+from .prescription_filters import filter_details
+from .prescription_sync import _upsert
+from .qr import LEGACY_PREFIX, _render, build_qr_payload, payload_digest
+from .response_cache import ResponseCache, doctor_cache
+from .scheduling import WEEKDAYS, free_slots, is_free, merge_intervals
+from .search import search_doctors
+from .sync import parse_sync_cursor
+from .tasks import claim, enqueue, task
+from .testing import (
+    TEST_JWT_SECRET, AuthTestMixin, StubSupabase, auth, make_appointment, make_availability, make_doctor,
+    make_prescription, make_profile, make_token,
+)
+from .token_cache import MISS, TokenCache
+from .utils import verify_token, verify_token_locally
+
+
+class LocalVerificationTests(AuthTestMixin, SimpleTestCase):
+    def test_valid_token(self):
+        user_id = uuid.uuid4()
+        user_data = verify_token_locally(make_token(user_id))
+        self.assertEqual(user_data['id'], str(user_id))
+        self.assertEqual(user_data['aud'], 'authenticated')
+
+    def test_expired_token(self):
+        self.assertIsNone(verify_token_locally(make_token(uuid.uuid4(), lifetime=-10)))
+
+    def test_wrong_secret(self):
+        token = make_token(uuid.uuid4(), secret='another-secret-of-at-least-32-bytes')
+        self.assertIsNone(verify_token_locally(token))
+
+    def test_wrong_audience(self):
+        token = jwt.encode(
+            {'sub': str(uuid.uuid4()), 'aud': 'anon', 'exp': int(time.time()) + 60}, TEST_JWT_SECRET, algorithm='HS256'
+        )
+        self.assertIsNone(verify_token_locally(token))
+
+    def test_no_network_call(self):
+        with StubSupabase() as stub, override_settings(SUPABASE_URL=stub.url):
+            self.assertIsNotNone(verify_token(make_token(uuid.uuid4())))
+        self.assertEqual(stub.requests, 0)
+
+    @override_settings(SUPABASE_JWT_SECRET='')
+    def test_falls_back_to_supabase_without_key(self):
+        user_id = uuid.uuid4()
+        with StubSupabase() as stub, override_settings(SUPABASE_URL=stub.url):
+            self.assertEqual(verify_token(make_token(user_id))['id'], str(user_id))
+        self.assertEqual(stub.requests, 1)
+
+
+@skipUnless(jwt.algorithms.has_crypto, 'needs PyJWT[crypto]')
+class TokenCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.now = time.time()
+        caches['default'].clear()
+
+    def make_cache(self, **options):
+        options = {'max_entries': 10, 'ttl': 300, 'negative_max_entries': 10, 'negative_ttl': 30, **options}
+        return TokenCache(**options)
+
+    def at(self, offset):
+        """Run the cache `offset` seconds from now"""
+        return mock.patch('app.token_cache.time.time', return_value=self.now + offset)
+
+    def test_entry_expires_with_the_token(self):
+        cache = self.make_cache(ttl=300)
+        token = make_token(uuid.uuid4(), lifetime=10)
+        with self.at(0):
+            cache.set(token, {'id': 'user'})
+        with self.at(9):
+            self.assertEqual(cache.get(token), {'id': 'user'})
+        with self.at(11):
+            self.assertIs(cache.get(token), MISS)
+        self.assertEqual(cache.stats()['expirations'], 1)
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_ttl_caps_long_lived_tokens(self):
+        cache = self.make_cache(ttl=60)
+        token = make_token(uuid.uuid4(), lifetime=3600)
+        with self.at(0):
+            cache.set(token, {'id': 'user'})
+        with self.at(59):
+            self.assertEqual(cache.get(token), {'id': 'user'})
+        with self.at(61):
+            self.assertIs(cache.get(token), MISS)
+
+    def test_expired_token_not_stored(self):
+        cache = self.make_cache()
+        token = make_token(uuid.uuid4(), lifetime=-10)
+        cache.set(token, {'id': 'user'})
+        self.assertIs(cache.get(token), MISS)
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_rejected_tokens(self):
+        cache = self.make_cache(negative_ttl=30)
+        token = make_token(uuid.uuid4())
+        with self.at(0):
+            cache.reject(token)
+        with self.at(29):
+            self.assertIsNone(cache.get(token))
+        with self.at(31):
+            self.assertIs(cache.get(token), MISS)
+        self.assertEqual(cache.stats()['negative_hits'], 1)
+
+    def test_counters(self):
+        cache = self.make_cache()
+        known, rejected, unknown = (make_token(uuid.uuid4()) for _ in range(3))
+        cache.set(known, {'id': 'user'})
+        cache.reject(rejected)
+        for token in (known, known, rejected, unknown):
+            cache.get(token)
+        # Lookups made for the single flight re-check don't count
+        cache.get(unknown, record=False)
+        stats = cache.stats()
+        self.assertEqual(
+            {name: stats[name] for name in ('hits', 'shared_hits', 'negative_hits', 'misses', 'hit_rate', 'size')},
+            {'hits': 2, 'shared_hits': 0, 'negative_hits': 1, 'misses': 1, 'hit_rate': 0.75, 'size': 1},
+        )
+
+    def test_least_recently_used_evicted(self):
+        cache = self.make_cache(max_entries=2)
+        first, second, third = (make_token(uuid.uuid4()) for _ in range(3))
+        cache.set(first, {'id': 'first'})
+        cache.set(second, {'id': 'second'})
+        cache.get(first)
+        cache.set(third, {'id': 'third'})
+        self.assertIs(cache.get(second), MISS)
+        self.assertEqual(cache.get(first), {'id': 'first'})
+        self.assertEqual((cache.stats()['evictions'], cache.stats()['size']), (1, 2))
+
+    def test_shared_tier(self):
+        token = make_token(uuid.uuid4())
+        self.make_cache(shared_alias='default').set(token, {'id': 'user'})
+        other_worker = self.make_cache(shared_alias='default')
+        self.assertEqual(other_worker.get(token), {'id': 'user'})
+        self.assertEqual(other_worker.stats()['shared_hits'], 1)
+        # Now in the local tier too
+        self.assertEqual(other_worker.get(token), {'id': 'user'})
+        self.assertEqual(other_worker.stats()['hits'], 1)
+
+
+class JWKSTests(AuthTestMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        from cryptography.hazmat.primitives.asymmetric import rsa
+
+        self.private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(self.private_key.public_key()))
+        self.jwks = {'keys': [dict(jwk, kid='key-1', use='sig', alg='RS256')]}
+
+    def _token(self, user_id, kid='key-1'):
+        return jwt.encode(
+            {'sub': str(user_id), 'aud': 'authenticated', 'exp': int(time.time()) + 60},
+            self.private_key, algorithm='RS256', headers={'kid': kid},
+        )
+
+    def test_keys_are_fetched_through_the_client_once(self):
+        with StubSupabase(jwks=self.jwks) as stub, override_settings(
+            SUPABASE_URL=stub.url, SUPABASE_JWKS_URL=f'{stub.url}/auth/v1/.well-known/jwks.json'
+        ):
+            for _ in range(5):
+                user_id = uuid.uuid4()
+                self.assertEqual(verify_token_locally(self._token(user_id))['id'], str(user_id))
+        self.assertEqual(stub.requests, 1)
+        self.assertEqual(supabase_client._latency.stats()['auth.jwks']['calls'], 1)
+
+    def test_unknown_key_refetches_at_a_limited_rate(self):
+        with StubSupabase(jwks=self.jwks) as stub, override_settings(
+            SUPABASE_URL=stub.url, SUPABASE_JWKS_URL=f'{stub.url}/auth/v1/.well-known/jwks.json'
+        ):
+            verify_token_locally(self._token(uuid.uuid4()))
+            for _ in range(3):
+                with self.assertRaises(LookupError):
+                    verify_token_locally(self._token(uuid.uuid4(), kid='rotated'))
+        self.assertEqual(stub.requests, 1)
+
+    def test_unreachable_jwks_leaves_the_token_to_supabase(self):
+        with StubSupabase(status=503) as stub, override_settings(
+            SUPABASE_URL=stub.url, SUPABASE_JWKS_URL=f'{stub.url}/auth/v1/.well-known/jwks.json',
+            SUPABASE_HTTP_RETRIES=0,
+        ):
+            with self.assertRaises(LookupError):
+                verify_token_locally(self._token(uuid.uuid4()))
+
+
+class SingleFlightTests(AuthTestMixin, SimpleTestCase):
+    @override_settings(SUPABASE_JWT_SECRET='')
+    def test_concurrent_verifications_hit_supabase_once(self):
+        user_id = uuid.uuid4()
+        token = make_token(user_id)
+        callers = 20
+        barrier = threading.Barrier(callers)
+
+        def verify():
+            barrier.wait()
+            return verify_token(token)
+
+        # The delay keeps the first call in flight while the others arrive
+        with StubSupabase(delay=0.3) as stub, override_settings(SUPABASE_URL=stub.url):
+            with ThreadPoolExecutor(callers) as pool:
+                results = list(pool.map(lambda _: verify(), range(callers)))
+        self.assertEqual(stub.requests, 1)
+        self.assertTrue(all(result['id'] == str(user_id) for result in results))
+
+    def test_errors_are_shared(self):
+        group = Group()
+        started = threading.Event()
+
+        def fail():
+            started.set()
+            time.sleep(0.2)
+            raise RuntimeError('upstream down')
+
+        with ThreadPoolExecutor(2) as pool:
+            leader = pool.submit(group.do, 'key', fail)
+            started.wait()
+            follower = pool.submit(group.do, 'key', lambda: 'not called')
+            for future in (leader, follower):
+                with self.assertRaises(RuntimeError):
+                    future.result()
+        self.assertEqual(group.stats(), {'calls': 1, 'shared': 1, 'in_flight': 0})
+
+
+class ResponseCacheTests(AuthTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = ResponseCache('test')
+        self.builds = 0
+
+    def build(self, data='data', started=None, release=None):
+        """A build returning data, optionally signalling its start and waiting to be released"""
+        def build():
+            self.builds += 1
+            if started:
+                started.set()
+            if release:
+                release.wait(5)
+            return data
+        return build
+
+    def cache_versions(self, doctor):
+        return doctor_cache.version('directory'), doctor_cache.version(f'doctor:{doctor.id}')
+
+    def test_bump_makes_entries_out_of_date(self):
+        self.assertEqual(self.cache.get_or_build('k', ['a', 'b'], self.build('first')), 'first')
+        self.assertEqual(self.cache.get_or_build('k', ['a', 'b'], self.build('second')), 'first')
+        self.cache.bump('other')
+        self.assertEqual(self.cache.get_or_build('k', ['a', 'b'], self.build('second')), 'first')
+        self.cache.bump('b')
+        self.assertEqual(self.cache.get_or_build('k', ['a', 'b'], self.build('second')), 'second')
+        self.assertEqual(self.builds, 2)
+
+    @override_settings(RESPONSE_CACHE_FRESH_TTL=0)
+    def test_expired_entry_rebuilt(self):
+        self.cache.get_or_build('k', ['a'], self.build('first'))
+        self.assertEqual(self.cache.get_or_build('k', ['a'], self.build('second')), 'second')
+
+    def test_writes_bump_versions(self):
+        doctor = make_doctor()
+        directory, detail = self.cache_versions(doctor)
+        with self.captureOnCommitCallbacks(execute=True):
+            doctor.specialty = 'Neurology'
+            doctor.save()
+        self.assertNotEqual(self.cache_versions(doctor), (directory, detail))
+        directory, detail = self.cache_versions(doctor)
+        with self.captureOnCommitCallbacks(execute=True):
+            doctor.user.full_name = 'Renamed'
+            doctor.user.save()
+        self.assertNotEqual(self.cache_versions(doctor), (directory, detail))
+
+    def test_stale_served_while_one_request_rebuilds(self):
+        self.cache.get_or_build('k', ['a'], self.build('old'))
+        self.cache.bump('a')
+        started, release = threading.Event(), threading.Event()
+        with ThreadPoolExecutor(1) as pool:
+            rebuild = pool.submit(self.cache.get_or_build, 'k', ['a'], self.build('new', started, release))
+            started.wait(5)
+            # The rebuild holds the lock, others get the old data right away
+            self.assertEqual(self.cache.get_or_build('k', ['a'], self.build('not built')), 'old')
+            release.set()
+            self.assertEqual(rebuild.result(), 'new')
+        self.assertEqual(self.cache.get_or_build('k', ['a'], self.build('not built')), 'new')
+        self.assertEqual(self.builds, 2)
+        self.assertEqual(self.cache.stats()['stale_hits'], 1)
+
+    def test_cold_key_built_once(self):
+        started, release = threading.Event(), threading.Event()
+        with ThreadPoolExecutor(5) as pool:
+            first = pool.submit(self.cache.get_or_build, 'k', ['a'], self.build('built', started, release))
+            started.wait(5)
+            # Nothing stale to serve, these wait for the first build
+            waiting = [pool.submit(self.cache.get_or_build, 'k', ['a'], self.build('not built')) for _ in range(4)]
+            time.sleep(0.2)
+            release.set()
+            self.assertEqual([future.result() for future in [first, *waiting]], ['built'] * 5)
+        self.assertEqual(self.builds, 1)
+        self.assertEqual(self.cache.stats()['waits'], 4)
+
+    def test_failed_build_not_cached(self):
+        def fail():
+            raise RuntimeError('database down')
+
+        with self.assertRaises(RuntimeError):
+            self.cache.get_or_build('k', ['a'], fail)
+        # The lock went with the failure
+        self.assertEqual(self.cache.get_or_build('k', ['a'], self.build('built')), 'built')
+
+
+class SupabaseClientTests(AuthTestMixin, SimpleTestCase):
+    def test_connections_are_reused(self):
+        with StubSupabase() as stub, override_settings(SUPABASE_URL=stub.url):
+            for _ in range(20):
+                self.assertEqual(supabase_client.get_user(make_token(uuid.uuid4())).status_code, 200)
+        self.assertEqual(stub.requests, 20)
+        self.assertEqual(len(stub.connections), 1)
+
+    @override_settings(SUPABASE_HTTP_RETRIES=2, SUPABASE_HTTP_BACKOFF_BASE=0.01)
+    def test_idempotent_calls_are_retried(self):
+        with StubSupabase(status=503) as stub, override_settings(SUPABASE_URL=stub.url):
+            self.assertEqual(supabase_client.get_user(make_token(uuid.uuid4())).status_code, 503)
+        self.assertEqual(stub.requests, 3)
+
+    @override_settings(SUPABASE_HTTP_RETRIES=2)
+    def test_other_calls_are_not_retried(self):
+        with StubSupabase(status=503) as stub, override_settings(SUPABASE_URL=stub.url):
+            self.assertEqual(supabase_client.sign_up({'email': 'a@example.com'}).status_code, 503)
+        self.assertEqual(stub.requests, 1)
+
+    @override_settings(SUPABASE_HTTP_READ_TIMEOUT=0.2, SUPABASE_HTTP_DEADLINE=0.5, SUPABASE_HTTP_BACKOFF_BASE=0.01)
+    def test_slow_upstream_is_bounded_by_the_deadline(self):
+        durations = []
+        with StubSupabase(delay=2) as stub, override_settings(SUPABASE_URL=stub.url):
+            for _ in range(8):
+                started = time.monotonic()
+                with self.assertRaises(SupabaseUnavailable):
+                    supabase_client.get_user(make_token(uuid.uuid4()))
+                durations.append(time.monotonic() - started)
+        self.assertLess(max(durations), 0.8)
+        # The breaker opened after the threshold, later calls fail fast
+        self.assertLess(durations[-1], 0.05)
+
+
+class CircuitBreakerTests(AuthTestMixin, SimpleTestCase):
+    @override_settings(SUPABASE_HTTP_RETRIES=0)
+    def test_breakers_are_per_endpoint(self):
+        with StubSupabase(status=503) as stub, override_settings(SUPABASE_URL=stub.url):
+            for _ in range(settings.SUPABASE_BREAKER_FAILURE_THRESHOLD):
+                supabase_client.sign_up({'email': 'a@example.com'})
+            with self.assertRaises(SupabaseUnavailable):
+                supabase_client.sign_up({'email': 'a@example.com'})
+            stub.status = None
+            self.assertEqual(supabase_client.get_user(make_token(uuid.uuid4())).status_code, 200)
+        self.assertEqual(supabase_client.signup_breaker.state, 'open')
+        self.assertEqual(supabase_client.verify_breaker.state, 'closed')
+
+    def test_probe_slot_is_released_on_unexpected_errors(self):
+        breaker = CircuitBreaker('test', failure_threshold=1, recovery_timeout=0, half_open_max_calls=1)
+        breaker.record_failure()
+        with self.assertRaises(TypeError):
+            # Not a requests error, says nothing about the upstream
+            supabase_client.request('GET', '/auth/v1/user', 'test', breaker, unknown_argument=True)
+        # The half-open probe is free again
+        breaker.before_call()
+        breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+
+
+def future_date(min_days=30):
+    """A date at least min_days ahead whose day of the month has one digit"""
+    day = date.today() + timedelta(days=min_days)
+    while day.day > 9:
+        day += timedelta(days=1)
+    return day
+
+
+def run_concurrently(calls):
+    """Run callables at the same time, each thread with its own connection"""
+    barrier = threading.Barrier(len(calls))
+
+    def run(call):
+        try:
+            barrier.wait()
+            return call()
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(len(calls)) as pool:
+        return list(pool.map(run, calls))
+
+
+class SchedulingTests(SimpleTestCase):
+    def test_empty_or_inverted_slot_is_never_free(self):
+        self.assertFalse(is_free([], 3600, 3600))
+        self.assertFalse(is_free([], 7200, 3600))
+        self.assertTrue(is_free([], 3600, 7200))
+
+    def test_inverted_intervals_block_nothing(self):
+        busy = merge_intervals([(36000, 32400), (3600, 7200)])
+        self.assertEqual(busy, [(3600, 7200)])
+        self.assertEqual(free_slots(0, 10800, 60, busy), [(0, 3600), (7200, 10800)])
+
+
+class InvertedSlotTests(AuthTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = make_profile()
+        cls.doctor = make_doctor()
+        cls.day = future_date()
+        make_availability(cls.doctor, WEEKDAYS[cls.day.weekday()])
+
+    def test_create(self):
+        for start, end in (('10:30:00', '10:00:00'), ('10:00:00', '10:00:00')):
+            response = self.client.post(reverse('appointments-list'), {
+                'doctor_id': str(self.doctor.id), 'appointment_date': self.day.isoformat(),
+                'start_time': start, 'end_time': end,
+            }, content_type='application/json', **auth(self.patient))
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(Appointments.objects.exists())
+
+    def test_reschedule(self):
+        appointment = make_appointment(self.patient, self.doctor, self.day)
+        response = self.client.patch(reverse('appointments-reschedule', args=[appointment.id]), {
+            'appointment_date': self.day.isoformat(), 'start_time': '11:00:00', 'end_time': '10:00:00',
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        appointment.refresh_from_db()
+        self.assertEqual(str(appointment.start_time), '09:00:00')
+
+
+class RescheduleWindowTests(AuthTestMixin, TestCase):
+    """Reschedule only accepts slots inside the doctor's windows, like create"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = make_profile()
+        cls.doctor = make_doctor()
+        cls.day = future_date()
+        make_availability(cls.doctor, WEEKDAYS[cls.day.weekday()], '09:00', '12:00')
+        make_availability(cls.doctor, WEEKDAYS[cls.day.weekday()], '14:00', '17:00')
+
+    def reschedule(self, appointment, day, start, end):
+        return self.client.patch(reverse('appointments-reschedule', args=[appointment.id]), {
+            'appointment_date': day.isoformat(), 'start_time': start, 'end_time': end,
+        }, content_type='application/json')
+
+    def test_outside_windows(self):
+        appointment = make_appointment(self.patient, self.doctor, self.day)
+        for day, start, end in (
+            (self.day, '03:00:00', '03:30:00'),
+            (self.day, '11:45:00', '12:15:00'),
+            (self.day, '12:30:00', '13:00:00'),
+            (self.day + timedelta(days=1), '10:00:00', '10:30:00'),
+        ):
+            with self.subTest(day=day, start=start):
+                self.assertEqual(self.reschedule(appointment, day, start, end).status_code, 400)
+        appointment.refresh_from_db()
+        self.assertEqual((appointment.appointment_date, str(appointment.start_time)), (self.day, '09:00:00'))
+
+    def test_inside_second_window(self):
+        appointment = make_appointment(self.patient, self.doctor, self.day)
+        self.assertEqual(self.reschedule(appointment, self.day, '16:30:00', '17:00:00').status_code, 200)
+
+
+@override_settings(EXPORT_CHUNK_SIZE=3)
+class StreamedExportTests(AuthTestMixin, TestCase):
+    """all_appointments?stream= gives the same rows as the paginated list"""
+
+    @classmethod
+    def setUpTestData(cls):
+        doctor, patient = make_doctor(), make_profile()
+        day = future_date()
+        # Ties on date and time are ordered by id, across pages too
+        for offset, start, end in ((0, '09:00', '09:30'), (0, '09:00', '09:30'), (0, '09:00', '09:30'),
+                                   (0, '10:00', '10:30'), (1, '09:00', '09:30'), (1, '09:00', '09:30'),
+                                   (7, '08:00', '08:30')):
+            make_appointment(patient, doctor, day + timedelta(days=offset), start, end)
+
+    def listed(self):
+        response = self.client.get(reverse('appointments-all-appointments'), {'page_size': 1000})
+        return response.json()['results']
+
+    def streamed(self, stream_format):
+        response = self.client.get(reverse('appointments-all-appointments'), {'stream': stream_format})
+        self.assertEqual(response.status_code, 200)
+        # Pages of 3: 3, 3 and 1 rows
+        with self.assertNumQueries(3):
+            body = b''.join(response.streaming_content).decode()
+        if stream_format == 'ndjson':
+            return [json.loads(line) for line in body.splitlines()]
+        return json.loads(body)
+
+    def test_same_rows_as_the_list(self):
+        listed = self.listed()
+        self.assertEqual(len(listed), 7)
+        self.assertEqual(self.streamed('ndjson'), listed)
+        self.assertEqual(self.streamed('json'), listed)
+
+    def test_exact_multiple_of_the_chunk(self):
+        Appointments.objects.filter(start_time='08:00').delete()
+        response = self.client.get(reverse('appointments-all-appointments'), {'stream': 'json'})
+        # A last, empty page tells the export is over
+        with self.assertNumQueries(3):
+            self.assertEqual(len(json.loads(b''.join(response.streaming_content))), 6)
+
+    def test_invalid_format(self):
+        response = self.client.get(reverse('appointments-all-appointments'), {'stream': 'csv'})
+        self.assertEqual(response.status_code, 400)
+
+
+class SlotCacheTests(AuthTestMixin, TestCase):
+    """Cached free slots go as soon as a booking or a window of that day changes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = make_profile()
+        cls.doctor = make_doctor()
+        cls.day = future_date()
+        cls.window = make_availability(cls.doctor, WEEKDAYS[cls.day.weekday()], '09:00', '12:00')
+
+    def slots(self, day=None):
+        response = self.client.get(reverse('doctor-availability'), {
+            'doctor_id': str(self.doctor.id), 'date': (day or self.day).isoformat(),
+        })
+        self.assertEqual(response.status_code, 200)
+        return [slot['start_time'] for slot in response.json()['available_slots']]
+
+    def cached_slots(self, day=None):
+        """Slots of a day, checked to be served from the cache the second time"""
+        slots = self.slots(day)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.slots(day), slots)
+        return slots
+
+    def test_repeat_request_runs_no_queries(self):
+        self.assertEqual(len(self.cached_slots()), 6)
+
+    def test_booking_invalidates(self):
+        self.assertIn('10:00', self.cached_slots())
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('appointments-list'), {
+                'doctor_id': str(self.doctor.id), 'appointment_date': self.day.isoformat(),
+                'start_time': '10:00:00', 'end_time': '10:30:00',
+            }, content_type='application/json', **auth(self.patient))
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('10:00', self.slots())
+
+    def test_cancel_invalidates(self):
+        appointment = make_appointment(self.patient, self.doctor, self.day, '10:00', '10:30')
+        self.assertNotIn('10:00', self.cached_slots())
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(reverse('appointments-cancel', args=[appointment.id]), {},
+                                         content_type='application/json', **auth(self.patient))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('10:00', self.slots())
+
+    def test_reschedule_invalidates_both_dates(self):
+        next_week = self.day + timedelta(days=7)
+        appointment = make_appointment(self.patient, self.doctor, self.day, '10:00', '10:30')
+        self.assertNotIn('10:00', self.cached_slots())
+        self.assertIn('11:00', self.cached_slots(next_week))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(reverse('appointments-reschedule', args=[appointment.id]), {
+                'appointment_date': next_week.isoformat(), 'start_time': '11:00:00', 'end_time': '11:30:00',
+            }, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('10:00', self.slots())
+        self.assertNotIn('11:00', self.slots(next_week))
+
+    def test_availability_write_invalidates(self):
+        self.assertEqual(self.cached_slots()[-1], '11:30')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.window.end_time = '13:00'
+            self.window.save()
+        self.assertEqual(self.slots()[-1], '12:30')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.window.delete()
+        self.assertEqual(self.slots(), [])
+
+
+class AvailabilityRangeTests(AuthTestMixin, TestCase):
+    """DoctorAvailabilityView with ?date_from=&date_to="""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor, patient = make_doctor(), make_profile()
+        cls.monday = future_date() + timedelta(days=7)
+        cls.monday -= timedelta(days=cls.monday.weekday())
+        for day in ('monday', 'wednesday'):
+            make_availability(cls.doctor, day, '09:00', '11:00', slot_duration=60)
+        # Booked on the first two mondays, cancelled on the third
+        make_appointment(patient, cls.doctor, cls.monday, '09:00', '10:00')
+        make_appointment(patient, cls.doctor, cls.monday + timedelta(days=7), '10:00', '11:00')
+        make_appointment(patient, cls.doctor, cls.monday + timedelta(days=14), '09:00', '10:00',
+                         status=Appointments.Status.CANCELLED)
+
+    def range(self, date_from, date_to):
+        return self.client.get(reverse('doctor-availability'), {
+            'doctor_id': str(self.doctor.id), 'date_from': str(date_from), 'date_to': str(date_to),
+        })
+
+    def test_booked_slots_left_out_every_day(self):
+        response = self.range(self.monday, self.monday + timedelta(days=15))
+        self.assertEqual(response.status_code, 200)
+        days = {
+            day['date']: [slot['start_time'] for slot in day['available_slots']]
+            for day in response.json()['days']
+        }
+        self.assertEqual(len(days), 16)
+        expected = {
+            self.monday: ['10:00'],
+            self.monday + timedelta(days=2): ['09:00', '10:00'],
+            self.monday + timedelta(days=7): ['09:00'],
+            self.monday + timedelta(days=9): ['09:00', '10:00'],
+            self.monday + timedelta(days=14): ['09:00', '10:00'],
+        }
+        self.assertEqual({date.fromisoformat(day): slots for day, slots in days.items() if slots}, expected)
+
+    def test_single_day(self):
+        response = self.range(self.monday, self.monday)
+        self.assertEqual([day['available_slots'][0]['start_time'] for day in response.json()['days']], ['10:00'])
+
+    @override_settings(AVAILABILITY_MAX_RANGE_DAYS=10)
+    def test_range_length(self):
+        self.assertEqual(self.range(self.monday, self.monday + timedelta(days=9)).status_code, 200)
+        self.assertEqual(self.range(self.monday, self.monday + timedelta(days=10)).status_code, 400)
+
+    def test_invalid_dates(self):
+        for date_from, date_to in (
+            (self.monday + timedelta(days=1), self.monday),
+            ('2026-02-30', self.monday),
+            (self.monday, 'tomorrow'),
+            (self.monday, ''),
+        ):
+            with self.subTest(date_from=date_from, date_to=date_to):
+                self.assertEqual(self.range(date_from, date_to).status_code, 400)
+
+
+class EarliestSlotsTests(AuthTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Tomorrow only, so no slot is already past
+        cls.day = timezone.localdate() + timedelta(days=1)
+        weekday = WEEKDAYS[cls.day.weekday()]
+        cls.early = make_doctor('Neurology', location_lat=Decimal('36.750000'), location_lng=Decimal('3.060000'))
+        cls.late = make_doctor('Neurology', location_lat=Decimal('36.750000'), location_lng=Decimal('3.360000'))
+        make_availability(cls.early, weekday, '09:30', '10:30')
+        make_availability(cls.late, weekday, '10:15', '11:15')
+        make_appointment(make_profile(), cls.early, cls.day, '10:00', '10:30')
+
+    def earliest(self, **params):
+        return self.client.get(reverse('doctor-earliest-slots'), {'specialty': 'neurology', 'days': 2, **params})
+
+    def test_ordered_across_doctors(self):
+        response = self.earliest()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(row['doctor_id'], row['date'], row['start_time']) for row in response.json()['results']],
+            [
+                (str(self.early.id), self.day.isoformat(), '09:30'),
+                (str(self.late.id), self.day.isoformat(), '10:15'),
+                (str(self.late.id), self.day.isoformat(), '10:45'),
+            ],
+        )
+        self.assertEqual(len(self.earliest(limit=2).json()['results']), 2)
+
+    def test_radius(self):
+        # The late doctor is about 27 km east
+        rows = self.earliest(near='36.75,3.06', radius_km=10).json()['results']
+        self.assertEqual({row['doctor_id'] for row in rows}, {str(self.early.id)})
+        rows = self.earliest(near='36.75,3.06', radius_km=50).json()['results']
+        self.assertEqual({row['doctor_id'] for row in rows}, {str(self.early.id), str(self.late.id)})
+        self.assertTrue(all(26 < row['distance_km'] < 28 for row in rows if row['doctor_id'] == str(self.late.id)))
+
+    def test_invalid_radius(self):
+        for radius_km in ('-5', '0', '501', 'nan', 'inf', 'far'):
+            with self.subTest(radius_km=radius_km):
+                self.assertEqual(self.earliest(near='36.75,3.06', radius_km=radius_km).status_code, 400)
+
+
+class ConcurrentBookingTests(AuthTestMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.doctor = make_doctor()
+        self.day = future_date()
+        make_availability(self.doctor, WEEKDAYS[self.day.weekday()])
+
+    def test_one_of_many_bookings_of_a_slot_wins(self):
+        patients = [make_profile() for _ in range(8)]
+
+        def book(patient):
+            return lambda: Client().post(reverse('appointments-list'), {
+                'doctor_id': str(self.doctor.id),
+                'appointment_date': self.day.isoformat(),
+                'start_time': '10:00:00',
+                'end_time': '10:30:00',
+            }, content_type='application/json', **auth(patient)).status_code
+
+        codes = run_concurrently([book(patient) for patient in patients])
+        self.assertEqual(sorted(codes), [201] + [400] * 7)
+        self.assertEqual(Appointments.objects.filter(doctor=self.doctor, appointment_date=self.day).count(), 1)
+
+    def test_reschedules_with_differently_written_dates_serialize(self):
+        patient = make_profile()
+        appointments = [
+            make_appointment(patient, self.doctor, self.day, f'{hour}:00', f'{hour}:30') for hour in (11, 12, 13, 14)
+        ]
+        spellings = [self.day.isoformat(), f'{self.day.year}-{self.day.month}-{self.day.day}']
+
+        def move(appointment, spelling):
+            return lambda: Client().patch(reverse('appointments-reschedule', args=[appointment.id]), {
+                'appointment_date': spelling, 'start_time': '16:00:00', 'end_time': '16:30:00',
+            }, content_type='application/json').status_code
+
+        codes = run_concurrently([
+            move(appointment, spellings[number % 2]) for number, appointment in enumerate(appointments)
+        ])
+        self.assertEqual(sorted(codes), [200, 400, 400, 400])
+        self.assertEqual(Appointments.objects.filter(doctor=self.doctor, start_time='16:00').count(), 1)
+
+
+class QRCodeTests(AuthTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = make_profile()
+        cls.doctor = make_doctor()
+        cls.day = future_date()
+        cls.appointment = make_appointment(cls.patient, cls.doctor, cls.day, qr_code=build_qr_payload(
+            uuid.uuid4(), cls.patient, cls.doctor, cls.day, '09:00:00', '09:30:00', 'scheduled'
+        ))
+
+    def qr(self, appointment, profile, **headers):
+        return self.client.get(reverse('appointment-qr', args=[appointment.id]), **auth(profile), **headers)
+
+    def test_png_with_etag(self):
+        response = self.qr(self.appointment, self.patient)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertTrue(response.content.startswith(b'\x89PNG'))
+        self.assertEqual(response['ETag'], f'"{payload_digest(self.appointment.qr_code)}"')
+
+        revalidated = self.qr(self.appointment, self.patient, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated.content, b'')
+        self.assertEqual(revalidated['ETag'], response['ETag'])
+        self.assertEqual(self.qr(self.appointment, self.patient, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_payload_change_changes_etag(self):
+        etag = self.qr(self.appointment, self.patient)['ETag']
+        Appointments.objects.filter(id=self.appointment.id).update(qr_code=self.appointment.qr_code + ' ')
+        response = self.qr(self.appointment, self.patient, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_only_patient_and_doctor(self):
+        self.assertEqual(self.qr(self.appointment, self.doctor.user).status_code, 200)
+        for profile in (make_profile(), make_doctor().user):
+            with self.subTest(profile=profile):
+                response = self.qr(self.appointment, profile)
+                self.assertEqual(response.status_code, 403)
+                self.assertNotEqual(response.get('Content-Type'), 'image/png')
+        anonymous = self.client.get(reverse('appointment-qr', args=[self.appointment.id]))
+        self.assertEqual(anonymous.status_code, 401)
+        missing = self.client.get(reverse('appointment-qr', args=[uuid.uuid4()]), **auth(self.patient))
+        self.assertEqual(missing.status_code, 404)
+
+    def test_legacy_data_uri(self):
+        png = _render('legacy payload')
+        legacy = make_appointment(self.patient, self.doctor, self.day, '10:00', '10:30',
+                                  qr_code=LEGACY_PREFIX + base64.b64encode(png).decode())
+        response = self.qr(legacy, self.patient)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, png)
+        self.assertEqual(self.qr(legacy, self.patient, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+
+class InvalidCursorTests(AuthTestMixin, TestCase):
+    CURSORS = [
+        'not base64 at all!',
+        encode_cursor({'not': 'a list'}),
+        encode_cursor(['x', 'y']),
+        encode_cursor(['x', 'y', 'z']),
+        encode_cursor([[1], {'a': 1}]),
+        encode_cursor([None, None]),
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = make_profile()
+        cls.doctor = make_doctor()
+        make_appointment(cls.patient, cls.doctor, future_date())
+
+    def test_invalid_cursors_are_404(self):
+        urls = [reverse('doctor-profiles'), reverse('appointments-list'), reverse('notifications-list')]
+        for url in urls:
+            for cursor in self.CURSORS:
+                with self.subTest(url=url, cursor=cursor):
+                    response = self.client.get(url, {'cursor': cursor}, **auth(self.patient))
+                    self.assertEqual(response.status_code, 404)
+                    self.assertEqual(response.json(), {'detail': 'Invalid cursor'})
+
+    def test_valid_cursor(self):
+        for _ in range(2):
+            make_appointment(self.patient, self.doctor, future_date(60))
+        first = self.client.get(reverse('appointments-list'), {'page_size': 1}).json()
+        second = self.client.get(reverse('appointments-list'), {'page_size': 1, 'cursor': first['next_cursor']})
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(first['results'][0]['id'], second.json()['results'][0]['id'])
+
+
+@override_settings(PAGINATION_MAX_PAGE_SIZE=1000)
+class QueryCountTests(AuthTestMixin, TestCase):
+    """List endpoints run the same number of queries for 10, 100 or 1000 rows"""
+
+    SIZES = (10, 100, 1000)
+
+    def populate(self, size):
+        """
+        A doctor with `size` appointments and prescriptions of distinct
+        patients, and a patient with `size` of them from distinct doctors
+        """
+        now = timezone.now()
+        day = future_date()
+        doctor, patient = make_doctor(), make_profile()
+        others = Profiles.objects.bulk_create([
+            Profiles(id=uuid.uuid4(), full_name=f'Person {n}', user_type=Profiles.UserType.PATIENT, created_at=now, updated_at=now)
+            for n in range(2 * size)
+        ])
+        patients, doctor_users = others[:size], others[size:]
+        doctors = DoctorProfiles.objects.bulk_create([
+            DoctorProfiles(id=uuid.uuid4(), user=user, specialty='Dermatology') for user in doctor_users
+        ])
+        pairs = [(doctor, other) for other in patients] + [(other, patient) for other in doctors]
+        appointments = Appointments.objects.bulk_create([
+            Appointments(id=uuid.uuid4(), doctor=d, patient=p, appointment_date=day, start_time='09:00', end_time='09:30')
+            for d, p in pairs
+        ])
+        Prescriptions.objects.bulk_create([
+            Prescriptions(
+                id=uuid.uuid4(), doctor=d, patient=p, appointment=appointment, prescription_date=day,
+                details={'medications': []}, is_synced=True,
+            )
+            for (d, p), appointment in zip(pairs, appointments)
+        ])
+        return doctor, patient
+
+    def assert_constant(self, expected, make_request):
+        for size in self.SIZES:
+            with self.subTest(size=size):
+                doctor, patient = self.populate(size)
+                with self.assertNumQueries(expected):
+                    response = make_request(doctor, patient)
+                self.assertEqual(response.status_code, 200)
+                self.assertGreaterEqual(len(response.json()['results']), size)
+
+    def test_all_appointments(self):
+        self.assert_constant(1, lambda doctor, patient: self.client.get(
+            reverse('appointments-all-appointments'), {'page_size': 1000}
+        ))
+
+    def test_appointment_list(self):
+        self.assert_constant(1, lambda doctor, patient: self.client.get(
+            reverse('appointments-list'), {'doctor': doctor.id, 'page_size': 1000}
+        ))
+
+    def test_doctor_appointments(self):
+        self.assert_constant(1, lambda doctor, patient: self.client.get(
+            reverse('appointments-doctor-appointments'), {'doctor_id': doctor.id, 'page_size': 1000}
+        ))
+
+    def test_patient_appointments(self):
+        self.assert_constant(1, lambda doctor, patient: self.client.get(
+            reverse('appointments-patient-appointments'), {'patient_id': patient.id, 'page_size': 1000}
+        ))
+
+    def test_doctor_appointments_view(self):
+        self.assert_constant(2, lambda doctor, patient: self.client.get(
+            reverse('doctor-appointments'), {'page_size': 1000}, **auth(doctor.user)
+        ))
+
+    def test_patient_prescriptions(self):
+        self.assert_constant(1, lambda doctor, patient: self.client.get(
+            reverse('prescriptions-patient-prescriptions'), {'patient_id': patient.id, 'page_size': 1000}
+        ))
+
+    def test_doctor_prescriptions(self):
+        self.assert_constant(1, lambda doctor, patient: self.client.get(
+            reverse('prescriptions-doctor-prescriptions'), {'doctor_id': doctor.id, 'page_size': 1000}
+        ))
+
+    def test_doctor_prescriptions_view(self):
+        self.assert_constant(2, lambda doctor, patient: self.client.get(
+            reverse('doctor-prescriptions'), {'page_size': 1000}, **auth(doctor.user)
+        ))
+
+
+class SearchTests(AuthTestMixin, TestCase):
+    """Every word of the query must match, on Postgres and in process alike"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.amina = make_doctor('Cardiology', 'Amina Benali', hospital_name='Mustapha Hospital')
+        cls.karim = make_doctor('Dermatology', 'Karim Benali', hospital_name='Parnet Clinic')
+        cls.lina = make_doctor('Pediatrics', 'Lina Haddad', bio='Pediatric cardiology')
+
+    def search(self, text):
+        return {doctor_id for doctor_id, _ in search_doctors(text, 10)}
+
+    def test_single_word(self):
+        self.assertEqual(self.search('benali'), {self.amina.id, self.karim.id})
+        self.assertEqual(self.search('cardio'), {self.amina.id, self.lina.id})
+
+    def test_all_words_must_match(self):
+        self.assertEqual(self.search('benali cardio'), {self.amina.id})
+        self.assertEqual(self.search('cardio benali'), {self.amina.id})
+        self.assertEqual(self.search('benali neurology'), set())
+
+    def test_words_may_match_different_fields(self):
+        self.assertEqual(self.search('haddad pediatric'), {self.lina.id})
+        self.assertEqual(self.search('karim parnet'), {self.karim.id})
+
+    def test_typo_in_one_word(self):
+        self.assertEqual(self.search('benali dermatolgy'), {self.karim.id})
+
+    def test_repeated_word(self):
+        self.assertEqual(self.search('benali benali'), {self.amina.id, self.karim.id})
+
+    def test_scores(self):
+        def scores(text):
+            return [(doctor_id, round(score, 6)) for doctor_id, score in search_doctors(text, 10)]
+
+        # Best field of each word, summed over the words, typos halved
+        self.assertEqual(scores('cardio'), [(self.amina.id, 1.0), (self.lina.id, 0.1)])
+        self.assertEqual(scores('benali mustapha'), [(self.amina.id, 1.4)])
+        self.assertEqual(scores('benali dermatolgy'), [(self.karim.id, 1.5)])
+
+    def test_endpoint(self):
+        response = self.client.get(reverse('doctor-search'), {'q': 'Benali cardio'}, **auth(make_profile()))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['id'] for row in response.json()['results']], [str(self.amina.id)])
+
+    def test_invalid_cursor(self):
+        user = make_profile()
+        for values in ([1, 5], [1, None], ['1', str(self.amina.id)], [True, str(self.amina.id)],
+                       [float('nan'), str(self.amina.id)], [float('inf'), str(self.amina.id)], [1, 'not-a-uuid']):
+            with self.subTest(values=values):
+                response = self.client.get(reverse('doctor-search'), {'q': 'benali', 'cursor': encode_cursor(values)},
+                                           **auth(user))
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response.json(), {'detail': 'Invalid cursor'})
+
+
+class PrescriptionSyncTests(AuthTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = make_doctor()
+        cls.other_doctor = make_doctor()
+        cls.patient = make_profile()
+
+    def sync(self, *local_ids):
+        items = [{'local_id': local_id, 'patient_id': str(self.patient.id), 'pdf_url': 'https://evil.example'}
+                 for local_id in local_ids]
+        response = self.client.post(reverse('prescriptions-sync'), {'prescriptions': items},
+                                    content_type='application/json', **auth(self.doctor.user))
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def test_replay_updates(self):
+        created = self.sync('a')[0]
+        self.assertEqual(created['status'], 'created')
+        Prescriptions.objects.filter(id=created['id']).update(pdf_url='https://pdfs/a.pdf')
+        replayed = self.sync('a')[0]
+        self.assertEqual((replayed['status'], replayed['id']), ('updated', created['id']))
+        # Only the renderer sets the PDF
+        self.assertEqual(Prescriptions.objects.get(id=created['id']).pdf_url, 'https://pdfs/a.pdf')
+
+    def test_local_id_of_another_doctor(self):
+        theirs = make_prescription(self.patient, self.other_doctor, local_id='b')
+        result = self.sync('b')[0]
+        self.assertEqual((result['status'], result['errors']), ('error', ['local_id belongs to another doctor']))
+        self.assertEqual(Prescriptions.objects.get(local_id='b').doctor_id, theirs.doctor_id)
+
+    def test_local_id_taken_after_the_check(self):
+        def taken_first(prescriptions):
+            make_prescription(self.patient, self.other_doctor, local_id='c')
+            return _upsert(prescriptions)
+
+        with mock.patch('app.prescription_sync._upsert', side_effect=taken_first):
+            results = self.sync('c', 'd')
+        self.assertEqual([result['status'] for result in results], ['error', 'created'])
+        self.assertEqual(results[0]['errors'], ['local_id belongs to another doctor'])
+        self.assertEqual(Prescriptions.objects.get(local_id='c').doctor_id, self.other_doctor.id)
+        self.assertEqual(Prescriptions.objects.get(local_id='d').doctor_id, self.doctor.id)
+
+
+class SyncCursorTests(AuthTestMixin, TestCase):
+    def changes(self, positions):
+        return self.client.get(reverse('sync-changes'), {'cursor': encode_cursor(positions)}, **auth(make_profile()))
+
+    def test_valid_cursor(self):
+        response = self.changes([
+            ['appointments', '2026-01-01T00:00:00+00:00', str(uuid.uuid4())],
+            ['deleted', '2026-01-01T00:00:00+00:00', 12],
+            ['synced_at', timezone.now().isoformat()],
+        ])
+        self.assertEqual(response.status_code, 200)
+
+    def test_invalid_positions(self):
+        now, row_id = '2026-01-01T00:00:00+00:00', str(uuid.uuid4())
+        for entry in (
+            ['appointments', 'yesterday', row_id],
+            ['appointments', '2026-13-45T00:00:00+00:00', row_id],
+            ['appointments', '2026-01-01T00:00:00', row_id],
+            ['appointments', 1767225600, row_id],
+            ['appointments', now, 'not-a-uuid'],
+            ['appointments', now, 12],
+            ['deleted', now, row_id],
+            ['deleted', now, True],
+            ['unknown', now, row_id],
+            ['synced_at', 'yesterday'],
+            ['synced_at', now, row_id],
+        ):
+            with self.subTest(entry=entry):
+                response = self.changes([entry])
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'detail': 'Invalid cursor or limit'})
+
+
+@override_settings(SYNC_TOMBSTONE_RETENTION_DAYS=30, SYNC_SETTLE_SECONDS=0)
+class SyncRetentionTests(AuthTestMixin, TestCase):
+    """Tombstones are pruned after the retention, cursors older than it get 410"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient, cls.doctor = make_profile(), make_doctor()
+
+    def changes(self, cursor=None, **params):
+        if cursor is not None:
+            params['cursor'] = cursor
+        return self.client.get(reverse('sync-changes'), params, **auth(self.patient))
+
+    def cursor(self, synced_at):
+        return encode_cursor([['synced_at', synced_at.isoformat()]])
+
+    def test_recent_cursor(self):
+        self.assertEqual(self.changes(self.cursor(timezone.now() - timedelta(days=29))).status_code, 200)
+
+    def test_expired_cursor(self):
+        for cursor in (
+            self.cursor(timezone.now() - timedelta(days=31)),
+            # Without the time it was caught up to, it can't be trusted
+            encode_cursor([['appointments', timezone.now().isoformat(), str(uuid.uuid4())]]),
+        ):
+            with self.subTest(cursor=cursor):
+                response = self.changes(cursor)
+                self.assertEqual(response.status_code, 410)
+                self.assertEqual(response.json(), {'detail': 'Cursor expired, sync again without a cursor'})
+
+    def test_caught_up_time_kept_while_paging(self):
+        for hour in (9, 10, 11):
+            make_appointment(self.patient, self.doctor, future_date(), f'{hour}:00', f'{hour}:30')
+        first = self.changes(limit=2).json()
+        self.assertTrue(first['has_more'])
+        started = parse_sync_cursor(first['next_cursor'])[1]
+        last = self.changes(first['next_cursor'], limit=2).json()
+        self.assertFalse(last['has_more'])
+        self.assertEqual(len(last['appointments']), 1)
+        self.assertGreaterEqual(parse_sync_cursor(last['next_cursor'])[1], started)
+
+        # A page that isn't the last keeps the time of the last complete sync
+        old = timezone.now() - timedelta(days=10)
+        cursor = encode_cursor([['synced_at', old.isoformat()]])
+        self.assertEqual(parse_sync_cursor(self.changes(cursor, limit=2).json()['next_cursor'])[1], old)
+
+    def test_prune(self):
+        appointment = make_appointment(self.patient, self.doctor, future_date())
+        # One for the patient, one for the doctor
+        appointment.delete()
+        recent = set(SyncTombstone.objects.values_list('id', flat=True))
+        self.assertEqual(len(recent), 2)
+        old = SyncTombstone.objects.create(entity='appointment', object_id=uuid.uuid4(), owner_id=self.patient.id)
+        SyncTombstone.objects.filter(id=old.id).update(deleted_at=timezone.now() - timedelta(days=31))
+        out = io.StringIO()
+        call_command('prune_sync_tombstones', stdout=out)
+        self.assertEqual(set(SyncTombstone.objects.values_list('id', flat=True)), recent)
+        self.assertIn('Deleted 1 tombstones', out.getvalue())
+
+
+class PrescriptionFilterTests(AuthTestMixin, TestCase):
+    """Details filters answer the same on Postgres (@>) and SQLite (json_contains)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor, cls.patient = make_doctor(), make_profile()
+        cls.amoxicillin = make_prescription(cls.patient, cls.doctor, details={
+            'medications': [{'name': 'Amoxicillin', 'dosage': '500mg'}, {'name': 'Ibuprofen', 'dosage': '200mg'}],
+        })
+        cls.ibuprofen = make_prescription(cls.patient, cls.doctor, details={
+            'medications': [{'name': 'Ibuprofen', 'dosage': '400mg'}], 'refills': 2,
+        })
+
+    def ids(self, **params):
+        response = self.client.get(reverse('prescriptions-list'), params, **auth(self.doctor.user))
+        self.assertEqual(response.status_code, 200)
+        return {row['id'] for row in response.json()['results']}
+
+    def test_medication(self):
+        self.assertEqual(self.ids(medication='Amoxicillin'), {str(self.amoxicillin.id)})
+        self.assertEqual(self.ids(medication='Ibuprofen'), {str(self.amoxicillin.id), str(self.ibuprofen.id)})
+        self.assertEqual(self.ids(medication='ibuprofen'), set())
+
+    def test_details_contains(self):
+        self.assertEqual(self.ids(details_contains='{"medications": [{"dosage": "400mg"}]}'), {str(self.ibuprofen.id)})
+        # Numbers and booleans don't match each other, like jsonb
+        self.assertEqual(self.ids(details_contains='{"refills": 2}'), {str(self.ibuprofen.id)})
+        self.assertEqual(self.ids(details_contains='{"refills": true}'), set())
+        self.assertEqual(self.ids(details_contains='{"refills": 2}', medication='Amoxicillin'), set())
+
+    def test_one_query_for_the_page(self):
+        queryset = filter_details(Prescriptions.objects.all(), [{'medications': [{'name': 'Ibuprofen'}]}])
+        with self.assertNumQueries(1):
+            self.assertEqual(len(queryset.order_by('id')[:1]), 1)
+
+
+@task('tests.noop')
+def noop_task():
+    pass
+
+
+@task('tests.fail')
+def failing_task():
+    raise RuntimeError('task failed')
+
+
+class TaskTests(AuthTestMixin, TestCase):
+    def make_task(self, **fields):
+        fields.setdefault('run_at', timezone.now())
+        return Task.objects.create(name='tests.noop', max_attempts=3, **fields)
+
+    def test_expired_lease_claimed_again(self):
+        expired = self.make_task(status=Task.Status.RUNNING, attempts=2, locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual([(t.id, t.attempts) for t in claim()], [(expired.id, 3)])
+
+    def test_expired_lease_on_last_attempt_is_dead(self):
+        expired = self.make_task(status=Task.Status.RUNNING, attempts=3, locked_until=timezone.now() - timedelta(seconds=1))
+        queued = self.make_task(run_at=timezone.now() + timedelta(microseconds=1))
+        with self.assertLogs('app.tasks', 'ERROR'):
+            claimed = claim()
+        # Claiming goes on past the dead letter
+        self.assertEqual([t.id for t in claimed], [queued.id])
+        expired.refresh_from_db()
+        self.assertEqual((expired.status, expired.attempts, expired.locked_until), (Task.Status.DEAD, 3, None))
+
+    @override_settings(TASKS_SYNC=True)
+    def test_sync_failure_logged(self):
+        with self.assertLogs('app.tasks', 'ERROR') as logs, self.captureOnCommitCallbacks(execute=True):
+            enqueue('tests.fail')
+        self.assertIn('RuntimeError: task failed', logs.output[0])
+
+    @override_settings(TASKS_SYNC=True)
+    def test_cancel_notifies(self):
+        patient, doctor = make_profile(), make_doctor()
+        appointment = make_appointment(patient, doctor, future_date())
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(reverse('appointments-cancel', args=[appointment.id]), {},
+                                         content_type='application/json', **auth(patient))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(Notifications.objects.filter(user_id=patient.id).values_list('type', 'related_id')),
+            [(Notifications.Types.APPOINTMENT_CANCELLED, appointment.id)],
+        )
+
+
+class MetricsPermissionTests(AuthTestMixin, TestCase):
+    def test_anonymous_refused(self):
+        self.assertIn(self.client.get(reverse('metrics')).status_code, (401, 403))
+
+    def test_signed_in_user(self):
+        response = self.client.get(reverse('metrics'), **auth(make_profile()))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('auth_token_cache', response.json())
+
+    @override_settings(METRICS_TOKEN='scrape-me')
+    def test_token_required_when_set(self):
+        self.assertEqual(self.client.get(reverse('metrics'), **auth(make_profile())).status_code, 403)
+        self.assertIn(self.client.get(reverse('metrics'), HTTP_X_METRICS_TOKEN='wrong').status_code, (401, 403))
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_X_METRICS_TOKEN='scrape-me').status_code, 200)
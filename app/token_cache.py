@@ -0,0 +1,210 @@
+"""
+Cache of verified bearer tokens
+
+A bounded in-process LRU maps token -> user data, optionally backed by a
+shared Django cache so that workers can reuse each other's verifications.
+Entries never outlive the token's own `exp` claim, and AUTH_TOKEN_CACHE_TTL
+caps how long a token revoked on Supabase can keep being accepted.
+Rejected tokens go to a small, short-lived negative cache.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+
+# Returned by TokenCache.get when the token is in neither cache
+MISS = object()
+
+
+def _token_key(token):
+    """Hash the token so raw credentials are never kept as cache keys"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _token_expiry(token, user_data):
+    """
+    Get the `exp` claim of an already verified token
+
+    Returns:
+        float or None: Unix timestamp, None if the token has no expiry
+    """
+    exp = user_data.get('exp') if isinstance(user_data, dict) else None
+    if exp is None:
+        try:
+            exp = jwt.decode(token, options={'verify_signature': False}).get('exp')
+        except jwt.InvalidTokenError:
+            return None
+    try:
+        return float(exp)
+    except (TypeError, ValueError):
+        return None
+
+
+class _LRU:
+    """Thread-safe LRU of key -> (expires_at, value)"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, now):
+        """
+        Returns:
+            tuple: (value or MISS, expired) where expired tells if a stale
+            entry was dropped
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISS, False
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._entries[key]
+                return MISS, True
+            self._entries.move_to_end(key)
+            return value, False
+
+    def set(self, key, value, expires_at):
+        """
+        Returns:
+            int: Number of entries evicted to make room
+        """
+        evicted = 0
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+        return evicted
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TokenCache:
+    """Two-tier cache of verified tokens plus a negative cache for rejected ones"""
+
+    def __init__(self, max_entries, ttl, negative_max_entries, negative_ttl, shared_alias=''):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.shared_alias = shared_alias
+        self._positive = _LRU(max_entries)
+        self._negative = _LRU(negative_max_entries)
+        self._counters = dict.fromkeys(
+            ('hits', 'shared_hits', 'negative_hits', 'misses', 'evictions', 'expirations'), 0
+        )
+        self._counter_lock = threading.Lock()
+
+    def _count(self, name, amount=1):
+        if not amount:
+            return
+        with self._counter_lock:
+            self._counters[name] += amount
+
+    def _shared(self):
+        return caches[self.shared_alias] if self.shared_alias else None
+
+    def get(self, token, record=True):
+        """
+        Look a token up in the local, shared and negative caches
+
+        Args:
+            token (str): The raw JWT
+            record (bool): Count the lookup in the hit/miss statistics
+
+        Returns:
+            dict, None or MISS: Cached user data, None for a recently
+            rejected token, MISS if the token has to be verified
+        """
+        key = _token_key(token)
+        now = time.time()
+
+        user_data, expired = self._positive.get(key, now)
+        if expired:
+            self._count('expirations', record)
+        if user_data is not MISS:
+            self._count('hits', record)
+            return user_data
+
+        shared = self._shared()
+        if shared is not None:
+            entry = shared.get(f'auth-token:{key}')
+            if entry is not None and entry[0] > now:
+                expires_at, user_data = entry
+                self._count('evictions', self._positive.set(key, user_data, expires_at))
+                self._count('shared_hits', record)
+                return user_data
+
+        rejected, _ = self._negative.get(key, now)
+        if rejected is not MISS:
+            self._count('negative_hits', record)
+            return None
+
+        self._count('misses', record)
+        return MISS
+
+    def set(self, token, user_data):
+        """
+        Remember a verified token until its expiry or the cache TTL, whichever is first
+
+        Args:
+            token (str): The raw JWT
+            user_data (dict): Result of the verification
+        """
+        now = time.time()
+        token_exp = _token_expiry(token, user_data)
+        if token_exp is None or token_exp <= now:
+            return
+        expires_at = min(token_exp, now + self.ttl)
+
+        key = _token_key(token)
+        self._count('evictions', self._positive.set(key, user_data, expires_at))
+
+        shared = self._shared()
+        if shared is not None:
+            shared.set(f'auth-token:{key}', (expires_at, user_data), timeout=max(1, int(expires_at - now)))
+
+    def reject(self, token):
+        """Remember a token that failed verification for AUTH_TOKEN_NEGATIVE_CACHE_TTL seconds"""
+        self._count('evictions', self._negative.set(_token_key(token), True, time.time() + self.negative_ttl))
+
+    def clear(self):
+        """Drop every local entry (the shared tier expires on its own)"""
+        self._positive.clear()
+        self._negative.clear()
+
+    def stats(self):
+        """
+        Returns:
+            dict: Hit/miss/eviction counters and current sizes
+        """
+        with self._counter_lock:
+            stats = dict(self._counters)
+        lookups = stats['hits'] + stats['shared_hits'] + stats['negative_hits'] + stats['misses']
+        stats['hit_rate'] = round((lookups - stats['misses']) / lookups, 4) if lookups else None
+        stats['size'] = len(self._positive)
+        stats['negative_size'] = len(self._negative)
+        return stats
+
+
+token_cache = TokenCache(
+    max_entries=settings.AUTH_TOKEN_CACHE_MAX_ENTRIES,
+    ttl=settings.AUTH_TOKEN_CACHE_TTL,
+    negative_max_entries=settings.AUTH_TOKEN_NEGATIVE_CACHE_MAX_ENTRIES,
+    negative_ttl=settings.AUTH_TOKEN_NEGATIVE_CACHE_TTL,
+    shared_alias=settings.AUTH_TOKEN_SHARED_CACHE,
+)
+
+metrics.register('auth_token_cache', token_cache.stats)
@@ -1,45 +1,274 @@
 
-import requests
+import threading
+import time
+
+import jwt
+from asgiref.sync import sync_to_async
 from django.conf import settings
 
-def verify_token(token):
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from . import metrics, supabase_client
+from .singleflight import Group
+from .supabase_client import SupabaseUnavailable
+from .token_cache import MISS, token_cache
+
+
+# Claims copied from a locally verified token into the user data dict, so
+# callers get the same shape as the Supabase /auth/v1/user response
+USER_CLAIMS = ('email', 'phone', 'role', 'aud', 'exp', 'user_metadata', 'app_metadata')
+
+# A token signed with a key we don't know refetches the JWKS (keys may have
+# rotated), but no more often than this, in seconds
+JWKS_MIN_REFRESH_INTERVAL = 30
+
+# Coalesces concurrent verifications of the same token within this worker
+_verifications = Group()
+metrics.register('auth_singleflight', _verifications.stats)
+
+
+class AuthServiceUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Authentication service unavailable, try again later.'
+    default_code = 'auth_unavailable'
+
+
+
+class _JWKSCache:
+    """
+    Public keys of the project's JWKS, by key id
+
+    Fetched through supabase_client, so the pooled session, deadline and
+    token-check circuit breaker apply, and kept SUPABASE_JWKS_CACHE_SECONDS.
+    When Supabase can't be reached the keys already known are kept.
+    """
+
+    def __init__(self):
+        self._keys = {}
+        self._fetched_at = None
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        """Fetch the JWKS (caller holds the lock)"""
+        try:
+            response = supabase_client.get_jwks()
+            if response.status_code != 200:
+                raise jwt.PyJWKSetError(f"JWKS request returned {response.status_code}")
+            jwks = jwt.PyJWKSet.from_dict(response.json())
+        except (SupabaseUnavailable, ValueError, jwt.PyJWKError, jwt.PyJWKSetError) as e:
+            print(f"Could not load signing keys from JWKS: {str(e)}")
+            return
+        self._keys = {key.key_id: key.key for key in jwks.keys}
+        self._fetched_at = time.monotonic()
+
+    def get(self, kid):
+        """
+        Key for a key id, refetching the JWKS when it is stale or lacks it
+
+        Returns:
+            The public key, None if the JWKS has no such key
+        """
+        # Held during the fetch too, so concurrent misses fetch it once
+        with self._lock:
+            now = time.monotonic()
+            age = None if self._fetched_at is None else now - self._fetched_at
+            if age is None or age >= settings.SUPABASE_JWKS_CACHE_SECONDS or (
+                kid not in self._keys and age >= JWKS_MIN_REFRESH_INTERVAL
+            ):
+                self._refresh()
+            if kid is None and len(self._keys) == 1:
+                return next(iter(self._keys.values()))
+            return self._keys.get(kid)
+
+    def clear(self):
+        with self._lock:
+            self._keys = {}
+            self._fetched_at = None
+
+
+jwks_cache = _JWKSCache()
+
+
+def _get_signing_key(token):
+    """
+    Find the key that should have signed the token
+
+    Args:
+        token (str): The raw JWT
+
+    Returns:
+        tuple or None: (key, algorithm) or None if no key is configured for it
+    """
+    header = jwt.get_unverified_header(token)
+    algorithm = header.get('alg')
+
+    if algorithm == 'HS256':
+        if not settings.SUPABASE_JWT_SECRET:
+            return None
+        return settings.SUPABASE_JWT_SECRET, algorithm
+
+    if not settings.SUPABASE_JWKS_URL:
+        return None
+    key = jwks_cache.get(header.get('kid'))
+    if key is None:
+        return None
+    return key, algorithm
+
+
+def verify_token_locally(token):
+    """
+    Verify a Supabase JWT signature, expiry and audience without a network call
+
+    Tokens revoked on Supabase (e.g. after sign-out) stay valid here until
+    they expire, which is the trade-off for not asking Supabase every time.
+
+    Args:
+        token (str): The raw JWT (without the "Bearer " prefix)
+
+    Returns:
+        dict or None: User data if token is valid, None if invalid
+
+    Raises:
+        LookupError: No key is configured for the token's algorithm, so it
+            can only be checked by Supabase
+    """
+    try:
+        signing_key = _get_signing_key(token)
+    except jwt.InvalidTokenError as e:
+        print(f"Token verification failed: {str(e)}")
+        return None
+
+    if signing_key is None:
+        raise LookupError("No local key available for this token")
+
+    key, algorithm = signing_key
+    try:
+        claims = jwt.decode(
+            token,
+            key,
+            algorithms=[algorithm],
+            audience=settings.SUPABASE_JWT_AUDIENCE,
+            options={'require': ['exp', 'sub']},
+            leeway=settings.SUPABASE_JWT_LEEWAY,
+        )
+    except jwt.InvalidTokenError as e:
+        print(f"Token verification failed: {str(e)}")
+        return None
+
+    user_data = {'id': claims['sub']}
+    for claim in USER_CLAIMS:
+        if claim in claims:
+            user_data[claim] = claims[claim]
+    return user_data
+
+
+def verify_token_remotely(token):
     """
     Verify a JWT token with Supabase authentication API
-    
+
+    Args:
+        token (str): The raw JWT (without the "Bearer " prefix)
+
+    Returns:
+        dict or None: User data if token is valid, None if Supabase rejected it
+
+    Raises:
+        SupabaseUnavailable: Supabase could not be reached or failed
+    """
+    # Call Supabase auth API to verify token and get user
+    response = supabase_client.get_user(token)
+
+    # If request is successful, return the user data
+    if response.status_code == 200:
+        return response.json()
+
+    # Server errors say nothing about the token itself
+    if response.status_code >= 500:
+        raise SupabaseUnavailable(f"Supabase returned {response.status_code}")
+    print(f"Token verification failed: {response.status_code} - {response.text}")
+    return None
+
+
+def _verify_uncached(token):
+    """Verify a token according to SUPABASE_AUTH_MODE, bypassing the token cache"""
+    if settings.SUPABASE_AUTH_MODE == 'local':
+        try:
+            return verify_token_locally(token)
+        except LookupError:
+            pass
+        except Exception as e:
+            print(f"Error verifying token locally: {str(e)}")
+
+    return verify_token_remotely(token)
+
+
+def verify_token(token):
+    """
+    Verify a JWT token, locally or with Supabase depending on SUPABASE_AUTH_MODE
+
+    In "local" mode the token is checked with PyJWT against the project JWT
+    secret or the cached JWKS, and Supabase is only asked when no local key
+    matches the token. In "remote" mode every token goes to Supabase.
+    Results are kept in the token cache, so repeat callers skip both, and
+    concurrent callers with the same token share a single verification.
+
     Args:
         token (str): The JWT token to verify
-        
+
     Returns:
         dict or None: User data if token is valid, None if invalid
+
+    Raises:
+        AuthServiceUnavailable: Supabase is unavailable and the token can't be
+            checked locally
     """
     if not token:
         return None
-        
+
+    # Clean the token if it has the "Bearer " prefix
+    if token.startswith('Bearer '):
+        token = token.split(' ')[1]
+
+    cached = token_cache.get(token)
+    if cached is not MISS:
+        return cached
+
+    return _verifications.do(token, lambda: _verify_and_remember(token))
+
+
+async def averify_token(token):
+    """Async variant of verify_token for ASGI code paths, sharing the same in-flight calls"""
+    return await sync_to_async(verify_token, thread_sensitive=False)(token)
+
+
+def _verify_and_remember(token):
+    """Verify a token that missed the cache and store the outcome"""
+    # Another flight may have finished while we were waiting to start
+    cached = token_cache.get(token, record=False)
+    if cached is not MISS:
+        return cached
+
     try:
-        # Clean the token if it has the "Bearer " prefix
-        if token.startswith('Bearer '):
-            token = token.split(' ')[1]
-            
-        # Call Supabase auth API to verify token and get user
-        response = requests.get(
-            f"{settings.SUPABASE_URL}/auth/v1/user",
-            headers={
-                'apikey': settings.SUPABASE_KEY,
-                'Authorization': f'Bearer {token}'
-            }
-        )
-        
-        # If request is successful, return the user data
-        if response.status_code == 200:
-            return response.json()
-        else:
-            print(f"Token verification failed: {response.status_code} - {response.text}")
-            return None
-            
+        user_data = _verify_uncached(token)
+    except SupabaseUnavailable as e:
+        # Degrade to the local check when Supabase is down or the circuit is open
+        print(f"Supabase unavailable, verifying token locally: {str(e)}")
+        try:
+            user_data = verify_token_locally(token)
+        except LookupError:
+            raise AuthServiceUnavailable()
     except Exception as e:
+        # Not the token's fault, so don't remember it as rejected
         print(f"Error verifying token: {str(e)}")
         return None
 
+    if user_data:
+        token_cache.set(token, user_data)
+    else:
+        token_cache.reject(token)
+    return user_data
+
 def get_user_id_from_token(request):
     """
     Extract and verify user ID from authentication token in request
@@ -50,6 +279,13 @@ def get_user_id_from_token(request):
     Returns:
         str or None: User ID if token is valid, None otherwise
     """
+    from .authentication import Principal
+
+    # Already authenticated by SupabaseAuthentication
+    user = getattr(request, 'user', None)
+    if isinstance(user, Principal):
+        return user.user_id
+
     auth_header = request.META.get('HTTP_AUTHORIZATION', '')
     if not auth_header:
         return None
@@ -1,10 +1,12 @@
 from .auth_views import LoginView, SignUpView
 from .profile_views import ProfileViewSet, ProfileUpdateView
-from .doctor_views import DoctorProfileView, DoctorAvailabilityViewSet, FavoriteDoctorViewSet , DoctorAvailabilityView
-from .appointment_views import AppointmentViewSet, AppointmentsView
+from .doctor_views import DoctorProfileView, DoctorAvailabilityViewSet, FavoriteDoctorViewSet , DoctorAvailabilityView, EarliestSlotsView, DoctorSearchView
+from .appointment_views import AppointmentViewSet, AppointmentsView, AppointmentQRCodeView
 from .notification_views import NotificationViewSet
 from .prescription_views import PrescriptionViewSet, DoctorPrescriptionsView
 from .availability_views import DoctorAvailabilityManagementView
+from .metrics_views import MetricsView
+from .sync_views import SyncChangesView
 __all__ = [
     'LoginView',
     'SignUpView',
@@ -17,7 +19,12 @@ __all__ = [
     'NotificationViewSet',
     'PrescriptionViewSet',
     'DoctorAvailabilityView',
+    'EarliestSlotsView',
+    'DoctorSearchView',
     'AppointmentsView',
+    'AppointmentQRCodeView',
     'DoctorPrescriptionsView',
-    'DoctorAvailabilityManagementView'
+    'DoctorAvailabilityManagementView',
+    'MetricsView',
+    'SyncChangesView'
 ]
\ No newline at end of file
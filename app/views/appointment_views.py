@@ -5,32 +5,42 @@ from rest_framework.views import APIView
 from rest_framework import status 
 
 from datetime import datetime, time
-from ..utils import get_user_id_from_token
+from ..authentication import get_principal
+from ..booking import lock_doctor_day
+from ..pagination import KeysetPagination, keyset_filter, row_values
+from ..qr import build_qr_payload, get_qr_png, prerender_qr
+from ..notifications import notify_status_change
+from ..scheduling import availability_windows, booked_intervals, is_free, to_seconds, within_windows
 import uuid
-from django.db import models
-
-
-import qrcode
-import json
-import base64
-from io import BytesIO
+from django.db import models, transaction
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
 
 
 from ..models import (
     Appointments,
     Prescriptions,
-    DoctorAvailability,
     Profiles,
     DoctorProfiles
 )
 from ..serializers import (
     AppointmentSerializer,
     PrescriptionSerializer,
+    appointment_qr_url,
 )
 
+def includes(request, field):
+    """Whether the client asked for an optional field with ?include=a,b"""
+    include = request.query_params.get('include', '')
+    return field in [name.strip() for name in include.split(',')]
+
+
 class AppointmentViewSet(viewsets.ModelViewSet):
     queryset = Appointments.objects.all()
     serializer_class = AppointmentSerializer
+    pagination_class = KeysetPagination
+    ordering = ('appointment_date', 'start_time', 'id')
     #permission_classes = [IsAuthenticated]
 
 
@@ -43,51 +53,126 @@ class AppointmentViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(patient_id=patient_id)
         if doctor_id is not None:
             queryset = queryset.filter(doctor_id=doctor_id)
+        # Lists leave the QR payload out unless asked for (?include=qr_code)
+        if self.action == 'list' and not includes(self.request, 'qr_code'):
+            queryset = queryset.defer('qr_code')
+        # These rebuild the QR payload or notify the patient, which needs the
+        # patient and the doctor's name
+        if self.action in ('reschedule', 'modify_status', 'cancel'):
+            queryset = queryset.select_related('patient', 'doctor__user')
         return queryset
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action == 'list' and not includes(self.request, 'qr_code'):
+            context['omit_fields'] = ['qr_code']
+        return context
     
 
+    def _all_appointments_row(self, appointment, request, include_qr_code):
+        """Response row of all_appointments with doctor and patient information"""
+        # Handle cases where doctor or patient is None
+        doctor = appointment.doctor
+        patient = appointment.patient
+        doctor_info = {
+            'id': str(doctor.id) if doctor else None,
+            'full_name': doctor.user.full_name if doctor and doctor.user else None,
+            'specialty': doctor.specialty if doctor else None,
+            'hospital_name': doctor.hospital_name if doctor else None
+        } if doctor else None
+
+        patient_info = {
+            'id': str(patient.id) if patient else None,
+            'full_name': patient.full_name if patient else None,
+            'email': patient.email if patient else None
+        } if patient else None
+
+        appointment_data = {
+            'id': str(appointment.id),
+            'appointment_date': appointment.appointment_date,
+            'start_time': appointment.start_time,
+            'end_time': appointment.end_time,
+            'status': appointment.status,
+            'reason': appointment.reason,
+            'notes': appointment.notes,
+            'qr_code_url': appointment_qr_url(appointment.id, request),
+            'doctor_info': doctor_info,
+            'patient_info': patient_info
+        }
+        if include_qr_code:
+            appointment_data['qr_code'] = appointment.qr_code
+        return appointment_data
+
+    def _export_rows(self, appointments):
+        """Every row of the queryset in self.ordering, EXPORT_CHUNK_SIZE per query"""
+        chunk_size = settings.EXPORT_CHUNK_SIZE
+        appointments = appointments.order_by(*self.ordering)
+        page = list(appointments[:chunk_size])
+        while page:
+            yield from page
+            if len(page) < chunk_size:
+                return
+            after = keyset_filter(self.ordering, row_values(page[-1], self.ordering))
+            page = list(appointments.filter(after)[:chunk_size])
+
+    def _stream_all_appointments(self, appointments, request, include_qr_code, stream_format):
+        """
+        Stream every appointment as NDJSON or as a JSON array
+
+        Rows are read in keyset pages of EXPORT_CHUNK_SIZE and written as
+        they come, so memory use does not grow with the table and the first
+        bytes go out right away. Each page is its own query, unlike a
+        server-side cursor, which Supabase's transaction-mode pooler can't
+        keep open between them.
+        """
+        rows = self._export_rows(appointments)
+        encoder = DjangoJSONEncoder()
+
+        def ndjson():
+            for appointment in rows:
+                yield encoder.encode(self._all_appointments_row(appointment, request, include_qr_code)) + '\n'
+
+        def json_array():
+            yield '['
+            separator = ''
+            for appointment in rows:
+                yield separator + encoder.encode(self._all_appointments_row(appointment, request, include_qr_code))
+                separator = ','
+            yield ']'
+
+        if stream_format == 'ndjson':
+            return StreamingHttpResponse(ndjson(), content_type='application/x-ndjson')
+        return StreamingHttpResponse(json_array(), content_type='application/json')
+
     @action(detail=False, methods=['get'])
     def all_appointments(self, request):
-        """Get all appointments."""
+        """
+        Get all appointments.
+
+        ?stream=ndjson or ?stream=json exports the full history in one
+        streamed response instead of pages.
+        """
         try:
+            include_qr_code = includes(request, 'qr_code')
+            stream_format = request.query_params.get('stream')
+            if stream_format and stream_format not in ('ndjson', 'json'):
+                return Response({"detail": "stream must be 'ndjson' or 'json'"}, status=status.HTTP_400_BAD_REQUEST)
+
             # Get all appointments with related doctor and patient data
-            appointments = Appointments.objects.all().select_related('doctor', 'patient')
-            appointments = appointments.order_by('appointment_date', 'start_time')
+            appointments = Appointments.objects.all().select_related('doctor__user', 'patient')
+            if not include_qr_code:
+                appointments = appointments.defer('qr_code')
+
+            if stream_format:
+                return self._stream_all_appointments(appointments, request, include_qr_code, stream_format)
             
             # Enhanced response with both doctor and patient information
-            enhanced_data = []
-            for appointment in appointments:
-                # Handle cases where doctor or patient is None
-                doctor = appointment.doctor
-                patient = appointment.patient
-                doctor_info = {
-                    'id': str(doctor.id) if doctor else None,
-                    'full_name': doctor.user.full_name if doctor and doctor.user else None,
-                    'specialty': doctor.specialty if doctor else None,
-                    'hospital_name': doctor.hospital_name if doctor else None
-                } if doctor else None
-
-                patient_info = {
-                    'id': str(patient.id) if patient else None,
-                    'full_name': patient.full_name if patient else None,
-                    'email': patient.email if patient else None
-                } if patient else None
-
-                appointment_data = {
-                    'id': str(appointment.id),
-                    'appointment_date': appointment.appointment_date,
-                    'start_time': appointment.start_time,
-                    'end_time': appointment.end_time,
-                    'status': appointment.status,
-                    'reason': appointment.reason,
-                    'notes': appointment.notes,
-                    'qr_code': appointment.qr_code,
-                    'doctor_info': doctor_info,
-                    'patient_info': patient_info
-                }
-                enhanced_data.append(appointment_data)
+            enhanced_data = [
+                self._all_appointments_row(appointment, request, include_qr_code)
+                for appointment in self.paginate_queryset(appointments)
+            ]
                 
-            return Response(enhanced_data, status=status.HTTP_200_OK)
+            return self.get_paginated_response(enhanced_data)
             
         except Exception as e:
             return Response({"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -115,12 +200,10 @@ class AppointmentViewSet(viewsets.ModelViewSet):
                 appointments = appointments.filter(appointment_date__gte=date_from)
             if date_to:
                 appointments = appointments.filter(appointment_date__lte=date_to)
-                
-            appointments = appointments.order_by('appointment_date', 'start_time')
             
             # Enhanced response with patient information
             appointments_data = []
-            for appointment in appointments:
+            for appointment in self.paginate_queryset(appointments):
                 appointment_data = {
                     'id': str(appointment.id),
                     'appointment_date': appointment.appointment_date,
@@ -138,7 +221,7 @@ class AppointmentViewSet(viewsets.ModelViewSet):
                 }
                 appointments_data.append(appointment_data)
             
-            return Response(appointments_data, status=status.HTTP_200_OK)
+            return self.get_paginated_response(appointments_data)
             
         except Exception as e:
             return Response({"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -156,10 +239,14 @@ class AppointmentViewSet(viewsets.ModelViewSet):
             date_from = request.query_params.get('date_from')
             date_to = request.query_params.get('date_to')
             
+            include_qr_code = includes(request, 'qr_code')
+
             # Base query with doctor information
             appointments = Appointments.objects.filter(
                 patient_id=patient_id
             ).select_related('doctor', 'doctor__user')
+            if not include_qr_code:
+                appointments = appointments.defer('qr_code')
             
             # Apply filters
             if appointment_status:
@@ -168,12 +255,10 @@ class AppointmentViewSet(viewsets.ModelViewSet):
                 appointments = appointments.filter(appointment_date__gte=date_from)
             if date_to:
                 appointments = appointments.filter(appointment_date__lte=date_to)
-                
-            appointments = appointments.order_by('appointment_date', 'start_time')
             
             # Enhanced response with doctor information
             appointments_data = []
-            for appointment in appointments:
+            for appointment in self.paginate_queryset(appointments):
                 appointment_data = {
                     'id': str(appointment.id),
                     'appointment_date': appointment.appointment_date,
@@ -182,7 +267,7 @@ class AppointmentViewSet(viewsets.ModelViewSet):
                     'status': appointment.status,
                     'reason': appointment.reason,
                     'notes': appointment.notes,
-                    'qr_code': appointment.qr_code,
+                    'qr_code_url': appointment_qr_url(appointment.id, request),
                     'doctor_info': {
                         'id': str(appointment.doctor.id),
                         'full_name': appointment.doctor.user.full_name,
@@ -191,9 +276,11 @@ class AppointmentViewSet(viewsets.ModelViewSet):
                         'avatar_url': appointment.doctor.user.avatar_url
                     }
                 }
+                if include_qr_code:
+                    appointment_data['qr_code'] = appointment.qr_code
                 appointments_data.append(appointment_data)
             
-            return Response(appointments_data, status=status.HTTP_200_OK)
+            return self.get_paginated_response(appointments_data)
             
         except Exception as e:
             return Response({"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -231,7 +318,10 @@ class AppointmentViewSet(viewsets.ModelViewSet):
             if 'reason' in request.data:
                 appointment.notes = f"Cancellation reason: {request.data['reason']}"
                 
-            appointment.save()
+            # The notification is queued with the save, as a task
+            with transaction.atomic():
+                appointment.save()
+                notify_status_change(appointment)
             
             # Return success response with updated appointment data
             serializer = self.serializer_class(appointment)
@@ -253,13 +343,15 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         
     def create(self, request):
         """Create a new appointment"""
-        user_id = get_user_id_from_token(request)
-        if not user_id:
+        principal = get_principal(request)
+        if not principal:
             return Response({"detail": "Unauthorized"}, status=status.HTTP_401_UNAUTHORIZED)
 
         try:
             # Get the patient profile
-            patient = Profiles.objects.get(id=user_id)
+            patient = principal.profile
+            if patient is None:
+                raise Profiles.DoesNotExist()
             
             # Verify that the user is a patient
             if patient.user_type != Profiles.UserType.PATIENT:
@@ -268,7 +360,7 @@ class AppointmentViewSet(viewsets.ModelViewSet):
 
             # Get the doctor profile
             doctor_id = request.data.get('doctor_id')
-            doctor = DoctorProfiles.objects.get(id=doctor_id)
+            doctor = DoctorProfiles.objects.select_related('user').get(id=doctor_id)
             
             # Validate appointment time
             start_time = request.data.get('start_time')
@@ -280,6 +372,11 @@ class AppointmentViewSet(viewsets.ModelViewSet):
             appt_end = datetime.strptime(end_time, '%H:%M:%S').time()
             appt_date = datetime.strptime(appointment_date, '%Y-%m-%d').date()
 
+            if appt_start >= appt_end:
+                return Response({
+                    "detail": "start_time must be before end_time"
+                }, status=status.HTTP_400_BAD_REQUEST)
+
             # Validate appointment is not in the past
             if appt_date < datetime.now().date():
                 return Response({
@@ -287,103 +384,59 @@ class AppointmentViewSet(viewsets.ModelViewSet):
                 }, status=status.HTTP_400_BAD_REQUEST)
             
             # Check if doctor is available at this time
-            availability = DoctorAvailability.objects.filter(
-                doctor_id=doctor_id,
-                day_of_week=datetime.strptime(appointment_date, '%Y-%m-%d').strftime('%A').lower(),
-                is_available=True
-            ).first()
+            windows = availability_windows(doctor.id, appt_date)
             
-            if not availability:
+            if not windows:
                 return Response({
                     "detail": "Doctor is not available on this day"
                 }, status=status.HTTP_400_BAD_REQUEST)
             
-            # Check if appointment time is within availability time
-            if appt_start < availability.start_time or appt_end > availability.end_time:
+            # Check if appointment time is within one of the availability windows
+            if not within_windows(windows, to_seconds(appt_start), to_seconds(appt_end)):
                 return Response({
                     "detail": "Appointment time must be within doctor's availability hours"
                 }, status=status.HTTP_400_BAD_REQUEST)
             
-            # Check for overlapping appointments
-            overlapping_appointments = Appointments.objects.filter(
-                doctor_id=doctor_id,
-                appointment_date=appointment_date
-            ).exclude(status=Appointments.Status.CANCELLED)
-            
-            # Check each existing appointment for overlap
-            for existing_appt in overlapping_appointments:
-                if (
-                    (appt_start >= existing_appt.start_time and appt_start < existing_appt.end_time) or  # Start time overlaps
-                    (appt_end > existing_appt.start_time and appt_end <= existing_appt.end_time) or      # End time overlaps
-                    (appt_start <= existing_appt.start_time and appt_end >= existing_appt.end_time)      # Appointment encompasses existing
-                ):
+            # Check for overlapping appointments and insert while holding the
+            # doctor's day lock, so concurrent bookings can't both pass the check
+            with transaction.atomic():
+                lock_doctor_day(doctor.id, appt_date)
+                if not is_free(booked_intervals(doctor.id, appt_date), to_seconds(appt_start), to_seconds(appt_end)):
                     return Response({
                         "detail": "This time slot conflicts with an existing appointment"
                     }, status=status.HTTP_400_BAD_REQUEST)
 
-            appointment_id = uuid.uuid4()
-            
-            # Create QR code data
-            qr_data = {
-                'appointment_id': str(appointment_id),
-                'patient': {
-                    'id': str(patient.id),
-                    'name': patient.full_name,
-                    'email': patient.email
-                },
-                'doctor': {
-                    'id': str(doctor.id),
-                    'name': doctor.user.full_name,
-                    'specialty': doctor.specialty,
-                    'hospital': doctor.hospital_name
-                },
-                'appointment': {
-                    'date': appointment_date,
+                appointment_id = uuid.uuid4()
+            
+                # Only the payload is stored, the image is rendered by AppointmentQRCodeView
+                qr_payload = build_qr_payload(
+                    appointment_id, patient, doctor,
+                    appointment_date, start_time, end_time,
+                    Appointments.Status.SCHEDULED
+                )
+
+                # Create appointment data
+                appointment_data = {
+                    'id': appointment_id,
+                    'patient': patient.id,
+                    'doctor': doctor.id,
+                    'appointment_date': appointment_date,
                     'start_time': start_time,
                     'end_time': end_time,
-                    'status': Appointments.Status.SCHEDULED
+                    'status': Appointments.Status.SCHEDULED,
+                    'reason': request.data.get('reason'),
+                    'notes': request.data.get('notes'),
+                    'qr_code': qr_payload
                 }
-            }
-            
-            # Generate QR code
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_L,
-                box_size=10,
-                border=4,
-            )
-            qr.add_data(json.dumps(qr_data))
-            qr.make(fit=True)
-            
-            # Create QR code image
-            qr_image = qr.make_image(fill_color="black", back_color="white")
-            
-            # Convert QR code to base64 string
-            buffered = BytesIO()
-            qr_image.save(buffered, format="PNG")
-            qr_code_base64 = base64.b64encode(buffered.getvalue()).decode()
-
-            # Create appointment data
-            appointment_data = {
-                'id': appointment_id,
-                'patient': patient.id,
-                'doctor': doctor.id,
-                'appointment_date': appointment_date,
-                'start_time': start_time,
-                'end_time': end_time,
-                'status': Appointments.Status.SCHEDULED,
-                'reason': request.data.get('reason'),
-                'notes': request.data.get('notes'),
-                'qr_code': f"data:image/png;base64,{qr_code_base64}"
-            }
-            
-            # Create the appointment
-            serializer = self.serializer_class(data=appointment_data)
-            if serializer.is_valid():
-                serializer.save()
-                return Response(serializer.data, status=status.HTTP_201_CREATED)
-            
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            
+                # Create the appointment
+                serializer = self.serializer_class(data=appointment_data)
+                if serializer.is_valid():
+                    serializer.save()
+                    prerender_qr(qr_payload)
+                    return Response(serializer.data, status=status.HTTP_201_CREATED)
+            
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
         except Profiles.DoesNotExist:
             return Response({"detail": "Patient profile not found"}, status=status.HTTP_404_NOT_FOUND)
@@ -407,60 +460,56 @@ class AppointmentViewSet(viewsets.ModelViewSet):
                     "detail": "start_time, end_time, and appointment_date are required"
                 }, status=status.HTTP_400_BAD_REQUEST)
 
+            # Parsed once, so '2026-10-5' and '2026-10-05' take the same lock
+            appt_date = datetime.strptime(new_date, '%Y-%m-%d').date()
+
             # Validate that appointment is not in the past
-            if datetime.strptime(new_date, '%Y-%m-%d').date() < datetime.now().date():
+            if appt_date < datetime.now().date():
                 return Response({
                     "detail": "Cannot reschedule to a past date"
                 }, status=status.HTTP_400_BAD_REQUEST)
 
-            # ... existing availability and conflict checks ...
-
-            # Update appointment details
-            appointment.start_time = new_start_time
-            appointment.end_time = new_end_time
-            appointment.appointment_date = new_date
-            appointment.save()
-
-            # Generate new QR code for rescheduled appointment
-            qr_data = {
-                'appointment_id': str(appointment.id),
-                'patient': {
-                    'id': str(appointment.patient.id),
-                    'name': appointment.patient.full_name,
-                    'email': appointment.patient.email
-                },
-                'doctor': {
-                    'id': str(appointment.doctor.id),
-                    'name': appointment.doctor.user.full_name,
-                    'specialty': appointment.doctor.specialty,
-                    'hospital': appointment.doctor.hospital_name
-                },
-                'appointment': {
-                    'date': new_date,
-                    'start_time': new_start_time,
-                    'end_time': new_end_time,
-                    'status': appointment.status
-                }
-            }
-            
-            # Generate new QR code
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_L,
-                box_size=10,
-                border=4,
-            )
-            qr.add_data(json.dumps(qr_data))
-            qr.make(fit=True)
-            
-            qr_image = qr.make_image(fill_color="black", back_color="white")
-            buffered = BytesIO()
-            qr_image.save(buffered, format="PNG")
-            qr_code_base64 = base64.b64encode(buffered.getvalue()).decode()
-            
-            # Update QR code
-            appointment.qr_code = f"data:image/png;base64,{qr_code_base64}"
-            appointment.save()
+            new_start = to_seconds(datetime.strptime(new_start_time, '%H:%M:%S').time())
+            new_end = to_seconds(datetime.strptime(new_end_time, '%H:%M:%S').time())
+            if new_start >= new_end:
+                return Response({
+                    "detail": "start_time must be before end_time"
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+            with transaction.atomic():
+                # Hold the target day's lock while checking and moving the slot
+                lock_doctor_day(appointment.doctor_id, appt_date)
+                # The same windows create checks, availability may have
+                # changed since the appointment was booked
+                windows = availability_windows(appointment.doctor_id, appt_date)
+                if not windows:
+                    return Response({
+                        "detail": "Doctor is not available on this day"
+                    }, status=status.HTTP_400_BAD_REQUEST)
+                if not within_windows(windows, new_start, new_end):
+                    return Response({
+                        "detail": "Appointment time must be within doctor's availability hours"
+                    }, status=status.HTTP_400_BAD_REQUEST)
+
+                busy = booked_intervals(appointment.doctor_id, appt_date, exclude_id=appointment.id)
+                if not is_free(busy, new_start, new_end):
+                    return Response({
+                        "detail": "This time slot conflicts with an existing appointment"
+                    }, status=status.HTTP_400_BAD_REQUEST)
+
+                # Update appointment details
+                appointment.start_time = new_start_time
+                appointment.end_time = new_end_time
+                appointment.appointment_date = appt_date
+
+                # Update QR code payload for the new slot
+                appointment.qr_code = build_qr_payload(
+                    appointment.id, appointment.patient, appointment.doctor,
+                    appt_date, new_start_time, new_end_time,
+                    appointment.status
+                )
+                appointment.save()
+                prerender_qr(appointment.qr_code)
 
             return Response({
                 "detail": "Appointment rescheduled successfully",
@@ -493,54 +542,26 @@ class AppointmentViewSet(viewsets.ModelViewSet):
                 }, status=status.HTTP_400_BAD_REQUEST)
 
             # Update appointment status
+            status_changed = appointment.status != new_status
             appointment.status = new_status
 
-            # Generate new QR code with updated status
-            qr_data = {
-                'appointment_id': str(appointment.id),
-                'patient': {
-                    'id': str(appointment.patient.id),
-                    'name': appointment.patient.full_name,
-                    'email': appointment.patient.email
-                },
-                'doctor': {
-                    'id': str(appointment.doctor.id),
-                    'name': appointment.doctor.user.full_name,
-                    'specialty': appointment.doctor.specialty,
-                    'hospital': appointment.doctor.hospital_name
-                },
-                'appointment': {
-                    'date': str(appointment.appointment_date),
-                    'start_time': str(appointment.start_time),
-                    'end_time': str(appointment.end_time),
-                    'status': new_status
-                }
-            }
-
-            # Create QR code
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_L,
-                box_size=10,
-                border=4,
+            # Update QR code payload with the new status
+            appointment.qr_code = build_qr_payload(
+                appointment.id, appointment.patient, appointment.doctor,
+                appointment.appointment_date, appointment.start_time, appointment.end_time,
+                new_status
             )
-            qr.add_data(json.dumps(qr_data))
-            qr.make(fit=True)
-
-            # Generate QR image
-            qr_image = qr.make_image(fill_color="black", back_color="white")
-            buffered = BytesIO()
-            qr_image.save(buffered, format="PNG")
-            qr_code_base64 = base64.b64encode(buffered.getvalue()).decode()
-
-            # Update appointment QR code
-            appointment.qr_code = f"data:image/png;base64,{qr_code_base64}"
             
             # Add status change note if provided
             if 'notes' in request.data:
                 appointment.notes = f"Status changed to {new_status}: {request.data['notes']}"
             
-            appointment.save()
+            # Side effects are queued with the save, as tasks
+            with transaction.atomic():
+                appointment.save()
+                prerender_qr(appointment.qr_code)
+                if status_changed:
+                    notify_status_change(appointment)
 
             return Response({
                 "detail": "Appointment status updated successfully",
@@ -561,26 +582,28 @@ class AppointmentViewSet(viewsets.ModelViewSet):
 class AppointmentsView(APIView):
     def get(self, request):
         """Get list of appointments for the logged in doctor"""
-        # Get user id from the token
-        doctor_user_id = get_user_id_from_token(request)
-        if not doctor_user_id:
+        principal = get_principal(request)
+        if not principal:
             return Response({"detail": "Unauthorized"}, status=status.HTTP_401_UNAUTHORIZED)
         
         try:
             # Get doctor profile
-            doctor_profile = DoctorProfiles.objects.get(user_id=doctor_user_id)
+            doctor_profile = principal.doctor_profile
+            if doctor_profile is None:
+                raise DoctorProfiles.DoesNotExist()
             
             # Verify that the user is a doctor
-            if doctor_profile.user.user_type != Profiles.UserType.DOCTOR:
+            if not principal.is_doctor:
                 return Response({"detail": "Only doctors can access their appointments"}, 
                                status=status.HTTP_403_FORBIDDEN)
             
             # Get appointments for the doctor
             appointments = Appointments.objects.filter(doctor=doctor_profile).select_related('patient')
+            paginator = KeysetPagination(ordering=AppointmentViewSet.ordering)
             
             # Format the response with required information
             appointments_data = []
-            for appointment in appointments:
+            for appointment in paginator.paginate_queryset(appointments, request, view=self):
                 appointment_data = {
                     'id': appointment.id,
                     'patient_name': appointment.patient.full_name,
@@ -595,7 +618,7 @@ class AppointmentsView(APIView):
                 }
                 appointments_data.append(appointment_data)
             
-            return Response(appointments_data, status=status.HTTP_200_OK)
+            return paginator.get_paginated_response(appointments_data)
             
         except DoctorProfiles.DoesNotExist:
             return Response({"detail": "Doctor profile not found"}, status=status.HTTP_404_NOT_FOUND)
@@ -605,9 +628,8 @@ class AppointmentsView(APIView):
 
     def patch(self, request, appointment_id=None):
         """Update appointment status for a doctor's appointment"""
-        # Get user id from the token
-        doctor_user_id = get_user_id_from_token(request)
-        if not doctor_user_id:
+        principal = get_principal(request)
+        if not principal:
             return Response({"detail": "Unauthorized"}, status=status.HTTP_401_UNAUTHORIZED)
         
         # Check if appointment_id was provided
@@ -628,10 +650,12 @@ class AppointmentsView(APIView):
         
         try:
             # Get doctor profile
-            doctor_profile = DoctorProfiles.objects.get(user_id=doctor_user_id)
+            doctor_profile = principal.doctor_profile
+            if doctor_profile is None:
+                raise DoctorProfiles.DoesNotExist()
             
             # Verify that the user is a doctor
-            if doctor_profile.user.user_type != Profiles.UserType.DOCTOR:
+            if not principal.is_doctor:
                 return Response({"detail": "Only doctors can update appointment status"}, 
                               status=status.HTTP_403_FORBIDDEN)
             
@@ -643,13 +667,19 @@ class AppointmentsView(APIView):
                               status=status.HTTP_404_NOT_FOUND)
             
             # Update appointment status
+            status_changed = appointment.status != new_status
             appointment.status = new_status
             
             # Optional: Add notes if provided
             if 'notes' in request.data:
                 appointment.notes = request.data.get('notes')
                 
-            appointment.save()
+            with transaction.atomic():
+                appointment.save()
+                if status_changed:
+                    # The caller's doctor profile, with its user already loaded
+                    appointment.doctor = doctor_profile
+                    notify_status_change(appointment)
             
             return Response({
                 "detail": "Appointment status updated successfully",
@@ -663,4 +693,37 @@ class AppointmentsView(APIView):
             return Response({"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
 
-    
\ No newline at end of file
+    
+
+
+class AppointmentQRCodeView(APIView):
+    def get(self, request, appointment_id):
+        """Get the QR code of an appointment as a PNG image"""
+        principal = get_principal(request)
+        if not principal:
+            return Response({"detail": "Unauthorized"}, status=status.HTTP_401_UNAUTHORIZED)
+
+        appointment = Appointments.objects.filter(id=appointment_id).values(
+            'qr_code', 'patient_id', 'doctor__user_id'
+        ).first()
+        if appointment is None:
+            return Response({"detail": "Appointment not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        # Only the patient and the doctor of the appointment can see its QR code
+        if str(principal.user_id) not in (str(appointment['patient_id']), str(appointment['doctor__user_id'])):
+            return Response({"detail": "Not authorized to view this QR code"}, status=status.HTTP_403_FORBIDDEN)
+
+        if not appointment['qr_code']:
+            return Response({"detail": "This appointment has no QR code"}, status=status.HTTP_404_NOT_FOUND)
+
+        png, digest = get_qr_png(appointment['qr_code'])
+        etag = f'"{digest}"'
+
+        # The payload changes on reschedule/status change, so clients revalidate
+        if etag in request.headers.get('If-None-Match', ''):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(png, content_type='image/png')
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
@@ -1,7 +1,7 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
-import requests
-from django.conf import settings
+
+from .. import supabase_client
 
 from ..models import (
     Profiles,
@@ -19,14 +19,14 @@ class LoginView(APIView):
                 'data': None
             }, status=400)
 
-        response = requests.post(
-            f"{settings.SUPABASE_URL}/auth/v1/token?grant_type=password",
-            headers={
-                'apikey': settings.SUPABASE_KEY,
-                'Content-Type': 'application/json'
-            },
-            json={'email': email, 'password': password}
-        )
+        try:
+            response = supabase_client.sign_in_with_password(email, password)
+        except supabase_client.SupabaseUnavailable:
+            return Response({
+                'success': False,
+                'message': 'Authentication service unavailable, try again later.',
+                'data': None
+            }, status=503)
 
         if response.status_code == 200:
             response_data = response.json()
@@ -79,14 +79,14 @@ class SignUpView(APIView):
         if user_type:
             payload["data"] = {"user_type": user_type}
 
-        response = requests.post(
-            f"{settings.SUPABASE_URL}/auth/v1/signup",
-            headers={
-                "apikey": settings.SUPABASE_KEY,
-                "Content-Type": "application/json"
-            },
-            json=payload
-        )
+        try:
+            response = supabase_client.sign_up(payload)
+        except supabase_client.SupabaseUnavailable:
+            return Response({
+                'success': False,
+                'message': 'Authentication service unavailable, try again later.',
+                'data': None
+            }, status=503)
 
         if response.status_code != 200:
             error_data = response.json()
@@ -11,19 +11,21 @@ from ..models import (
     Appointments
 )
 from ..serializers import DoctorAvailabilitySerializer
-from ..utils import get_user_id_from_token
+from ..authentication import get_principal
 
 class DoctorAvailabilityManagementView(APIView):
     """View for managing doctor availability"""
     
     def get(self, request):
         """Get availability for the logged-in doctor"""
-        doctor_user_id = get_user_id_from_token(request)
-        if not doctor_user_id:
+        principal = get_principal(request)
+        if not principal:
             return Response({"detail": "Unauthorized"}, status=status.HTTP_401_UNAUTHORIZED)
             
         try:
-            doctor_profile = DoctorProfiles.objects.get(user_id=doctor_user_id)
+            doctor_profile = principal.doctor_profile
+            if doctor_profile is None:
+                raise DoctorProfiles.DoesNotExist()
             availability = DoctorAvailability.objects.filter(doctor=doctor_profile)
             
             availability_data = []
@@ -47,12 +49,14 @@ class DoctorAvailabilityManagementView(APIView):
 
     def post(self, request):
         """Create new availability slot for the logged-in doctor"""
-        doctor_user_id = get_user_id_from_token(request)
-        if not doctor_user_id:
+        principal = get_principal(request)
+        if not principal:
             return Response({"detail": "Unauthorized"}, status=status.HTTP_401_UNAUTHORIZED)
 
         try:
-            doctor_profile = DoctorProfiles.objects.get(user_id=doctor_user_id)
+            doctor_profile = principal.doctor_profile
+            if doctor_profile is None:
+                raise DoctorProfiles.DoesNotExist()
             
             # Add doctor_id to the request data
             availability_data = request.data.copy()
@@ -74,12 +78,14 @@ class DoctorAvailabilityManagementView(APIView):
 
     def put(self, request, availability_id):
         """Update an existing availability slot"""
-        doctor_user_id = get_user_id_from_token(request)
-        if not doctor_user_id:
+        principal = get_principal(request)
+        if not principal:
             return Response({"detail": "Unauthorized"}, status=status.HTTP_401_UNAUTHORIZED)
 
         try:
-            doctor_profile = DoctorProfiles.objects.get(user_id=doctor_user_id)
+            doctor_profile = principal.doctor_profile
+            if doctor_profile is None:
+                raise DoctorProfiles.DoesNotExist()
             availability = DoctorAvailability.objects.get(
                 id=availability_id,
                 doctor=doctor_profile
@@ -105,12 +111,14 @@ class DoctorAvailabilityManagementView(APIView):
 
     def delete(self, request, availability_id):
         """Delete an availability slot"""
-        doctor_user_id = get_user_id_from_token(request)
-        if not doctor_user_id:
+        principal = get_principal(request)
+        if not principal:
             return Response({"detail": "Unauthorized"}, status=status.HTTP_401_UNAUTHORIZED)
 
         try:
-            doctor_profile = DoctorProfiles.objects.get(user_id=doctor_user_id)
+            doctor_profile = principal.doctor_profile
+            if doctor_profile is None:
+                raise DoctorProfiles.DoesNotExist()
             availability = DoctorAvailability.objects.get(
                 id=availability_id,
                 doctor=doctor_profile
@@ -1,20 +1,38 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, viewsets
+from rest_framework.exceptions import NotFound
+from ..authentication import get_principal
+from ..geo import bounding_box_filter, haversine_km, parse_point
+from ..pagination import KeysetPagination, decode_cursor, encode_cursor
+from ..response_cache import doctor_cache
+from ..search import search_doctors
+from ..slot_cache import slot_cache
+from ..scheduling import (
+    WEEKDAYS,
+    window_slots,
+    booked_intervals,
+    booked_intervals_by_date,
+    booked_intervals_by_doctor,
+    booked_intervals_by_weekday,
+    from_seconds,
+    iter_free_slots,
+    to_seconds,
+)
 from ..utils import get_user_id_from_token
 from datetime import datetime, timedelta
 from rest_framework.decorators import api_view
 from django.utils import timezone
-from django.db.models import Q
+from django.conf import settings
+from django.db.models import DecimalField, Q, Value
+from django.db.models.functions import Coalesce
 
 
 from ..models import (
     Profiles,
     DoctorProfiles,
     DoctorAvailability,
-    FavoriteDoctors,
-    Appointments
-    
+    FavoriteDoctors
 )
 from ..serializers import (
     DoctorProfileSerializer,
@@ -23,23 +41,77 @@ from ..serializers import (
     DoctorDetailSerializer
 )
 
+import heapq
+import math
 import uuid
+from itertools import islice
+from operator import itemgetter
+
+
+# Columns of DoctorProfiles (and the joined profile) in directory responses
+DIRECTORY_FIELDS = (
+    'id', 'specialty', 'hospital_name', 'hospital_address',
+    'location_lat', 'location_lng', 'average_rating',
+    'user__full_name', 'user__email', 'user__phone_number', 'user__avatar_url'
+)
+
 
+def directory_rows(doctors):
+    """Directory response rows for DoctorProfiles .values(*DIRECTORY_FIELDS) rows"""
+    # Availability of all the doctors in one query
+    available_days = {}
+    for window in DoctorAvailability.objects.filter(
+        doctor_id__in=[doctor['id'] for doctor in doctors],
+        is_available=True
+    ).values('doctor_id', 'day_of_week', 'start_time', 'end_time', 'slot_duration', 'is_available'):
+        available_days.setdefault(window.pop('doctor_id'), []).append(window)
+    
+    # Create custom response data with the requested fields
+    result = []
+    for doctor in doctors:
+        doctor_data = {
+            'id': doctor['id'],
+            'specialty': doctor['specialty'],
+            'hospital_name': doctor['hospital_name'],
+            'hospital_address': doctor['hospital_address'],
+            'location': {
+                'lat': doctor['location_lat'],
+                'lng': doctor['location_lng']
+            },
+            'average_rating': doctor['average_rating'],
+            'profiles': {
+                'full_name': doctor['user__full_name'],
+                'email': doctor['user__email'],
+                'phone_number': doctor['user__phone_number'],
+                'avatar_url': doctor['user__avatar_url']
+            },
+            'availability': available_days.get(doctor['id'], [])
+    
+        }
+        result.append(doctor_data)
+    return result
 
 
 class DoctorProfileView(APIView):
     queryset = DoctorProfiles.objects.all()
     serializer_class = DoctorProfileSerializer
+    # ?near= search
+    default_radius_km = 10.0
+    max_radius_km = 500.0
+    default_limit = 20
 
     def post(self, request):
         """Create a new doctor profile"""
-        user_id = get_user_id_from_token(request)
-        if not user_id:
+        principal = get_principal(request)
+        if not principal:
             return Response({"detail": "Unauthorized"}, status=status.HTTP_401_UNAUTHORIZED)
+        user_id = principal.user_id
 
         try:
             # Get the user profile
-            user = Profiles.objects.get(id=user_id)
+            user = principal.profile
+            if user is None:
+                raise Profiles.DoesNotExist()
             
             # Verify that the user is a doctor
             if user.user_type != Profiles.UserType.DOCTOR:
@@ -47,8 +119,7 @@ class DoctorProfileView(APIView):
                             status=status.HTTP_403_FORBIDDEN)
 
             # Check if doctor profile already exists
-            existing_profile = DoctorProfiles.objects.filter(user_id=user_id).first()
-            if existing_profile:
+            if principal.doctor_profile is not None:
                 return Response({
                     "detail": "Doctor profile already exists for this user"
                 }, status=status.HTTP_400_BAD_REQUEST)
@@ -84,6 +155,10 @@ class DoctorProfileView(APIView):
     def get(self, request):
         """
         Get doctor profiles ordered by average rating with related profile information
+
+        Query params: specialty (optional, case insensitive),
+        near=lat,lng with radius_km and limit to get the closest doctors,
+        ordered by distance, instead of pages ordered by rating
         """
 
         doctor_id = request.query_params.get('id')
@@ -95,45 +170,74 @@ class DoctorProfileView(APIView):
         user_id = get_user_id_from_token(request)
         if not user_id or user_id is None:
             return Response({"detail": "Unauthorized"}, status=status.HTTP_401_UNAUTHORIZED)
-        print("Debug - Inside get_top_doctors method")
-        # Get doctor profiles with related profile data
-        doctor_profiles = DoctorProfiles.objects.select_related('user').all()
-        
-        # Order by average rating in descending order
-        doctor_profiles = doctor_profiles.order_by('-average_rating')
-        
-        # Create custom response data with the requested fields
-        result = []
-        for doctor in doctor_profiles:
 
-            available_days = DoctorAvailability.objects.filter(
-                doctor_id=doctor.id,
-                is_available=True
-            ).values('day_of_week', 'start_time', 'end_time', 'slot_duration', 'is_available')
-            
-            doctor_data = {
-                'id': doctor.id,
-                'specialty': doctor.specialty,
-                'hospital_name': doctor.hospital_name,
-                'hospital_address': doctor.hospital_address,
-                'location': {
-                    'lat': doctor.location_lat,
-                    'lng': doctor.location_lng
-                },
-                'average_rating': doctor.average_rating,
-                'profiles': {
-                    'full_name': doctor.user.full_name if doctor.user else None,
-                    'email': doctor.user.email if doctor.user else None,
-                    'phone_number': doctor.user.phone_number if doctor.user else None,
-                    'avatar_url': doctor.user.avatar_url if doctor.user else None
-                },
-                'availability': list(available_days)  
-        
-            }
-            result.append(doctor_data)
-        
-        return Response(result)
-    
+        near = request.query_params.get('near')
+        if near:
+            try:
+                point = parse_point(near)
+                radius_km = float(request.query_params.get('radius_km', self.default_radius_km))
+                limit = int(request.query_params.get('limit', self.default_limit))
+            except ValueError:
+                return Response(
+                    {"detail": "Invalid near, radius_km or limit. Use near=lat,lng"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if not 0 < radius_km <= self.max_radius_km:
+                return Response(
+                    {"detail": f"radius_km must be between 0 and {self.max_radius_km}"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            limit = max(1, min(limit, settings.PAGINATION_MAX_PAGE_SIZE))
+            build = lambda: self.get_nearby_doctors(request, point, radius_km, limit)
+        else:
+            build = lambda: self.get_directory_page(request)
+
+        # Pages are the same for every caller, cached per URL (query included)
+        data = doctor_cache.get_or_build(request.build_absolute_uri(), ['directory'], build)
+        return Response(data)
+
+    def get_directory_queryset(self, request):
+        """Doctors as .values() rows with the columns of the response"""
+        # Order by average rating in descending order (unrated doctors last)
+        doctor_profiles = DoctorProfiles.objects.annotate(
+            rating=Coalesce('average_rating', Value(0), output_field=DecimalField(max_digits=3, decimal_places=2))
+        )
+
+        specialty = request.query_params.get('specialty')
+        if specialty:
+            doctor_profiles = doctor_profiles.filter(specialty__iexact=specialty)
+
+        # Only the columns of the response, with the profile joined in
+        return doctor_profiles.values(*DIRECTORY_FIELDS, 'rating')
+
+    def get_directory_page(self, request):
+        """Build one page of the doctor directory"""
+        paginator = KeysetPagination(ordering=('-rating', 'id'))
+        doctors = paginator.paginate_queryset(self.get_directory_queryset(request), request)
+        return paginator.get_paginated_response(directory_rows(doctors)).data
+
+    def get_nearby_doctors(self, request, point, radius_km, limit):
+        """
+        Build the list of the `limit` doctors closest to point, within radius_km
+
+        The database only returns the doctors inside the bounding box of the
+        circle (served by doctor_profiles_location_idx), the exact distance
+        is then computed for those.
+        """
+        lat, lng = point
+        candidates = self.get_directory_queryset(request).filter(bounding_box_filter(lat, lng, radius_km))
+
+        nearby = []
+        for doctor in candidates:
+            distance = haversine_km(lat, lng, doctor['location_lat'], doctor['location_lng'])
+            if distance <= radius_km:
+                nearby.append((distance, str(doctor['id']), doctor))
+        nearby = heapq.nsmallest(limit, nearby, key=itemgetter(0, 1))
+
+        result = directory_rows([doctor for _, _, doctor in nearby])
+        for row, (distance, _, _) in zip(result, nearby):
+            row['distance_km'] = round(distance, 3)
+        return {'results': result}
 
     def get_doctor_detail(self, request, doctor_id = None):
         """
@@ -150,41 +254,59 @@ class DoctorProfileView(APIView):
             return Response({"detail": "Unauthorized"}, status=status.HTTP_401_UNAUTHORIZED)
         
         try:
-            doctor = DoctorProfiles.objects.select_related('user').get(id=doctor_id)
-            
-            # Get doctor's availability
-            available_days = DoctorAvailability.objects.filter(
-                doctor_id=doctor.id,
-                is_available=True
-            ).values('day_of_week', 'start_time', 'end_time', 'slot_duration', 'is_available')
-            
-            # Format response data
-            doctor_data = {
-                'id': doctor.id,
-                'specialty': doctor.specialty,
-                'hospital_name': doctor.hospital_name,
-                'hospital_address': doctor.hospital_address,
-                'location': {
-                    'lat': doctor.location_lat,
-                    'lng': doctor.location_lng
-                },
-                'bio': doctor.bio,
-                'years_of_experience': doctor.years_of_experience,
-                'contact_information': doctor.contact_information,
-                'average_rating': doctor.average_rating,
-                'profiles': {
-                    'full_name': doctor.user.full_name if doctor.user else None,
-                    'email': doctor.user.email if doctor.user else None,
-                    'phone_number': doctor.user.phone_number if doctor.user else None,
-                    'avatar_url': doctor.user.avatar_url if doctor.user else None
-                },
-                'availability': list(available_days)
-            }
-            
+            doctor_id = str(uuid.UUID(str(doctor_id)))
+        except ValueError:
+            return Response({"detail": "Doctor not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            doctor_data = doctor_cache.get_or_build(
+                f'detail:{doctor_id}',
+                [f'doctor:{doctor_id}'],
+                lambda: self.get_doctor_detail_data(doctor_id)
+            )
             return Response(doctor_data)
             
         except DoctorProfiles.DoesNotExist:
             return Response({"detail": "Doctor not found"}, status=status.HTTP_404_NOT_FOUND)
+
+
+    def get_doctor_detail_data(self, doctor_id):
+        """
+        Build the detail of a doctor
+
+        Raises:
+            DoctorProfiles.DoesNotExist: No doctor has this id
+        """
+        doctor = DoctorProfiles.objects.select_related('user').get(id=doctor_id)
+        
+        # Get doctor's availability
+        available_days = DoctorAvailability.objects.filter(
+            doctor_id=doctor.id,
+            is_available=True
+        ).values('day_of_week', 'start_time', 'end_time', 'slot_duration', 'is_available')
+        
+        # Format response data
+        return {
+            'id': doctor.id,
+            'specialty': doctor.specialty,
+            'hospital_name': doctor.hospital_name,
+            'hospital_address': doctor.hospital_address,
+            'location': {
+                'lat': doctor.location_lat,
+                'lng': doctor.location_lng
+            },
+            'bio': doctor.bio,
+            'years_of_experience': doctor.years_of_experience,
+            'contact_information': doctor.contact_information,
+            'average_rating': doctor.average_rating,
+            'profiles': {
+                'full_name': doctor.user.full_name if doctor.user else None,
+                'email': doctor.user.email if doctor.user else None,
+                'phone_number': doctor.user.phone_number if doctor.user else None,
+                'avatar_url': doctor.user.avatar_url if doctor.user else None
+            },
+            'availability': list(available_days)
+        }
     
 
     
@@ -221,6 +343,8 @@ class DoctorDetailView(APIView):
 class DoctorAvailabilityViewSet(viewsets.ModelViewSet):
     queryset = DoctorAvailability.objects.all()
     serializer_class = DoctorAvailabilitySerializer
+    pagination_class = KeysetPagination
+    ordering = ('created_at', 'id')
     #permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
@@ -233,6 +357,8 @@ class DoctorAvailabilityViewSet(viewsets.ModelViewSet):
 class FavoriteDoctorViewSet(viewsets.ModelViewSet):
     queryset = FavoriteDoctors.objects.all()
     serializer_class = FavoriteDoctorSerializer
+    pagination_class = KeysetPagination
+    ordering = ('created_at', 'id')
     #permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
@@ -257,6 +383,9 @@ class DoctorAvailabilityView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        if 'date_from' in request.query_params or 'date_to' in request.query_params:
+            return self.get_range(request, doctor_id)
+
         try:
             # Get doctor's general availability
             availability = DoctorAvailability.objects.filter(
@@ -279,58 +408,21 @@ class DoctorAvailabilityView(APIView):
                         status=status.HTTP_400_BAD_REQUEST
                     )
 
-            # Get booked appointments
-            appointments = Appointments.objects.filter(
-                doctor_id=doctor_id,
-                status__in=['scheduled', 'confirmed', 'in_progress']
-            )
-
             if date:
-                appointments = appointments.filter(appointment_date=date)
-            
-            available_slots = []
+                day = date_obj.date()
+                cached, stamp = slot_cache.get_many(doctor_id, [day])
+                available_slots = cached.get(day)
+                if available_slots is None:
+                    available_slots = window_slots(availability, booked_intervals(doctor_id, day))
+                    slot_cache.set_many({day: available_slots}, stamp)
+            else:
+                # Booked intervals of every date, grouped by weekday
+                busy_by_day = booked_intervals_by_weekday(doctor_id)
 
-            for slot in availability:
-                # Rest of the code remains the same
-                current_time = datetime.combine(
-                    datetime.min, 
-                    slot.start_time
-                )
-                end_time = datetime.combine(
-                    datetime.min, 
-                    slot.end_time
-                )
-                
-                while current_time < end_time:
-                    slot_end = current_time + timedelta(minutes=slot.slot_duration)
-                    
-                    # Check if slot overlaps with any appointment
-                    is_available = True
-                    for appt in appointments:
-                        appt_start = datetime.combine(
-                            datetime.min, 
-                            appt.start_time
-                        )
-                        appt_end = datetime.combine(
-                            datetime.min, 
-                            appt.end_time
-                        )
-                        
-                        if (current_time < appt_end and 
-                            slot_end > appt_start and 
-                            slot.day_of_week == appt.appointment_date.strftime('%A').lower()):
-                            is_available = False
-                            break
-                    
-                    if is_available:
-                        available_slots.append({
-                            'day_of_week': slot.day_of_week,
-                            'start_time': current_time.time().strftime('%H:%M'),
-                            'end_time': slot_end.time().strftime('%H:%M'),
-                            'duration': slot.slot_duration
-                        })
-                    
-                    current_time = slot_end
+                available_slots = []
+
+                for slot in availability:
+                    available_slots.extend(window_slots([slot], busy_by_day.get(slot.day_of_week, [])))
 
             return Response({
                 'doctor_id': doctor_id,
@@ -348,4 +440,265 @@ class DoctorAvailabilityView(APIView):
             return Response(
                 {"detail": str(e)}, 
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
\ No newline at end of file
+            )
+
+    def get_range(self, request, doctor_id):
+        """
+        Get available time slots for every date of ?date_from=&date_to=
+
+        The weekly availability windows and the bookings of the whole range
+        are loaded with one query each, then the windows are expanded over
+        the range in Python.
+        """
+        try:
+            date_from = datetime.strptime(request.query_params.get('date_from', ''), '%Y-%m-%d').date()
+            date_to = datetime.strptime(request.query_params.get('date_to', ''), '%Y-%m-%d').date()
+        except ValueError:
+            return Response(
+                {"detail": "date_from and date_to are required. Use YYYY-MM-DD"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if date_to < date_from:
+            return Response(
+                {"detail": "date_to must not be before date_from"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        max_days = settings.AVAILABILITY_MAX_RANGE_DAYS
+        if (date_to - date_from).days + 1 > max_days:
+            return Response(
+                {"detail": f"The range can't be longer than {max_days} days"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            dates = [date_from + timedelta(days=offset) for offset in range((date_to - date_from).days + 1)]
+            slots_by_date, stamp = slot_cache.get_many(doctor_id, dates)
+            missing = [day for day in dates if day not in slots_by_date]
+
+            # Only dates missing from the cache need the database
+            if missing:
+                windows_by_day = {}
+                for window in DoctorAvailability.objects.filter(
+                    doctor_id=doctor_id,
+                    is_available=True
+                ).order_by('start_time'):
+                    windows_by_day.setdefault(window.day_of_week, []).append(window)
+
+                busy_by_date = booked_intervals_by_date(doctor_id, missing[0], missing[-1])
+
+                computed = {
+                    day: window_slots(
+                        windows_by_day.get(WEEKDAYS[day.weekday()], []),
+                        busy_by_date.get(day, [])
+                    )
+                    for day in missing
+                }
+                slot_cache.set_many(computed, stamp)
+                slots_by_date.update(computed)
+
+            days = [
+                {
+                    'date': day,
+                    'day_of_week': WEEKDAYS[day.weekday()],
+                    'available_slots': slots_by_date[day]
+                }
+                for day in dates
+            ]
+
+            return Response({
+                'doctor_id': doctor_id,
+                'date_from': date_from,
+                'date_to': date_to,
+                'days': days
+            })
+
+        except Exception as e:
+            return Response(
+                {"detail": str(e)}, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class EarliestSlotsView(APIView):
+    default_limit = 10
+    max_limit = 100
+    default_days = 14
+    default_radius_km = 10.0
+    max_radius_km = 500.0
+
+    def get(self, request):
+        """
+        Get the earliest free slots across every doctor of a specialty
+
+        Query params: specialty, near=lat,lng and radius_km (optional),
+        limit (number of slots), days (how far ahead to look)
+
+        The availability windows and bookings of all candidate doctors are
+        loaded with one query each. Each doctor's free slots are produced
+        lazily in chronological order and merged with a heap, so only the
+        first `limit` slots are ever computed in full.
+        """
+        specialty = request.query_params.get('specialty')
+        if not specialty:
+            return Response({"detail": "Specialty is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            limit = int(request.query_params.get('limit', self.default_limit))
+            days = int(request.query_params.get('days', self.default_days))
+            near = request.query_params.get('near')
+            point = parse_point(near) if near else None
+            radius_km = float(request.query_params.get('radius_km', self.default_radius_km))
+        except ValueError:
+            return Response(
+                {"detail": "Invalid limit, days, near or radius_km"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        # Like DoctorProfileView's ?near=, bounds the doctors scanned
+        if not 0 < radius_km <= self.max_radius_km:
+            return Response(
+                {"detail": f"radius_km must be between 0 and {self.max_radius_km}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        limit = max(1, min(limit, self.max_limit))
+        days = max(1, min(days, settings.AVAILABILITY_MAX_RANGE_DAYS))
+
+        try:
+            now = timezone.localtime()
+            date_from = now.date()
+            date_to = date_from + timedelta(days=days - 1)
+
+            doctors = DoctorProfiles.objects.filter(specialty__iexact=specialty)
+            if point:
+                doctors = doctors.filter(bounding_box_filter(point[0], point[1], radius_km))
+
+            candidates = {}
+            for doctor in doctors.values(
+                'id', 'specialty', 'hospital_name', 'location_lat', 'location_lng', 'user__full_name'
+            ):
+                doctor['distance_km'] = None
+                if point:
+                    # The bounding box is wider than the circle
+                    doctor['distance_km'] = haversine_km(
+                        point[0], point[1], doctor['location_lat'], doctor['location_lng']
+                    )
+                    if doctor['distance_km'] > radius_km:
+                        continue
+                candidates[doctor['id']] = doctor
+
+            windows = {}
+            for window in DoctorAvailability.objects.filter(
+                doctor_id__in=list(candidates),
+                is_available=True
+            ):
+                windows.setdefault(window.doctor_id, {}).setdefault(window.day_of_week, []).append(window)
+
+            busy = booked_intervals_by_doctor(list(windows), date_from, date_to)
+
+            def tagged(doctor_id, slots):
+                for day, start, end, duration in slots:
+                    yield day, start, end, duration, doctor_id
+
+            merged = heapq.merge(
+                *(
+                    tagged(doctor_id, iter_free_slots(
+                        windows_by_day, busy.get(doctor_id, {}), date_from, date_to,
+                        not_before=(date_from, to_seconds(now.time()))
+                    ))
+                    for doctor_id, windows_by_day in windows.items()
+                ),
+                key=itemgetter(0, 1)
+            )
+
+            results = []
+            for day, start, end, duration, doctor_id in islice(merged, limit):
+                doctor = candidates[doctor_id]
+                results.append({
+                    'doctor_id': str(doctor_id),
+                    'full_name': doctor['user__full_name'],
+                    'specialty': doctor['specialty'],
+                    'hospital_name': doctor['hospital_name'],
+                    'distance_km': round(doctor['distance_km'], 2) if doctor['distance_km'] is not None else None,
+                    'date': day,
+                    'day_of_week': WEEKDAYS[day.weekday()],
+                    'start_time': from_seconds(start).strftime('%H:%M'),
+                    'end_time': from_seconds(end).strftime('%H:%M'),
+                    'duration': duration
+                })
+
+            return Response({
+                'specialty': specialty,
+                'date_from': date_from,
+                'date_to': date_to,
+                'results': results
+            })
+
+        except Exception as e:
+            return Response(
+                {"detail": str(e)}, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class DoctorSearchView(APIView):
+    def get(self, request):
+        """
+        Search doctors by name, specialty, hospital or bio
+
+        Query params: q, page_size, cursor. Results are ordered by relevance,
+        each with its score.
+        """
+        user_id = get_user_id_from_token(request)
+        if not user_id:
+            return Response({"detail": "Unauthorized"}, status=status.HTTP_401_UNAUTHORIZED)
+
+        text = request.query_params.get('q', '').strip()
+        if not text:
+            return Response({"detail": "Search query (q) is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        data = doctor_cache.get_or_build(
+            request.build_absolute_uri(),
+            ['directory'],
+            lambda: self.get_results_page(request, text)
+        )
+        return Response(data)
+
+    def get_results_page(self, request, text):
+        """Build one page of search results"""
+        paginator = KeysetPagination()
+        paginator.request = request
+        page_size = paginator.get_page_size(request)
+
+        after = None
+        cursor = request.query_params.get(paginator.cursor_query_param)
+        if cursor:
+            try:
+                score, doctor_id = decode_cursor(cursor)
+                # JSON also decodes NaN, Infinity and ids of any type
+                if isinstance(score, bool) or not isinstance(score, (int, float)) or not math.isfinite(score):
+                    raise ValueError('Invalid cursor')
+                if not isinstance(doctor_id, str):
+                    raise ValueError('Invalid cursor')
+                after = (float(score), str(uuid.UUID(doctor_id)))
+            except (TypeError, ValueError):
+                raise NotFound('Invalid cursor')
+
+        # One extra match tells whether there is a next page
+        matches = search_doctors(text, page_size + 1, after)
+        has_next = len(matches) > page_size
+        matches = matches[:page_size]
+
+        doctors = {
+            doctor['id']: doctor
+            for doctor in DoctorProfiles.objects.filter(
+                id__in=[doctor_id for doctor_id, _ in matches]
+            ).values(*DIRECTORY_FIELDS)
+        }
+        found = [(doctors[doctor_id], score) for doctor_id, score in matches if doctor_id in doctors]
+        result = directory_rows([doctor for doctor, _ in found])
+        for row, (_, score) in zip(result, found):
+            row['score'] = round(score, 4)
+
+        last_id, last_score = matches[-1] if matches else (None, None)
+        paginator.next_cursor = encode_cursor([last_score, str(last_id)]) if has_next else None
+        return paginator.get_paginated_response(result).data
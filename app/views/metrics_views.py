@@ -0,0 +1,28 @@
+import hmac
+
+from django.conf import settings
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework import status
+from rest_framework.permissions import BasePermission, IsAuthenticated
+
+from .. import metrics
+
+
+class HasMetricsToken(BasePermission):
+    """The X-Metrics-Token header matches METRICS_TOKEN, or a signed-in user when it is unset"""
+
+    def has_permission(self, request, view):
+        if not settings.METRICS_TOKEN:
+            return IsAuthenticated().has_permission(request, view)
+        supplied = request.headers.get('X-Metrics-Token', '')
+        return hmac.compare_digest(supplied.encode(), settings.METRICS_TOKEN.encode())
+
+
+class MetricsView(APIView):
+    """Process-local counters (token cache, upstream calls, ...)"""
+    permission_classes = [HasMetricsToken]
+
+    def get(self, request):
+        """Get a snapshot of every registered metric for this worker"""
+        return Response(metrics.snapshot(), status=status.HTTP_200_OK)
@@ -7,10 +7,14 @@ from ..models import (
 from ..serializers import (
     NotificationSerializer,
 )
+from ..pagination import KeysetPagination
 
 class NotificationViewSet(viewsets.ModelViewSet):
     queryset = Notifications.objects.all()
     serializer_class = NotificationSerializer
+    pagination_class = KeysetPagination
+    # Newest first
+    ordering = ('-created_at', '-id')
     #permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
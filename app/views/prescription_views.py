@@ -4,20 +4,28 @@ from rest_framework.decorators import action
 from datetime import datetime
 import uuid
 from rest_framework.views import APIView
+from django.conf import settings
 
 
 from ..models import (
     Prescriptions,
-    Profiles,
     DoctorProfiles,
     Appointments
 )
 from ..serializers import PrescriptionSerializer
+from ..authentication import get_principal
+from ..pagination import KeysetPagination
 from ..utils import get_user_id_from_token
+from ..prescription_sync import sync_prescriptions
+from ..prescription_filters import filter_prescriptions
+from rest_framework.exceptions import ValidationError
 
 class PrescriptionViewSet(viewsets.ModelViewSet):
     queryset = Prescriptions.objects.all()
     serializer_class = PrescriptionSerializer
+    pagination_class = KeysetPagination
+    # Newest first
+    ordering = ('-created_at', '-id')
 
     def get_queryset(self):
         """Filter prescriptions based on query parameters"""
@@ -32,20 +40,28 @@ class PrescriptionViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(doctor_id=doctor_id)
         if appointment_id:
             queryset = queryset.filter(appointment_id=appointment_id)
+        # ?medication=, ?details_contains=, ?details_has_key=, ?date_from=, ?date_to=
+        queryset = filter_prescriptions(queryset, self.request.query_params)
+
+        # The ownership check reads the doctor's user id
+        if self.action in ('update', 'destroy'):
+            queryset = queryset.select_related('doctor')
 
         return queryset
 
     def create(self, request):
         """Create a new prescription"""
-        user_id = get_user_id_from_token(request)
-        if not user_id:
+        principal = get_principal(request)
+        if not principal:
             return Response({"detail": "Unauthorized"}, status=status.HTTP_401_UNAUTHORIZED)
 
         try:
             # Get the doctor profile
-            doctor = DoctorProfiles.objects.get(user_id=user_id)
+            doctor = principal.doctor_profile
+            if doctor is None:
+                raise DoctorProfiles.DoesNotExist()
 
-            if doctor.user.user_type != Profiles.UserType.DOCTOR:
+            if not principal.is_doctor:
                 return Response({"detail": "Only doctors can create prescriptions"}, 
                             status=status.HTTP_403_FORBIDDEN)
             
@@ -59,20 +75,19 @@ class PrescriptionViewSet(viewsets.ModelViewSet):
                     appointment = Appointments.objects.get(id=appointment_id)
                     
                     # Check if appointment already has a prescription
-                    existing_prescription = Prescriptions.objects.filter(appointment_id=appointment_id).first()
-                    if existing_prescription:
+                    if Prescriptions.objects.filter(appointment_id=appointment_id).exists():
                         return Response(
                             {"detail": "This appointment already has a prescription"}, 
                             status=status.HTTP_400_BAD_REQUEST
                         )
 
                     # Verify that the doctor creating the prescription is the same as in appointment
-                    if str(appointment.doctor.id) != str(doctor.id):
+                    if str(appointment.doctor_id) != str(doctor.id):
                         return Response({"detail": "You can only create prescriptions for your own appointments"}, 
                                     status=status.HTTP_403_FORBIDDEN)
                     
                     # Verify that the patient in the request matches the appointment
-                    if str(appointment.patient.id) != str(patient_id):
+                    if str(appointment.patient_id) != str(patient_id):
                         return Response({"detail": "Patient ID does not match the appointment"}, 
                                     status=status.HTTP_400_BAD_REQUEST)
                 except Appointments.DoesNotExist:
@@ -115,7 +130,7 @@ class PrescriptionViewSet(viewsets.ModelViewSet):
             user_id = get_user_id_from_token(request)
 
             # Verify ownership
-            if str(prescription.doctor.user.id) != str(user_id):
+            if str(prescription.doctor.user_id) != str(user_id):
                 return Response({"detail": "Not authorized to update this prescription"}, 
                               status=status.HTTP_403_FORBIDDEN)
 
@@ -140,7 +155,7 @@ class PrescriptionViewSet(viewsets.ModelViewSet):
             user_id = get_user_id_from_token(request)
 
             # Verify ownership
-            if str(prescription.doctor.user.id) != str(user_id):
+            if str(prescription.doctor.user_id) != str(user_id):
                 return Response({"detail": "Not authorized to delete this prescription"}, 
                               status=status.HTTP_403_FORBIDDEN)
 
@@ -151,6 +166,45 @@ class PrescriptionViewSet(viewsets.ModelViewSet):
             return Response({"detail": str(e)}, 
                           status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @action(detail=False, methods=['post'])
+    def sync(self, request):
+        """
+        Create or update prescriptions written offline, keyed by local_id
+
+        Takes {"prescriptions": [...]} or a plain list. Items are checked one
+        by one, the valid ones are saved and the others reported, so the
+        whole batch can be sent again until every item is saved.
+        """
+        principal = get_principal(request)
+        if not principal:
+            return Response({"detail": "Unauthorized"}, status=status.HTTP_401_UNAUTHORIZED)
+        if not principal.is_doctor:
+            return Response({"detail": "Only doctors can create prescriptions"},
+                        status=status.HTTP_403_FORBIDDEN)
+        doctor = principal.doctor_profile
+        if doctor is None:
+            return Response({"detail": "Doctor profile not found"},
+                        status=status.HTTP_404_NOT_FOUND)
+
+        items = request.data.get('prescriptions') if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list):
+            return Response({"detail": "A list of prescriptions is required"},
+                        status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > settings.PRESCRIPTION_SYNC_MAX_BATCH:
+            return Response({"detail": f"At most {settings.PRESCRIPTION_SYNC_MAX_BATCH} prescriptions per batch"},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            results = sync_prescriptions(doctor, items)
+        except Exception as e:
+            return Response({"detail": str(e)},
+                        status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        counts = {'created': 0, 'updated': 0, 'error': 0}
+        for result in results:
+            counts[result['status']] += 1
+        return Response({**counts, 'results': results}, status=status.HTTP_200_OK)
+
     @action(detail=False, methods=['get'])
     def patient_prescriptions(self, request):
         """Get prescriptions for a specific patient"""
@@ -166,7 +220,7 @@ class PrescriptionViewSet(viewsets.ModelViewSet):
         
         # Format the response with doctor and patient information
         prescriptions_data = []
-        for prescription in prescriptions:
+        for prescription in self.paginate_queryset(prescriptions):
             prescription_data = {
                 'id': prescription.id,
                 'doctor': {
@@ -195,7 +249,7 @@ class PrescriptionViewSet(viewsets.ModelViewSet):
             }
             prescriptions_data.append(prescription_data)
         
-        return Response(prescriptions_data, status=status.HTTP_200_OK)
+        return self.get_paginated_response(prescriptions_data)
 
 
     @action(detail=False, methods=['get'])
@@ -207,25 +261,26 @@ class PrescriptionViewSet(viewsets.ModelViewSet):
                           status=status.HTTP_400_BAD_REQUEST)
 
         prescriptions = self.get_queryset().filter(doctor_id=doctor_id)
-        serializer = self.serializer_class(prescriptions, many=True)
-        return Response(serializer.data)
+        serializer = self.serializer_class(self.paginate_queryset(prescriptions), many=True)
+        return self.get_paginated_response(serializer.data)
     
 class DoctorPrescriptionsView(APIView):
     """View for managing a doctor's prescriptions"""
     
     def get(self, request):
         """Get all prescriptions created by the logged-in doctor"""
-        # Get doctor's user ID from token
-        doctor_user_id = get_user_id_from_token(request)
-        if not doctor_user_id:
+        principal = get_principal(request)
+        if not principal:
             return Response({"detail": "Unauthorized"}, status=status.HTTP_401_UNAUTHORIZED)
         
         try:
-            # Get the doctor profile using the user ID from token
-            doctor_profile = DoctorProfiles.objects.get(user_id=doctor_user_id)
+            # Get the doctor profile of the caller
+            doctor_profile = principal.doctor_profile
+            if doctor_profile is None:
+                raise DoctorProfiles.DoesNotExist()
             
             # Verify the user is a doctor
-            if doctor_profile.user.user_type != Profiles.UserType.DOCTOR:
+            if not principal.is_doctor:
                 return Response({"detail": "Only doctors can access their prescriptions"}, 
                              status=status.HTTP_403_FORBIDDEN)
             
@@ -233,10 +288,13 @@ class DoctorPrescriptionsView(APIView):
             prescriptions = Prescriptions.objects.filter(
                 doctor=doctor_profile
             ).select_related('patient', 'appointment')
+            # e.g. ?medication=Amoxicillin&date_from=2026-10-01
+            prescriptions = filter_prescriptions(prescriptions, request.query_params)
+            paginator = KeysetPagination(ordering=PrescriptionViewSet.ordering)
             
             # Format the response with required information
             prescriptions_data = []
-            for prescription in prescriptions:
+            for prescription in paginator.paginate_queryset(prescriptions, request, view=self):
                 prescription_data = {
                     'id': prescription.id,
                     'patient': {
@@ -254,9 +312,11 @@ class DoctorPrescriptionsView(APIView):
                 }
                 prescriptions_data.append(prescription_data)
             
-            return Response(prescriptions_data, status=status.HTTP_200_OK)
+            return paginator.get_paginated_response(prescriptions_data)
             
         except DoctorProfiles.DoesNotExist:
             return Response({"detail": "Doctor profile not found"}, status=status.HTTP_404_NOT_FOUND)
+        except ValidationError as e:
+            return Response(e.detail, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response({"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
@@ -2,7 +2,8 @@ from rest_framework import viewsets
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from ..utils import get_user_id_from_token
+from ..authentication import get_principal
+from ..pagination import KeysetPagination
 
 from ..models import (
     Profiles,
@@ -15,17 +16,18 @@ from ..serializers import (
 class ProfileViewSet(viewsets.ModelViewSet):
     queryset = Profiles.objects.all()
     serializer_class = ProfileSerializer
+    pagination_class = KeysetPagination
+    ordering = ('created_at', 'id')
     #permission_classes = [IsAuthenticated]
 
 
 class ProfileUpdateView(APIView):
     def patch(self, request):
-        user_id = get_user_id_from_token(request)
-        if not user_id:
+        principal = get_principal(request)
+        if not principal:
             return Response({"detail": "Unauthorized"}, status=status.HTTP_401_UNAUTHORIZED)  
-        try:
-            profile = Profiles.objects.get(id=user_id)
-        except Profiles.DoesNotExist:
+        profile = principal.profile
+        if profile is None:
             return Response({"detail": "Profile not found"}, status=status.HTTP_404_NOT_FOUND)
         
         serializer = ProfileSerializer(profile, data=request.data, partial=True)
@@ -35,16 +37,15 @@ class ProfileUpdateView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
     def get(self, request):
-        user_id = get_user_id_from_token(request)
-        if not user_id:
+        principal = get_principal(request)
+        if not principal:
             return Response({
                 'success': False,
                 'message': 'Invalid Token.',
                 'data': None
             }, status=401)
-        try:
-            profile = Profiles.objects.get(id=user_id)
-        except Profiles.DoesNotExist:
+        profile = principal.profile
+        if profile is None:
             return Response({
                 'success': False,
                 'message': 'Profile not found.',
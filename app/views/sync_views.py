@@ -0,0 +1,80 @@
+from django.conf import settings
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework import status
+
+from ..authentication import get_principal
+from ..serializers import (
+    AppointmentSerializer,
+    DoctorAvailabilitySerializer,
+    NotificationSerializer,
+    PrescriptionSerializer,
+)
+from ..sync import changes_since, cursor_expired, encode_sync_cursor, parse_sync_cursor
+
+SERIALIZERS = {
+    'appointments': AppointmentSerializer,
+    'prescriptions': PrescriptionSerializer,
+    'notifications': NotificationSerializer,
+    'availability': DoctorAvailabilitySerializer,
+}
+
+
+class SyncChangesView(APIView):
+    """Changes of the caller's appointments, prescriptions and notifications"""
+
+    def get(self, request):
+        """
+        Get what changed since the last sync
+
+        Query params: cursor (next_cursor of the previous sync, none for a
+        first full sync), limit (most rows per entity)
+
+        Returns the rows created or updated since the cursor for each entity,
+        the deleted rows under 'deleted', and the cursor of the next sync.
+        While has_more is true the client should call again right away.
+        Notifications are only sent when created, not when marked read.
+
+        A cursor last caught up more than SYNC_TOMBSTONE_RETENTION_DAYS ago
+        gets 410: deletions it hasn't seen may be forgotten, so the client
+        must drop its copy and sync again without a cursor.
+        """
+        principal = get_principal(request)
+        if not principal:
+            return Response({"detail": "Unauthorized"}, status=status.HTTP_401_UNAUTHORIZED)
+
+        try:
+            cursor = request.query_params.get('cursor')
+            positions, synced_at = parse_sync_cursor(cursor)
+            limit = int(request.query_params.get('limit', settings.PAGINATION_PAGE_SIZE))
+        except ValueError:
+            return Response({"detail": "Invalid cursor or limit"}, status=status.HTTP_400_BAD_REQUEST)
+        limit = max(1, min(limit, settings.PAGINATION_MAX_PAGE_SIZE))
+        if cursor and cursor_expired(synced_at):
+            return Response(
+                {"detail": "Cursor expired, sync again without a cursor"},
+                status=status.HTTP_410_GONE
+            )
+
+        try:
+            changes, positions, has_more, synced_at = changes_since(principal, positions, limit, synced_at)
+
+            data = {}
+            context = {'request': request, 'omit_fields': ['qr_code']}
+            for entity, serializer_class in SERIALIZERS.items():
+                if entity in changes:
+                    data[entity] = serializer_class(changes[entity], many=True, context=context).data
+            data['deleted'] = [
+                {
+                    'entity': tombstone.entity,
+                    'id': tombstone.object_id,
+                    'deleted_at': tombstone.deleted_at,
+                }
+                for tombstone in changes['deleted']
+            ]
+            data['next_cursor'] = encode_sync_cursor(positions, synced_at)
+            data['has_more'] = has_more
+            return Response(data, status=status.HTTP_200_OK)
+
+        except Exception as e:
+            return Response({"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -10,12 +10,108 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import sys
 from pathlib import Path
 
 from decouple import config
 
-SUPABASE_URL = config('SUPABASE_URL')
-SUPABASE_KEY = config('SUPABASE_KEY')
+# `manage.py test` runs against a local database and never calls Supabase
+TESTING = sys.argv[1:2] == ['test']
+
+SUPABASE_URL = config('SUPABASE_URL', default='http://127.0.0.1:54321') if TESTING else config('SUPABASE_URL')
+SUPABASE_KEY = config('SUPABASE_KEY', default='test-key') if TESTING else config('SUPABASE_KEY')
+
+# Token verification: 'local' checks the JWT with PyJWT (project secret for
+# HS256 tokens, JWKS for asymmetric ones) and only asks Supabase when no local
+# key matches; 'remote' sends every token to Supabase /auth/v1/user
+SUPABASE_AUTH_MODE = config('SUPABASE_AUTH_MODE', default='local')
+SUPABASE_JWT_SECRET = config('SUPABASE_JWT_SECRET', default='')
+SUPABASE_JWT_AUDIENCE = config('SUPABASE_JWT_AUDIENCE', default='authenticated')
+SUPABASE_JWT_LEEWAY = config('SUPABASE_JWT_LEEWAY', default=0, cast=int)
+SUPABASE_JWKS_URL = config('SUPABASE_JWKS_URL', default=f'{SUPABASE_URL}/auth/v1/.well-known/jwks.json')
+SUPABASE_JWKS_CACHE_SECONDS = config('SUPABASE_JWKS_CACHE_SECONDS', default=300, cast=int)
+
+# Verified-token cache: entries expire at the token's `exp` or after
+# AUTH_TOKEN_CACHE_TTL seconds, whichever comes first. Set
+# AUTH_TOKEN_SHARED_CACHE to a CACHES alias to share entries between workers
+AUTH_TOKEN_CACHE_MAX_ENTRIES = config('AUTH_TOKEN_CACHE_MAX_ENTRIES', default=10000, cast=int)
+AUTH_TOKEN_CACHE_TTL = config('AUTH_TOKEN_CACHE_TTL', default=300, cast=int)
+AUTH_TOKEN_NEGATIVE_CACHE_MAX_ENTRIES = config('AUTH_TOKEN_NEGATIVE_CACHE_MAX_ENTRIES', default=1024, cast=int)
+AUTH_TOKEN_NEGATIVE_CACHE_TTL = config('AUTH_TOKEN_NEGATIVE_CACHE_TTL', default=30, cast=int)
+AUTH_TOKEN_SHARED_CACHE = config('AUTH_TOKEN_SHARED_CACHE', default='')
+# /api/metrics/ asks for this value in the X-Metrics-Token header when set,
+# and for any signed-in user otherwise
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+# Pooled HTTP client used for every Supabase call (timeouts in seconds).
+# Only idempotent calls are retried
+SUPABASE_HTTP_POOL_CONNECTIONS = config('SUPABASE_HTTP_POOL_CONNECTIONS', default=4, cast=int)
+SUPABASE_HTTP_POOL_MAXSIZE = config('SUPABASE_HTTP_POOL_MAXSIZE', default=20, cast=int)
+SUPABASE_HTTP_CONNECT_TIMEOUT = config('SUPABASE_HTTP_CONNECT_TIMEOUT', default=3.05, cast=float)
+SUPABASE_HTTP_READ_TIMEOUT = config('SUPABASE_HTTP_READ_TIMEOUT', default=10, cast=float)
+SUPABASE_HTTP_RETRIES = config('SUPABASE_HTTP_RETRIES', default=2, cast=int)
+SUPABASE_HTTP_BACKOFF_BASE = config('SUPABASE_HTTP_BACKOFF_BASE', default=0.1, cast=float)
+SUPABASE_HTTP_BACKOFF_MAX = config('SUPABASE_HTTP_BACKOFF_MAX', default=1.0, cast=float)
+# Total time budget for one Supabase call, retries included
+SUPABASE_HTTP_DEADLINE = config('SUPABASE_HTTP_DEADLINE', default=5, cast=float)
+
+# Circuit breaker around Supabase: open after N consecutive failures, try
+# again (half-open) after the recovery timeout in seconds
+SUPABASE_BREAKER_FAILURE_THRESHOLD = config('SUPABASE_BREAKER_FAILURE_THRESHOLD', default=5, cast=int)
+SUPABASE_BREAKER_RECOVERY_TIMEOUT = config('SUPABASE_BREAKER_RECOVERY_TIMEOUT', default=30, cast=float)
+SUPABASE_BREAKER_HALF_OPEN_MAX_CALLS = config('SUPABASE_BREAKER_HALF_OPEN_MAX_CALLS', default=1, cast=int)
+
+# Rendered appointment QR codes, cached by payload hash. Set QR_CACHE_DIR to
+# also keep the PNGs on disk across restarts
+QR_CACHE_MAX_ENTRIES = config('QR_CACHE_MAX_ENTRIES', default=512, cast=int)
+QR_CACHE_DIR = config('QR_CACHE_DIR', default='')
+
+# Keyset pagination of list endpoints (?page_size= is capped at the max)
+PAGINATION_PAGE_SIZE = config('PAGINATION_PAGE_SIZE', default=50, cast=int)
+PAGINATION_MAX_PAGE_SIZE = config('PAGINATION_MAX_PAGE_SIZE', default=200, cast=int)
+# Rows fetched per query by streamed exports, paged by keyset so it works
+# behind transaction-mode poolers without server-side cursors
+EXPORT_CHUNK_SIZE = config('EXPORT_CHUNK_SIZE', default=2000, cast=int)
+# Longest ?date_from=&date_to= range of DoctorAvailabilityView, in days
+AVAILABILITY_MAX_RANGE_DAYS = config('AVAILABILITY_MAX_RANGE_DAYS', default=62, cast=int)
+# Computed free slots per (doctor, date), invalidated when appointments or
+# availability change. Invalidations only reach the workers sharing the
+# cache, so with a per-process cache the TTL is how stale other workers get
+SLOT_CACHE_ALIAS = config('SLOT_CACHE_ALIAS', default='default')
+SLOT_CACHE_TTL = config('SLOT_CACHE_TTL', default=300, cast=int)
+# Cached doctor directory and detail responses (app.response_cache). Entries
+# are fresh for FRESH_TTL seconds, then served stale for up to STALE_TTL
+# more while one request rebuilds them
+RESPONSE_CACHE_ALIAS = config('RESPONSE_CACHE_ALIAS', default='default')
+RESPONSE_CACHE_FRESH_TTL = config('RESPONSE_CACHE_FRESH_TTL', default=60, cast=int)
+RESPONSE_CACHE_STALE_TTL = config('RESPONSE_CACHE_STALE_TTL', default=300, cast=int)
+RESPONSE_CACHE_LOCK_TIMEOUT = config('RESPONSE_CACHE_LOCK_TIMEOUT', default=10, cast=int)
+# Most prescriptions accepted by one POST /api/prescriptions/sync/
+PRESCRIPTION_SYNC_MAX_BATCH = config('PRESCRIPTION_SYNC_MAX_BATCH', default=500, cast=int)
+# Rows changed in the last few seconds are left out of /api/sync/changes/
+# until transactions that could still commit older timestamps are done
+SYNC_SETTLE_SECONDS = config('SYNC_SETTLE_SECONDS', default=5, cast=int)
+# Days deletions stay in the sync feed (manage.py prune_sync_tombstones);
+# clients that haven't synced for longer must sync again from scratch
+SYNC_TOMBSTONE_RETENTION_DAYS = config('SYNC_TOMBSTONE_RETENTION_DAYS', default=30, cast=int)
+# Server-rendered prescription PDFs (app.prescription_pdf), stored by content
+# hash on the storage alias below (see STORAGES). Set PRESCRIPTION_PDF_FONT
+# to a TTF file for scripts the bundled Pillow font doesn't cover
+PRESCRIPTION_PDF_STORAGE = config('PRESCRIPTION_PDF_STORAGE', default='default')
+PRESCRIPTION_PDF_FONT = config('PRESCRIPTION_PDF_FONT', default='')
+# Background tasks (app.tasks), run by `manage.py run_tasks`. TASKS_SYNC=true
+# runs them in process after commit instead, 'auto' does so without Postgres
+TASKS_SYNC = config(
+    'TASKS_SYNC', default='auto',
+    cast=lambda value: None if value == 'auto' else value.lower() in ('1', 'true', 'yes', 'on')
+)
+TASKS_MAX_ATTEMPTS = config('TASKS_MAX_ATTEMPTS', default=5, cast=int)
+TASKS_RETRY_BASE_SECONDS = config('TASKS_RETRY_BASE_SECONDS', default=10, cast=int)
+TASKS_RETRY_MAX_SECONDS = config('TASKS_RETRY_MAX_SECONDS', default=3600, cast=int)
+# A task running longer than this is assumed lost and run again
+TASKS_LEASE_SECONDS = config('TASKS_LEASE_SECONDS', default=300, cast=int)
+TASKS_WORKER_CONCURRENCY = config('TASKS_WORKER_CONCURRENCY', default=4, cast=int)
+TASKS_POLL_INTERVAL = config('TASKS_POLL_INTERVAL', default=1.0, cast=float)
 
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -61,6 +157,14 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+REST_FRAMEWORK = {
+    # Resolves request.user to an app.authentication.Principal; views decide
+    # themselves whether they need one (see app.authentication.get_principal)
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'app.authentication.SupabaseAuthentication',
+    ],
+}
+
 ROOT_URLCONF = 'docktorek_backend.urls'
 
 TEMPLATES = [
@@ -101,6 +205,46 @@ DATABASES = {
     }
 }
 
+if TESTING:
+    # SQLite by default. Set TEST_POSTGRES_HOST to run the tests (and the
+    # benchmarks in app.benchmarks) on a local Postgres server instead
+    if config('TEST_POSTGRES_HOST', default=''):
+        DATABASES = {
+            'default': {
+                'ENGINE': 'django.db.backends.postgresql',
+                'NAME': config('TEST_POSTGRES_NAME', default='postgres'),
+                'USER': config('TEST_POSTGRES_USER', default='postgres'),
+                'PASSWORD': config('TEST_POSTGRES_PASSWORD', default=''),
+                'HOST': config('TEST_POSTGRES_HOST'),
+                'PORT': config('TEST_POSTGRES_PORT', default='5432'),
+            }
+        }
+    else:
+        DATABASES = {
+            'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': BASE_DIR / 'test.sqlite3',
+                # A file, so threads of the concurrency tests share it, and
+                # IMMEDIATE transactions so SQLite serializes writers
+                'TEST': {'NAME': BASE_DIR / 'test.sqlite3'},
+                'OPTIONS': {'transaction_mode': 'IMMEDIATE', 'timeout': 30},
+            }
+        }
+
+# Creates the unmanaged Supabase tables in the test database
+TEST_RUNNER = 'app.testing.TestRunner'
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='docktorek'),
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -138,6 +282,11 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Uploaded and generated files (prescription PDFs), on the local filesystem
+# unless STORAGES says otherwise
+MEDIA_URL = config('MEDIA_URL', default='/media/')
+MEDIA_ROOT = config('MEDIA_ROOT', default=str(BASE_DIR / 'media'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -16,6 +16,8 @@ Including another URLconf
 """
 
 from app.views import *
+from django.conf import settings
+from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
@@ -31,9 +33,14 @@ from app.views import (
     SignUpView,
     PrescriptionViewSet,
     DoctorAvailabilityView,
+    EarliestSlotsView,
+    DoctorSearchView,
     AppointmentsView,
+    AppointmentQRCodeView,
     DoctorPrescriptionsView,
-    DoctorAvailabilityManagementView
+    DoctorAvailabilityManagementView,
+    MetricsView,
+    SyncChangesView
     
 )
 
@@ -54,6 +61,8 @@ urlpatterns = [
     path('api/', include(router.urls)),
     path('api/profile/', ProfileUpdateView.as_view(), name='my-profile-update'),
     path('api/doctors/', DoctorProfileView.as_view(), name='doctor-profiles'),
+    path('api/doctors/search/', DoctorSearchView.as_view(), name='doctor-search'),
+    path('api/doctors/earliest-slots/', EarliestSlotsView.as_view(), name='doctor-earliest-slots'),
     path('api/doctors/<uuid:doctor_id>/', DoctorProfileView.as_view(), name='doctor-detail'),
     path('api/login/', LoginView.as_view(), name='login'),
     path('api/signup/', SignUpView.as_view(), name='signup'),
@@ -63,6 +72,12 @@ urlpatterns = [
     path('api/doctor/prescriptions/', DoctorPrescriptionsView.as_view(), name='doctor-prescriptions'),
     path('api/doctor/availability/', DoctorAvailabilityManagementView.as_view(), name='doctor-availability-management'),
     path('api/doctor/availability/<uuid:availability_id>/', DoctorAvailabilityManagementView.as_view(), name='doctor-availability-detail'),
+    path('api/appointments/<uuid:appointment_id>/qr.png', AppointmentQRCodeView.as_view(), name='appointment-qr'),
+    path('api/metrics/', MetricsView.as_view(), name='metrics'),
+    path('api/sync/changes/', SyncChangesView.as_view(), name='sync-changes'),
 
 ]
 
+# Generated prescription PDFs, served by the web server in production
+urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+